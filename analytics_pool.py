@@ -0,0 +1,212 @@
+import multiprocessing as mp
+import os
+import sys
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy import stats
+
+# CPU-heavy analyses run here instead of on the Streamlit script thread. The
+# pool is bounded and shared by every session of the process; inputs are
+# handed over in shared memory rather than pickled per task.
+ANALYTICS_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+# How long a page waits for an analysis, and how long after that for the
+# worker to stop and return what it has so far
+DEFAULT_TIMEOUT = 5.0
+PARTIAL_GRACE = 0.5
+
+# Iterative tasks check for cancellation every this many iterations
+CHECK_EVERY = 50
+
+
+class SharedArrays:
+    """Arrays copied once into a shared memory block, plus a cancel flag in byte 0"""
+
+    def __init__(self, arrays):
+        arrays = {key: np.ascontiguousarray(value) for key, value in arrays.items()}
+        self.layout = []
+        offset = 8
+        for key, array in arrays.items():
+            self.layout.append((key, array.shape, array.dtype.str, offset))
+            # Keep every array 8-byte aligned
+            offset += (array.nbytes + 7) // 8 * 8
+        self.shm = shared_memory.SharedMemory(create=True, size=offset)
+        self.shm.buf[0] = 0
+        for (key, shape, dtype, start), array in zip(self.layout, arrays.values()):
+            np.ndarray(shape, dtype, buffer=self.shm.buf, offset=start)[...] = array
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def cancel(self):
+        try:
+            self.shm.buf[0] = 1
+        except TypeError:
+            # Already released: the task has finished
+            pass
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _run(task_name, shm_name, layout, kwargs):
+    """Worker side: map the inputs, run the task, unmap"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    arrays = None
+    try:
+        arrays = {key: np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+                  for key, shape, dtype, offset in layout}
+        return TASKS[task_name](arrays, lambda: shm.buf[0] == 1, **kwargs)
+    finally:
+        # Views into the block must be gone before it can be closed; a failed
+        # task's traceback may still hold some, and then the mapping goes with
+        # the exception instead
+        arrays = None
+        try:
+            shm.close()
+        except BufferError:
+            pass
+
+
+# Tasks: (arrays, cancelled, **kwargs) -> dict. Results must not reference the
+# input arrays. Iterative tasks return what they have when cancelled, with
+# complete=False.
+
+def fare_regression(arrays, cancelled, n_boot=1000, seed=0):
+    """Least-squares fit of y on x, with a bootstrap interval for the slope"""
+    x = np.asarray(arrays['x'], dtype=np.float64)
+    y = np.asarray(arrays['y'], dtype=np.float64)
+    fit = stats.linregress(x, y)
+
+    rng = np.random.default_rng(seed)
+    slopes = []
+    for start in range(0, n_boot, CHECK_EVERY):
+        if cancelled():
+            break
+        idx = rng.integers(0, len(x), size=(min(CHECK_EVERY, n_boot - start), len(x)))
+        xs = x[idx] - x[idx].mean(axis=1, keepdims=True)
+        ys = y[idx] - y[idx].mean(axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            slopes.append((xs * ys).sum(axis=1) / (xs ** 2).sum(axis=1))
+    slopes = np.concatenate(slopes) if slopes else np.empty(0)
+    slopes = slopes[np.isfinite(slopes)]
+    low, high = np.percentile(slopes, [2.5, 97.5]) if len(slopes) >= 20 else (np.nan, np.nan)
+    return {
+        'slope': float(fit.slope),
+        'intercept': float(fit.intercept),
+        'correlation': float(fit.rvalue),
+        'slope_low': float(low),
+        'slope_high': float(high),
+        'resamples': int(len(slopes)),
+        'complete': len(slopes) == n_boot
+    }
+
+
+def lag_correlation(arrays, cancelled, max_lag=7):
+    """Correlation of x with y shifted by -max_lag..max_lag steps (positive: y after x)"""
+    x = np.asarray(arrays['x'], dtype=np.float64)
+    y = np.asarray(arrays['y'], dtype=np.float64)
+    lags, correlations = [], []
+    for lag in range(-max_lag, max_lag + 1):
+        if cancelled():
+            break
+        a, b = (x[:len(x) - lag], y[lag:]) if lag >= 0 else (x[-lag:], y[:len(y) + lag])
+        r = np.corrcoef(a, b)[0, 1] if len(a) > 2 and a.std() > 0 and b.std() > 0 else np.nan
+        lags.append(lag)
+        correlations.append(float(r))
+    return {'lag': lags, 'correlation': correlations, 'complete': len(lags) == 2 * max_lag + 1}
+
+
+TASKS = {
+    'fare_regression': fare_regression,
+    'lag_correlation': lag_correlation,
+}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_jobs = {}
+
+
+def get_pool():
+    """The process-wide analytics pool, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Don't fork the multithreaded app process
+            method = 'forkserver' if sys.platform.startswith('linux') else 'spawn'
+            _pool = ProcessPoolExecutor(ANALYTICS_WORKERS, mp_context=mp.get_context(method))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+class AnalyticsJob:
+    def __init__(self, future, shared):
+        self.future = future
+        self.shared = shared
+
+    def cancel(self):
+        """Drop the job if it hasn't started, otherwise ask it to stop early"""
+        if not self.future.cancel() and not self.future.done():
+            self.shared.cancel()
+
+    def result(self, timeout=DEFAULT_TIMEOUT, fallback=None):
+        """The task's result; after timeout seconds, its partial result or fallback"""
+        try:
+            return self.future.result(timeout)
+        except FutureTimeout:
+            self.cancel()
+            try:
+                return self.future.result(PARTIAL_GRACE)
+            except (FutureTimeout, CancelledError):
+                return fallback
+        except (CancelledError, BrokenProcessPool):
+            return fallback
+
+
+def submit(key, task_name, arrays, **kwargs):
+    """Run TASKS[task_name] on the pool, replacing any job submitted under the same key.
+
+    Pages key jobs by session and analysis, so a rerun with new filters
+    cancels the analysis it supersedes.
+    """
+    with _pool_lock:
+        previous = _jobs.pop(key, None)
+    if previous is not None:
+        previous.cancel()
+
+    shared = SharedArrays(arrays)
+    try:
+        try:
+            future = get_pool().submit(_run, task_name, shared.name, shared.layout, kwargs)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool
+            _reset_pool()
+            future = get_pool().submit(_run, task_name, shared.name, shared.layout, kwargs)
+    except Exception:
+        shared.release()
+        raise
+
+    job = AnalyticsJob(future, shared)
+    with _pool_lock:
+        _jobs[key] = job
+
+    def finished(_):
+        shared.release()
+        with _pool_lock:
+            if _jobs.get(key) is job:
+                del _jobs[key]
+
+    future.add_done_callback(finished)
+    return job
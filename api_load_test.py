@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import random
+import time
+
+import numpy as np
+from aiohttp import ClientSession, ClientTimeout
+
+from taxi_zones import DAYS
+from trip_profiles import TIME_RANGE_HOURS
+
+BOROUGHS = ["Manhattan", "Brooklyn", "Queens", "Bronx"]
+
+
+def random_request(rng, start_date, end_date):
+    """(endpoint name, path, params) drawn from a driver-like mix of calls"""
+    kind = rng.choices(['best-zones', 'trip-profitability', 'filtered-stats'], weights=[5, 4, 1])[0]
+    if kind == 'best-zones':
+        params = {
+            'day': rng.choice(DAYS),
+            'time_range': rng.choice(list(TIME_RANGE_HOURS)),
+            'borough': rng.choice(["All"] + BOROUGHS)
+        }
+    elif kind == 'trip-profitability':
+        params = {
+            'pickup_borough': rng.choice(BOROUGHS),
+            'dropoff_borough': rng.choice(BOROUGHS),
+            'time_range': rng.choice(list(TIME_RANGE_HOURS)),
+            'distance': rng.choice([1, 2, 3, 5, 8, 12])
+        }
+    else:
+        params = {
+            'start_date': start_date,
+            'end_date': end_date,
+            'pickup_borough': rng.choice(BOROUGHS)
+        }
+    return kind, f"/{kind}", params
+
+
+async def worker(session, base_url, deadline, rng, latencies, errors, start_date, end_date):
+    while time.perf_counter() < deadline:
+        kind, path, params = random_request(rng, start_date, end_date)
+        started = time.perf_counter()
+        try:
+            async with session.get(base_url + path, params=params) as response:
+                await response.read()
+                ok = response.status == 200
+        except Exception:
+            ok = False
+        latencies.setdefault(kind, []).append(time.perf_counter() - started)
+        if not ok:
+            errors[kind] = errors.get(kind, 0) + 1
+
+
+async def run(base_url, concurrency, duration, start_date, end_date, seed):
+    latencies, errors = {}, {}
+    deadline = time.perf_counter() + duration
+    async with ClientSession(timeout=ClientTimeout(total=30)) as session:
+        await asyncio.gather(*(
+            worker(session, base_url, deadline, random.Random(seed + i), latencies, errors, start_date, end_date)
+            for i in range(concurrency)
+        ))
+    return latencies, errors
+
+
+def report(latencies, errors, duration):
+    total = sum(len(v) for v in latencies.values())
+    print(f"{total:,} requests in {duration:.0f}s = {total / duration:,.1f} req/s")
+    print(f"{'endpoint':<20}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind, values in sorted(latencies.items()):
+        ms = np.array(values) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        print(f"{kind:<20}{len(ms):>8}{errors.get(kind, 0):>8}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for taxi_api.py")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--start-date", default="2023-06-01")
+    parser.add_argument("--end-date", default="2023-12-31")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    latencies, errors = asyncio.run(run(args.url, args.concurrency, args.duration,
+                                        args.start_date, args.end_date, args.seed))
+    report(latencies, errors, args.duration)
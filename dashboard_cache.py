@@ -0,0 +1,234 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from taxi_db import query_fingerprint, read_frame, single_flight
+from query_cache import load, store
+from dashboard_queries import table_exists_query, dashboard_queries
+
+# Results of the dashboard's queries, shared by every session of the process.
+# An entry is fresh for FRESH_SECONDS. After that it is still served while a
+# single background refresh replaces it (stale-while-revalidate), so a visitor
+# never waits on an expired entry. The warmer keeps the dashboard's fixed
+# queries refreshed ahead of expiry, so those are always fresh.
+FRESH_SECONDS = 600
+# Entries older than this are not served; the visitor waits for a fresh result
+MAX_STALE_SECONDS = 3600
+# The warmer's schedule, and how long before going stale it refreshes an entry
+WARM_INTERVAL = 60
+REFRESH_AHEAD_SECONDS = 120
+REFRESH_WORKERS = 2
+
+_CACHE_SIZE = 512
+_entries = OrderedDict()
+_refreshing = set()
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(REFRESH_WORKERS, thread_name_prefix="dashboard-refresh")
+_warmer = None
+_last_cycle = None
+
+# Tables behind the dashboard. Results kept in the on-disk query cache are
+# stamped with the dataset version (see refresh.py) and with these tables'
+# write counters, so any write to them invalidates those. The counters restart
+# from zero with the server or pg_stat_reset(), so their reset time is part of
+# the stamp too.
+DASHBOARD_TABLES = ['nyc_taxi_trips', 'nyc_taxi_overview', 'nyc_events', 'trip_anomalies', 'event_trip_attribution']
+VERSION_TTL = 30
+
+# The dashboard's database connection. Everything below runs without a
+# Streamlit script context, so the warmer thread can use it too; errors are
+# raised for the page to report.
+_conn = None
+_version = (0.0, None)
+_version_lock = threading.Lock()
+
+
+def _copy(result):
+    # Callers are free to modify what they get back
+    return result.copy() if result is not None else None
+
+
+def _refresh(key, query, fetch):
+    """fetch(query) into the cache; a failed fetch keeps the entry it would replace"""
+    try:
+        result = fetch(query)
+    finally:
+        with _lock:
+            _refreshing.discard(key)
+    if result is not None:
+        with _lock:
+            _entries[key] = (time.time(), result)
+            _entries.move_to_end(key)
+            while len(_entries) > _CACHE_SIZE:
+                _entries.popitem(last=False)
+    return result
+
+
+def _claim(key):
+    # Only one refresh per entry at a time
+    with _lock:
+        if key in _refreshing:
+            return False
+        _refreshing.add(key)
+        return True
+
+
+def cached(query, fetch):
+    """fetch(query) through the cache, or None if it failed with nothing cached"""
+    key = query_fingerprint(query)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+    age = time.time() - entry[0] if entry is not None else None
+
+    if age is not None and age < MAX_STALE_SECONDS:
+        if age >= FRESH_SECONDS and _claim(key):
+            _executor.submit(_refresh, key, query, fetch)
+        return _copy(entry[1])
+
+    _claim(key)
+    result = _refresh(key, query, fetch)
+    return _copy(result if result is not None else entry[1] if entry is not None else None)
+
+
+def _warm(queries, fetch):
+    global _last_cycle
+    while True:
+        started = time.time()
+        try:
+            parameterizations = queries()
+        except Exception:
+            parameterizations = []
+        for _, _, query in parameterizations:
+            key = query_fingerprint(query)
+            with _lock:
+                entry = _entries.get(key)
+            if entry is None or started - entry[0] >= FRESH_SECONDS - REFRESH_AHEAD_SECONDS:
+                # One at a time: the warmer shouldn't compete with visitors
+                if _claim(key):
+                    try:
+                        _refresh(key, query, fetch)
+                    except Exception:
+                        pass
+        with _lock:
+            _last_cycle = (started, time.time() - started)
+        time.sleep(WARM_INTERVAL)
+
+
+def start_warmer(queries, fetch):
+    """Refresh every (section, option, query) in queries() every WARM_INTERVAL seconds
+    when it is missing or close to going stale, on a background thread, once per process"""
+    global _warmer
+    with _lock:
+        if _warmer is not None:
+            return
+        _warmer = threading.Thread(target=_warm, args=(queries, fetch), name="dashboard-warmer", daemon=True)
+    _warmer.start()
+
+
+def coverage(parameterizations):
+    """How many of the (section, option, query) parameterizations are fresh, per section.
+
+    Returns {'warm', 'total', 'sections': {section: (warm, total)}, 'last_cycle': (started, seconds) or None}.
+    """
+    now = time.time()
+    sections = {}
+    with _lock:
+        for section, _, query in parameterizations:
+            entry = _entries.get(query_fingerprint(query))
+            warm, total = sections.get(section, (0, 0))
+            sections[section] = (warm + (entry is not None and now - entry[0] < FRESH_SECONDS), total + 1)
+        last_cycle = _last_cycle
+    return {
+        'warm': sum(w for w, _ in sections.values()),
+        'total': sum(t for _, t in sections.values()),
+        'sections': sections,
+        'last_cycle': last_cycle
+    }
+
+
+def connect(settings):
+    """Open the dashboard's connection with psycopg2.connect(**settings), once per process"""
+    global _conn
+    with _lock:
+        if _conn is None:
+            conn = psycopg2.connect(**settings)
+            # The connection lives as long as the process: a failed query mustn't
+            # abort it, and no transaction may stay open holding locks
+            conn.autocommit = True
+            _conn = conn
+        return _conn
+
+
+def data_version():
+    """Stamp for the on-disk cache entries, re-read every VERSION_TTL seconds, or None"""
+    global _version
+    with _version_lock:
+        checked_at, version = _version
+        if time.time() - checked_at < VERSION_TTL:
+            return version
+    if _conn is None:
+        return None
+    table_list = "', '".join(DASHBOARD_TABLES)
+    try:
+        row = read_frame(_conn, f"""
+        SELECT
+            (SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0)
+             FROM pg_stat_user_tables WHERE relname IN ('{table_list}')) as changes,
+            EXTRACT(EPOCH FROM GREATEST(
+                pg_postmaster_start_time(),
+                (SELECT stats_reset FROM pg_stat_database WHERE datname = current_database())
+            )) as counted_since,
+            to_regclass('dataset_versions') IS NOT NULL as versioned
+        """).iloc[0]
+        dataset_version = 0
+        if row['versioned']:
+            dataset_version = int(read_frame(
+                _conn, "SELECT COALESCE(MAX(version), 0) as version FROM dataset_versions"
+            ).iloc[0]['version'])
+        version = f"v{dataset_version}-d{int(row['changes'])}-{int(row['counted_since'])}"
+    except Exception:
+        version = None
+    with _version_lock:
+        _version = (time.time(), version)
+    return version
+
+
+def fetch_query(query):
+    """Run a dashboard query, or None without a connection. Sessions that run the
+    same query at the same moment share one execution, which is read from the
+    on-disk cache when this data version has been queried before (even by an
+    earlier process)."""
+    if _conn is None:
+        return None
+
+    def fetch():
+        version = data_version()
+        result = load('dashboard', query, version) if version else None
+        if result is not None:
+            return result
+        result = read_frame(_conn, query)
+        if version and not result.empty:
+            store(query, version, result)
+        return result
+
+    return single_flight(f"dashboard:{query_fingerprint(query)}", fetch)
+
+
+def fetch_cached(query):
+    """fetch_query through the cache"""
+    return cached(query, fetch_query)
+
+
+def table_exists(table_name):
+    result = fetch_cached(table_exists_query(table_name))
+    return result is not None and not result.empty and bool(result.iloc[0]['present'])
+
+
+def warm_queries():
+    """Every parameterization of the dashboard's selectors, for the warmer"""
+    return dashboard_queries(table_exists("trip_anomalies"), table_exists("event_trip_attribution"))
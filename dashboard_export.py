@@ -0,0 +1,183 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from taxi_db import execute_query, get_dataset_version, table_exists
+from zone_map import STATIC_DIR
+from dashboard_queries import (
+    OVERVIEW_QUERY, BOROUGH_QUERY, daily_trips_query, correlation_query,
+    daily_anomalies_query, events_query, get_monthly_metrics, format_event
+)
+
+# Snapshots read by index.html. Data files are named after a hash of their
+# content, so they can be cached forever by browsers and a CDN; only
+# manifest.json, which points at the current files, has to be revalidated
+EXPORT_DIR = os.path.join(STATIC_DIR, "dashboard")
+MANIFEST = "manifest.json"
+
+MONTHS_QUERY = """
+SELECT DISTINCT
+    EXTRACT(YEAR FROM trip_datetime)::int as year,
+    EXTRACT(MONTH FROM trip_datetime)::int as month
+FROM nyc_taxi_trips
+ORDER BY 1, 2
+"""
+
+
+def _dates(series):
+    return pd.to_datetime(series).dt.strftime("%Y-%m-%d").tolist()
+
+
+def _write_snapshot(out_dir, key, payload):
+    """Write one gzip JSON snapshot and return its file name"""
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    name = f"{key.replace('/', '-')}.{hashlib.sha1(raw).hexdigest()[:12]}.json.gz"
+    path = os.path.join(out_dir, name)
+    if not os.path.exists(path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            # mtime=0 keeps the bytes identical for identical content
+            f.write(gzip.compress(raw, compresslevel=9, mtime=0))
+        os.replace(tmp_path, path)
+    return name
+
+
+def overview_snapshot():
+    overview = execute_query(OVERVIEW_QUERY)
+    if overview.empty:
+        return None
+    row = overview.iloc[0]
+    return {
+        'total_trips': int(row['total_trips']),
+        'avg_daily_trips': float(row['avg_daily_trips']),
+        'peak_borough': str(row['peak_borough']),
+        'peak_day': str(row['peak_day'])
+    }
+
+
+def borough_snapshot():
+    boroughs = execute_query(BOROUGH_QUERY)
+    if boroughs.empty:
+        return None
+    return {
+        'borough': boroughs['borough'].astype(str).tolist(),
+        'trip_count': boroughs['trip_count'].astype(int).tolist(),
+        'percentage': boroughs['percentage'].astype(float).tolist()
+    }
+
+
+def correlation_snapshot():
+    correlation = execute_query(correlation_query())
+    if correlation.empty:
+        return None
+    return {
+        'date': _dates(correlation['date']),
+        'taxi_trips': correlation['taxi_trips'].astype(int).tolist(),
+        'events': correlation['events'].astype(int).tolist()
+    }
+
+
+def daily_snapshot(year, month, with_anomalies):
+    daily = execute_query(daily_trips_query(month, year))
+    if daily.empty:
+        return None
+    snapshot = {
+        'date': _dates(daily['date']),
+        'trips': daily['trips'].astype(int).tolist(),
+        'event': daily['is_event'].astype(int).tolist(),
+        'metrics': get_monthly_metrics(daily)
+    }
+    if with_anomalies:
+        first_day = f"{year}-{month:02d}-01"
+        last_day = (pd.Timestamp(first_day) + pd.offsets.MonthEnd(0)).strftime("%Y-%m-%d")
+        anomalies = execute_query(daily_anomalies_query(first_day, last_day))
+        counts = {}
+        if not anomalies.empty:
+            anomalies['date'] = _dates(anomalies['date'])
+            counts = anomalies.set_index('date')[['surges', 'dips']].astype(int).to_dict('index')
+        snapshot['surges'] = [counts.get(d, {}).get('surges', 0) for d in snapshot['date']]
+        snapshot['dips'] = [counts.get(d, {}).get('dips', 0) for d in snapshot['date']]
+    return snapshot
+
+
+def calendar_snapshot(year, month, with_attribution, surge_days):
+    """Events per day of the month, plus the days tinted as surge or dip days"""
+    first_day = f"{year}-{month:02d}-01"
+    last_day = (pd.Timestamp(first_day) + pd.offsets.MonthEnd(0)).strftime("%Y-%m-%d")
+    events = execute_query(events_query(first_day, last_day, with_attribution))
+    days = {}
+    for _, row in events.iterrows():
+        day = str(pd.to_datetime(row['event_datetime']).day)
+        days.setdefault(day, []).append(format_event(row))
+    return {'events': days, 'anomalies': surge_days}
+
+
+def export_dashboard(out_dir=EXPORT_DIR):
+    """Write every section's snapshot and a manifest pointing at them"""
+    os.makedirs(out_dir, exist_ok=True)
+    files = {}
+
+    for key, build in [('overview', overview_snapshot),
+                       ('boroughs', borough_snapshot),
+                       ('correlation', correlation_snapshot)]:
+        snapshot = build()
+        if snapshot is not None:
+            files[key] = _write_snapshot(out_dir, key, snapshot)
+
+    with_anomalies = table_exists('trip_anomalies')
+    with_attribution = table_exists('event_trip_attribution')
+    months = []
+    for year, month in execute_query(MONTHS_QUERY).itertuples(index=False):
+        key = f"{year}-{month:02d}"
+        daily = daily_snapshot(year, month, with_anomalies)
+        if daily is None:
+            continue
+        months.append(key)
+        files[f"daily/{key}"] = _write_snapshot(out_dir, f"daily/{key}", daily)
+
+        surge_days = {}
+        if with_anomalies:
+            for date, surges, dips in zip(daily['date'], daily['surges'], daily['dips']):
+                if surges or dips:
+                    surge_days[str(int(date[-2:]))] = 'surge' if surges >= dips else 'dip'
+        calendar_data = calendar_snapshot(year, month, with_attribution, surge_days)
+        files[f"calendar/{key}"] = _write_snapshot(out_dir, f"calendar/{key}", calendar_data)
+
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f).get('files', {})
+
+    manifest = {
+        'version': get_dataset_version(),
+        'generated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'months': months,
+        'files': files
+    }
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(tmp_path, manifest_path)
+
+    # Keep the previous generation for pages that loaded the old manifest
+    keep = set(files.values()) | set(previous.values()) | {MANIFEST}
+    for name in os.listdir(out_dir):
+        if name.endswith(".json.gz") and name not in keep:
+            os.remove(os.path.join(out_dir, name))
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the dashboard's data as static snapshots for index.html")
+    parser.add_argument("--out", default=EXPORT_DIR)
+    args = parser.parse_args()
+
+    manifest = export_dashboard(args.out)
+    print(f"Exported {len(manifest['files'])} snapshots ({len(manifest['months'])} months) "
+          f"for dataset {manifest['version']} to {args.out}")
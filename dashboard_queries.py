@@ -0,0 +1,173 @@
+import calendar
+
+import pandas as pd
+
+# SQL and row formatting shared by the Streamlit dashboard (nyc_taxi_dashboard.py)
+# and the static snapshot exporter (dashboard_export.py), so both show the same numbers
+
+MONTHS = ["January", "February", "March", "April", "May", "June",
+          "July", "August", "September", "October", "November", "December"]
+
+# The Correlation Analysis time periods, as (start, end) dates
+CORRELATION_PERIODS = {
+    "All Time (Jun-Dec)": ('2023-06-01', '2023-12-31'),
+    "Q2 2023": ('2023-04-01', '2023-06-30'),
+    "Q3 2023": ('2023-07-01', '2023-09-30'),
+    "Q4 2023": ('2023-10-01', '2023-12-31'),
+}
+
+# The calendar's fixed month and day
+CALENDAR_MONTH = 12
+CALENDAR_DAY = '2023-07-14'
+
+OVERVIEW_QUERY = """
+SELECT
+    COUNT(*) as total_trips,
+    AVG(daily_trips) as avg_daily_trips,
+    MAX(peak_borough) as peak_borough,
+    MAX(peak_day) as peak_day
+FROM nyc_taxi_overview
+"""
+
+BOROUGH_QUERY = """
+SELECT
+    borough,
+    COUNT(*) as trip_count,
+    ROUND(100.0 * COUNT(*) / SUM(COUNT(*)) OVER (), 1) as percentage
+FROM nyc_taxi_trips
+GROUP BY borough
+ORDER BY trip_count DESC
+"""
+
+
+def table_exists_query(table_name):
+    return f"SELECT to_regclass('{table_name}') IS NOT NULL as present"
+
+
+def month_bounds(month, year=2023):
+    """First and last day of a month as 'YYYY-MM-DD'"""
+    return f"{year}-{month:02d}-01", f"{year}-{month:02d}-{calendar.monthrange(year, month)[1]}"
+
+
+def daily_trips_query(month, year=2023):
+    return f"""
+    SELECT
+        date_trunc('day', trip_datetime) as date,
+        COUNT(*) as trips,
+        CASE WHEN EXISTS (
+            SELECT 1 FROM nyc_events
+            WHERE DATE(event_datetime) = DATE(date_trunc('day', trip_datetime))
+        ) THEN TRUE ELSE FALSE END as is_event
+    FROM nyc_taxi_trips
+    WHERE EXTRACT(MONTH FROM trip_datetime) = {int(month)}
+    AND EXTRACT(YEAR FROM trip_datetime) = {int(year)}
+    GROUP BY date
+    ORDER BY date
+    """
+
+
+def correlation_query(start_date='2023-06-01', end_date='2023-12-31'):
+    # Count each side per day before joining, rather than joining every
+    # trip to every event on the same date
+    return f"""
+    WITH daily_trips AS (
+        SELECT DATE(trip_datetime) as date, COUNT(*) as taxi_trips
+        FROM nyc_taxi_trips
+        WHERE trip_datetime BETWEEN '{start_date}' AND '{end_date}'
+        GROUP BY 1
+    ),
+    daily_events AS (
+        SELECT DATE(event_datetime) as date, COUNT(*) as events
+        FROM nyc_events
+        WHERE event_datetime BETWEEN '{start_date}' AND '{end_date}'
+        GROUP BY 1
+    )
+    SELECT t.date, t.taxi_trips, COALESCE(e.events, 0) as events
+    FROM daily_trips t
+    LEFT JOIN daily_events e ON e.date = t.date
+    ORDER BY t.date
+    """
+
+
+# Surge and dip zone-hours per day from trip_anomalies (see trip_anomalies.py)
+def daily_anomalies_query(start_date, end_date):
+    return f"""
+    SELECT
+        DATE(hour_start) as date,
+        SUM(CASE WHEN kind = 'surge' THEN 1 ELSE 0 END) as surges,
+        SUM(CASE WHEN kind = 'dip' THEN 1 ELSE 0 END) as dips
+    FROM trip_anomalies
+    WHERE hour_start >= '{start_date}' AND hour_start < DATE '{end_date}' + 1
+    GROUP BY 1
+    ORDER BY 1
+    """
+
+
+# Events between two days with the taxi demand attributed to each (see event_attribution.py)
+def events_query(start_date, end_date, with_attribution=True):
+    if with_attribution:
+        attribution = "a.zones, a.matched_by, a.lift FROM nyc_events e LEFT JOIN event_trip_attribution a ON a.event_id = e.id"
+    else:
+        attribution = "NULL as zones, NULL as matched_by, NULL as lift FROM nyc_events e"
+    return f"""
+    SELECT e.*, {attribution}
+    WHERE e.event_datetime >= '{start_date}' AND e.event_datetime < DATE '{end_date}' + 1
+    ORDER BY e.event_datetime
+    """
+
+
+def dashboard_queries(with_anomalies=True, with_attribution=True):
+    """Every (section, option, query) the dashboard's selectors can ask for,
+    given whether the trip_anomalies and event_trip_attribution tables exist"""
+    queries = [
+        ('tables', name, table_exists_query(name)) for name in ['trip_anomalies', 'event_trip_attribution']
+    ]
+    queries.append(('overview', None, OVERVIEW_QUERY))
+    for number, month in enumerate(MONTHS, start=1):
+        queries.append(('monthly', month, daily_trips_query(number)))
+        if with_anomalies:
+            queries.append(('monthly', month, daily_anomalies_query(*month_bounds(number))))
+    queries.append(('borough', None, BOROUGH_QUERY))
+    for period, (start_date, end_date) in CORRELATION_PERIODS.items():
+        queries.append(('correlation', period, correlation_query(start_date, end_date)))
+    if with_anomalies:
+        queries.append(('calendar', None, daily_anomalies_query(*month_bounds(CALENDAR_MONTH))))
+    queries.append(('calendar', None, events_query(CALENDAR_DAY, CALENDAR_DAY, with_attribution)))
+    return queries
+
+
+def get_monthly_metrics(daily_data):
+    # Headline numbers straight from the month's daily counts
+    peak = daily_data.loc[daily_data['trips'].idxmax()]
+    peak_date = pd.to_datetime(peak['date'])
+    return {
+        "total_trips": f"{int(daily_data['trips'].sum()):,}",
+        "avg_daily": f"{int(round(daily_data['trips'].mean())):,}",
+        "peak_day": f"{int(peak['trips']):,}",
+        "peak_day_date": f"{peak_date:%b} {peak_date.day}"
+    }
+
+
+def format_event(row):
+    """A row of events_query as the title/location/time/note shown in the calendar"""
+    def first_value(names, default=""):
+        for name in names:
+            if name in row and pd.notna(row[name]) and row[name] != "":
+                return row[name]
+        return default
+
+    note = None
+    if pd.notna(row['lift']):
+        if row['matched_by'] == 'location':
+            area = row['zones'].split(", ")[0]
+        elif row['matched_by'] == 'coordinates':
+            area = "nearby zones"
+        else:
+            area = "the borough"
+        note = f"Taxi pickups in {area} {'increased' if row['lift'] >= 0 else 'decreased'} by {abs(row['lift']):.0%} vs the week before"
+    return {
+        "title": str(first_value(['event_name', 'title', 'name'], "Event")),
+        "location": str(first_value(['event_location', 'location', 'event_borough', 'borough'])),
+        "time": pd.to_datetime(row['event_datetime']).strftime("%I:%M %p").lstrip("0"),
+        "note": note
+    }
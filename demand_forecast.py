@@ -0,0 +1,239 @@
+import os
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from taxi_db import DATA_DIR, execute_query
+from taxi_zones import HOURS_PER_WEEK, hourly_zone_matrix, load_zone_dictionary
+from event_attribution import load_events, match_event_zones
+
+FORECAST_PATH = os.path.join(DATA_DIR, "demand_forecast.npz")
+
+# Weeks of history behind the seasonal profile; recent weeks weigh more
+TRAIN_WEEKS = 12
+WEEK_DECAY = 0.8
+
+# Zones with few trips during past events borrow the citywide event lift
+EVENT_PRIOR_TRIPS = 200.0
+
+
+def _event_mask(zone_names, start, n_hours, events):
+    """zones x hours boolean mask of hours inside an event window in the event's zones"""
+    mask = np.zeros((len(zone_names), n_hours), dtype=bool)
+    if events.empty or not zone_names:
+        return mask
+    zones = pd.DataFrame({'zone': zone_names}).merge(load_zone_dictionary(), on='zone', how='left')
+    zones['borough'] = zones['borough'].fillna('')
+    matches = match_event_zones(events, zones)
+    starts = (events['window_start'].to_numpy().astype('datetime64[h]') - start).astype(int)
+    ends = (events['window_end'].to_numpy().astype('datetime64[h]') - start).astype(int) + 1
+    for (zone_ids, _), lo, hi in zip(matches, starts, ends):
+        lo, hi = max(lo, 0), min(hi, n_hours)
+        if lo < hi and len(zone_ids):
+            mask[zone_ids, lo:hi] = True
+    return mask
+
+
+def _by_hour_of_week(matrix):
+    """zones x weeks x 168 view of a zones x hours matrix that starts on a Monday"""
+    weeks = matrix.shape[1] // HOURS_PER_WEEK
+    return matrix[:, :weeks * HOURS_PER_WEEK].reshape(matrix.shape[0], weeks, HOURS_PER_WEEK)
+
+
+def _last_loaded_day():
+    last = execute_query("SELECT MAX(pickup_date) as last_day FROM taxi_trips")
+    if last.empty or pd.isna(last.iloc[0]['last_day']):
+        return None
+    return date.fromisoformat(str(last.iloc[0]['last_day']))
+
+
+def _training_window(last_day):
+    """Whole weeks ending on the last loaded Sunday-or-earlier day, starting on a Monday"""
+    end = last_day - timedelta(days=(last_day.weekday() + 1) % 7)
+    first = end - timedelta(weeks=TRAIN_WEEKS) + timedelta(days=1)
+    return first, end
+
+
+def _save_model(path, zone_names, profile, event_lift, trained_through):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        zones=np.array(zone_names, dtype=str),
+        profile=profile.astype(np.float32),
+        event_lift=event_lift.astype(np.float32),
+        trained_through=np.str_(trained_through)
+    )
+    os.replace(tmp_path, path)
+
+
+def train_demand_forecast(path=FORECAST_PATH):
+    """Fit the weekly seasonal profile and event lift for every zone at once and save them"""
+    last_day = _last_loaded_day()
+    if last_day is None:
+        return None
+    first, end = _training_window(last_day)
+
+    zone_names, start, matrix = hourly_zone_matrix(first.isoformat(), end.isoformat())
+    if not zone_names:
+        return None
+    events = load_events(
+        f"event_datetime >= '{first - timedelta(days=1)}' AND event_datetime < '{end + timedelta(days=1)}'"
+    )
+    mask = _event_mask(zone_names, start, matrix.shape[1], events)
+
+    counts = _by_hour_of_week(matrix)
+    in_event = _by_hour_of_week(mask)
+    weeks = counts.shape[1]
+    weights = WEEK_DECAY ** np.arange(weeks - 1, -1, -1)
+
+    # Seasonal profile: decay-weighted mean of each hour of the week, leaving
+    # event hours out so the regressor isn't absorbed into the baseline
+    w = np.where(in_event, 0.0, weights[None, :, None])
+    weight_sum = w.sum(axis=1)
+    profile = np.where(weight_sum > 0,
+                       (counts * w).sum(axis=1) / np.maximum(weight_sum, 1e-9),
+                       (counts * weights[None, :, None]).sum(axis=1) / weights.sum())
+
+    # Event lift: observed over expected trips during event hours, shrunk to the citywide ratio
+    expected = np.broadcast_to(profile[:, None, :], counts.shape)
+    event_actual = np.where(in_event, counts, 0.0).sum(axis=(1, 2))
+    event_expected = np.where(in_event, expected, 0.0).sum(axis=(1, 2))
+    citywide = event_actual.sum() / event_expected.sum() if event_expected.sum() > 0 else 1.0
+    event_lift = (event_actual + EVENT_PRIOR_TRIPS * citywide) / (event_expected + EVENT_PRIOR_TRIPS)
+
+    _save_model(path, zone_names, profile, event_lift, last_day.isoformat())
+    return path
+
+
+def refresh_demand_forecast(days=None, path=FORECAST_PATH):
+    """Retrain when any of the changed pickup dates (every date when days is None)
+    falls inside the training window, or the window has moved on to a new week.
+
+    Otherwise the model is unchanged and only its trained_through date is
+    moved up, so the forecast still starts after the last loaded day.
+    """
+    last_day = _last_loaded_day()
+    if last_day is None:
+        return None
+    model = load_demand_forecast(path)
+    if days is None or model is None:
+        return train_demand_forecast(path)
+    first, end = _training_window(last_day)
+    if (first, end) != _training_window(date.fromisoformat(model['trained_through'])) or \
+            any(first.isoformat() <= d <= end.isoformat() for d in days):
+        return train_demand_forecast(path)
+    if model['trained_through'] != last_day.isoformat():
+        _save_model(path, model['zones'], model['profile'], model['event_lift'], last_day.isoformat())
+    return path
+
+
+_forecast = None
+_forecast_mtime = None
+_forecast_lock = threading.Lock()
+
+
+def load_demand_forecast(path=FORECAST_PATH):
+    """Serialized model state, loaded once per process, or None if not trained yet"""
+    global _forecast, _forecast_mtime
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _forecast_lock:
+        if _forecast is None or _forecast_mtime != mtime:
+            with np.load(path, allow_pickle=False) as f:
+                _forecast = {
+                    'zones': f['zones'].tolist(),
+                    'profile': f['profile'],
+                    'event_lift': f['event_lift'],
+                    'trained_through': str(f['trained_through'])
+                }
+            _forecast_mtime = mtime
+        return _forecast
+
+
+# forecast_week results per (model file mtime, start date, hours), since one
+# page rerun reads the same week several times and each read queries events
+_WEEKS_CACHED = 16
+_weeks = {}
+_weeks_lock = threading.Lock()
+
+
+def forecast_week(start_date=None, hours=HOURS_PER_WEEK, path=FORECAST_PATH):
+    """Hourly trips per zone from start_date (default: the day after the training data).
+
+    Returns (zones, hour timestamps, zones x hours forecast, zones x hours
+    event flags), or None if the model hasn't been trained. The result is
+    shared between callers and must not be modified.
+    """
+    model = load_demand_forecast(path)
+    if model is None:
+        return None
+    if start_date is None:
+        start_date = date.fromisoformat(model['trained_through']) + timedelta(days=1)
+    key = (_forecast_mtime, str(start_date), hours)
+    with _weeks_lock:
+        if key in _weeks:
+            return _weeks[key]
+
+    start = np.datetime64(str(start_date), 'h')
+    timestamps = pd.DatetimeIndex(start + np.arange(hours))
+    how = timestamps.dayofweek.to_numpy() * 24 + timestamps.hour.to_numpy()
+
+    end_date = timestamps[-1].date() + timedelta(days=1)
+    events = load_events(f"event_datetime >= '{start_date}' AND event_datetime < '{end_date}'")
+    in_event = _event_mask(model['zones'], start, hours, events)
+
+    forecast = model['profile'][:, how] * np.where(in_event, model['event_lift'][:, None], 1.0)
+    forecast.flags.writeable = False
+    in_event.flags.writeable = False
+    week = (model['zones'], timestamps, forecast, in_event)
+    with _weeks_lock:
+        if any(k[0] != key[0] for k in _weeks) or len(_weeks) >= _WEEKS_CACHED:
+            _weeks.clear()
+        _weeks[key] = week
+    return week
+
+
+def forecast_zone(zone, start_date=None, week=None):
+    """Hourly forecast for one zone as a frame, or None. Pass the forecast_week
+    result as week when the caller already has it."""
+    if week is None:
+        week = forecast_week(start_date)
+    if week is None or zone not in week[0]:
+        return None
+    zones, timestamps, forecast, in_event = week
+    z = zones.index(zone)
+    return pd.DataFrame({'hour': timestamps, 'trips': forecast[z], 'event': in_event[z]})
+
+
+def busiest_zones(start_date=None, day_offset=0, hour=None, k=15, week=None):
+    """Zones with the most forecast trips on one day (or one hour of it)"""
+    if week is None:
+        week = forecast_week(start_date)
+    if week is None:
+        return None
+    zones, timestamps, forecast, in_event = week
+    cols = np.arange(day_offset * 24, day_offset * 24 + 24)
+    if hour is not None:
+        cols = cols[hour:hour + 1]
+    totals = forecast[:, cols].sum(axis=1)
+    k = min(k, len(zones))
+    best = np.argpartition(-totals, k - 1)[:k]
+    best = best[np.argsort(-totals[best])]
+    return pd.DataFrame({
+        'zone': np.array(zones)[best],
+        'forecast_trips': totals[best],
+        'event': in_event[best][:, cols].any(axis=1)
+    })
+
+
+if __name__ == "__main__":
+    path = train_demand_forecast()
+    if path is None:
+        print("No trips found to train on")
+    else:
+        print(f"Saved demand forecast to {path}")
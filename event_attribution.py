@@ -0,0 +1,270 @@
+import re
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from taxi_db import get_connection, execute_query
+from taxi_zones import PICKUP_HOUR_SQL, update_zone_dictionary, zone_index
+from zone_map import zone_centroids
+
+# Trips are attributed from an hour before an event starts until two hours
+# after it ends; events without an end time are assumed to last three hours
+PRE_EVENT_HOURS = 1
+POST_EVENT_HOURS = 2
+DEFAULT_EVENT_HOURS = 3
+
+# Zones whose centroid lies within this distance of an event's coordinates
+EVENT_RADIUS_KM = 1.5
+
+# Demand is compared against the same window one week earlier
+BASELINE_OFFSET_DAYS = 7
+
+CREATE_ATTRIBUTION_SQL = """
+CREATE TABLE IF NOT EXISTS event_trip_attribution (
+    event_id BIGINT PRIMARY KEY,
+    event_date DATE NOT NULL,
+    window_start TIMESTAMP NOT NULL,
+    window_end TIMESTAMP NOT NULL,
+    matched_by TEXT NOT NULL,
+    zones TEXT NOT NULL,
+    trips BIGINT NOT NULL,
+    baseline_trips BIGINT NOT NULL,
+    lift DOUBLE PRECISION
+);
+CREATE INDEX IF NOT EXISTS event_trip_attribution_date_idx ON event_trip_attribution (event_date)
+"""
+
+# nyc_events comes from different exports; use whichever of these columns exist
+EVENT_COLUMNS = {
+    'name': ['event_name', 'title', 'name'],
+    'end': ['end_datetime', 'event_end_datetime', 'end_date_time'],
+    'borough': ['event_borough', 'borough'],
+    'location': ['event_location', 'location'],
+    'lat': ['latitude', 'lat'],
+    'lon': ['longitude', 'lon', 'lng'],
+}
+
+
+def _column(events, key):
+    for name in EVENT_COLUMNS[key]:
+        if name in events.columns:
+            return events[name]
+    return pd.Series([None] * len(events), index=events.index)
+
+
+def load_events(where_clause="1=1"):
+    events = execute_query(f"SELECT * FROM nyc_events WHERE {where_clause}")
+    if events.empty:
+        return events
+    frame = pd.DataFrame({
+        'event_id': events['id'].astype(np.int64),
+        'start': pd.to_datetime(events['event_datetime']),
+        'end': pd.to_datetime(_column(events, 'end'), errors='coerce'),
+        'name': _column(events, 'name'),
+        'borough': _column(events, 'borough'),
+        'location': _column(events, 'location'),
+        'lat': pd.to_numeric(_column(events, 'lat'), errors='coerce'),
+        'lon': pd.to_numeric(_column(events, 'lon'), errors='coerce'),
+    })
+    default_end = frame['start'] + pd.Timedelta(hours=DEFAULT_EVENT_HOURS)
+    frame['end'] = frame['end'].where(frame['end'] > frame['start'], default_end)
+    frame['window_start'] = frame['start'] - pd.Timedelta(hours=PRE_EVENT_HOURS)
+    frame['window_end'] = frame['end'] + pd.Timedelta(hours=POST_EVENT_HOURS)
+    return frame
+
+
+def _normalize(text):
+    """Lowercase words separated by single spaces, and padded with one, so
+    that substring tests match whole words only"""
+    words = re.sub(r"[^a-z0-9]+", " ", str(text).lower()).split()
+    return f" {' '.join(words)} " if words else ""
+
+
+def match_event_zones(events, zones):
+    """Zone indices and how they were found for every event.
+
+    Coordinates win (all zones whose centroid is within EVENT_RADIUS_KM, at
+    least the nearest one), then zone names mentioned as whole words in the
+    location text, then every zone in the event's borough. A location that is
+    only part of a zone name ("Park", "Center") doesn't match that zone.
+    """
+    index = zone_index(zones)
+    centroids = zone_centroids()
+    known = [z for z in zones['zone'] if z in centroids]
+    centroid_xy = np.array([centroids[z] for z in known]).reshape(-1, 2)
+    known_index = np.array([index[z] for z in known], dtype=np.int64)
+
+    # Equirectangular distances from every located event to every zone centroid at once
+    located = events['lat'].notna() & events['lon'].notna()
+    nearby = {}
+    if located.any() and len(known):
+        lat = events.loc[located, 'lat'].to_numpy()[:, None]
+        lon = events.loc[located, 'lon'].to_numpy()[:, None]
+        dx = (centroid_xy[None, :, 0] - lon) * np.cos(np.radians(lat)) * 111.32
+        dy = (centroid_xy[None, :, 1] - lat) * 110.57
+        dist = np.hypot(dx, dy)
+        within = dist <= EVENT_RADIUS_KM
+        within[np.arange(len(dist)), dist.argmin(axis=1)] = True
+        for row, event_id in enumerate(events.loc[located, 'event_id']):
+            nearby[event_id] = known_index[within[row]]
+
+    zone_names = [(_normalize(z), i) for i, z in enumerate(zones['zone'])]
+    borough_zones = {b: np.flatnonzero(zones['borough'].to_numpy() == b) for b in zones['borough'].unique()}
+
+    matches = []
+    for event in events.itertuples():
+        if event.event_id in nearby:
+            matches.append((nearby[event.event_id], 'coordinates'))
+            continue
+        location = _normalize(event.location) if event.location else ""
+        named = [i for name, i in zone_names if name and location and name in location]
+        if named:
+            matches.append((np.array(named, dtype=np.int64), 'location'))
+        elif event.borough in borough_zones:
+            matches.append((borough_zones[event.borough], 'borough'))
+        else:
+            matches.append((np.array([], dtype=np.int64), 'unmatched'))
+    return matches
+
+
+def _hourly_counts(zones, dates):
+    """Sorted (zone * 2^32 + hour since epoch) keys and a cumulative trip count over them"""
+    index = zone_index(zones)
+    date_list = "', '".join(sorted(dates))
+    counts = execute_query(f"""
+    SELECT
+        pickup_zone,
+        pickup_date,
+        {PICKUP_HOUR_SQL} as hour,
+        COUNT(*) as trip_count
+    FROM
+        taxi_trips
+    WHERE
+        pickup_zone != '' AND
+        pickup_date IN ('{date_list}')
+    GROUP BY
+        1, 2, 3
+    """)
+    if counts.empty:
+        return np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64)
+
+    hours = (pd.to_datetime(counts['pickup_date']).to_numpy().astype('datetime64[h]').astype(np.int64)
+             + counts['hour'].astype(np.int64).to_numpy())
+    keys = counts['pickup_zone'].map(index).to_numpy().astype(np.int64) * (1 << 32) + hours
+    order = np.argsort(keys)
+    cumulative = np.concatenate([[0], np.cumsum(counts['trip_count'].astype(np.int64).to_numpy()[order])])
+    return keys[order], cumulative
+
+
+def _window_trips(keys, cumulative, zone_ids, starts, ends):
+    """Trips in [start, end) hours for each (zone, window) pair via two binary searches"""
+    lo = np.searchsorted(keys, zone_ids * (1 << 32) + starts, side='left')
+    hi = np.searchsorted(keys, zone_ids * (1 << 32) + ends, side='left')
+    return cumulative[hi] - cumulative[lo]
+
+
+def attribute_events(events):
+    """Trips in each event's zones during its window, and in the same window a week earlier"""
+    zones = update_zone_dictionary()
+    if events.empty or zones.empty:
+        return pd.DataFrame()
+    matches = match_event_zones(events, zones)
+
+    # One (event, zone) pair per row
+    pair_event = np.repeat(np.arange(len(events)), [len(m[0]) for m in matches])
+    pair_zone = np.concatenate([m[0] for m in matches]) if matches else np.array([], dtype=np.int64)
+    starts = events['window_start'].to_numpy().astype('datetime64[h]').astype(np.int64)
+    ends = events['window_end'].to_numpy().astype('datetime64[h]').astype(np.int64) + 1
+
+    # Only the days the windows and their baselines touch are read
+    dates = set()
+    offset = timedelta(days=BASELINE_OFFSET_DAYS)
+    for start, end in zip(events['window_start'], events['window_end']):
+        for day in pd.date_range(start.normalize(), end.normalize()):
+            dates.add(day.date().isoformat())
+            dates.add((day - offset).date().isoformat())
+    keys, cumulative = _hourly_counts(zones, dates)
+
+    shift = BASELINE_OFFSET_DAYS * 24
+    trips = _window_trips(keys, cumulative, pair_zone, starts[pair_event], ends[pair_event])
+    baseline = _window_trips(keys, cumulative, pair_zone, starts[pair_event] - shift, ends[pair_event] - shift)
+
+    result = pd.DataFrame({
+        'event_id': events['event_id'].to_numpy(),
+        'event_date': events['start'].dt.date.to_numpy(),
+        'window_start': events['window_start'].to_numpy(),
+        'window_end': events['window_end'].to_numpy(),
+        'matched_by': [m[1] for m in matches],
+        'zones': [", ".join(zones['zone'].iloc[m[0]]) for m in matches],
+        'trips': np.bincount(pair_event, weights=trips, minlength=len(events)).astype(np.int64),
+        'baseline_trips': np.bincount(pair_event, weights=baseline, minlength=len(events)).astype(np.int64),
+    })
+    result['lift'] = np.where(result['baseline_trips'] > 0,
+                              result['trips'] / result['baseline_trips'].clip(lower=1) - 1.0, np.nan)
+    return result
+
+
+def store_attribution(cur, attribution):
+    cur.execute(CREATE_ATTRIBUTION_SQL)
+    if attribution.empty:
+        return
+    rows = [
+        (int(r.event_id), r.event_date, pd.Timestamp(r.window_start).to_pydatetime(),
+         pd.Timestamp(r.window_end).to_pydatetime(), r.matched_by, r.zones,
+         int(r.trips), int(r.baseline_trips), None if np.isnan(r.lift) else float(r.lift))
+        for r in attribution.itertuples()
+    ]
+    execute_values(cur, """
+    INSERT INTO event_trip_attribution VALUES %s
+    ON CONFLICT (event_id) DO UPDATE SET
+        event_date = EXCLUDED.event_date,
+        window_start = EXCLUDED.window_start,
+        window_end = EXCLUDED.window_end,
+        matched_by = EXCLUDED.matched_by,
+        zones = EXCLUDED.zones,
+        trips = EXCLUDED.trips,
+        baseline_trips = EXCLUDED.baseline_trips,
+        lift = EXCLUDED.lift
+    """, rows)
+
+
+def refresh_event_attribution(cur, days=None, last_event_id=None):
+    """Attribute events newer than last_event_id plus events near days whose trips changed.
+
+    Returns (events attributed, highest event id seen).
+    """
+    conditions = []
+    if last_event_id is not None:
+        conditions.append(f"id > {int(last_event_id)}")
+    if days:
+        # A changed day can fall in an event's window or in its baseline a week earlier
+        day_values = ", ".join(f"('{d}')" for d in days)
+        conditions.append(f"""
+        EXISTS (
+            SELECT 1 FROM (VALUES {day_values}) d(day)
+            WHERE d.day::date BETWEEN DATE(event_datetime) - {BASELINE_OFFSET_DAYS + 1} AND DATE(event_datetime) + 1
+        )""")
+    where_clause = " OR ".join(f"({c})" for c in conditions) if conditions else "1=1"
+
+    events = load_events(where_clause)
+    store_attribution(cur, attribute_events(events))
+    if events.empty:
+        return 0, last_event_id
+    return len(events), max(int(events['event_id'].max()), int(last_event_id or 0))
+
+
+if __name__ == "__main__":
+    conn = get_connection()
+    if conn is None:
+        print("Could not connect to the database")
+    else:
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                n_events, _ = refresh_event_attribution(cur)
+            conn.commit()
+            print(f"Attributed trips for {n_events:,} events")
+        finally:
+            conn.close()
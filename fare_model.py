@@ -0,0 +1,385 @@
+import os
+import threading
+
+import numpy as np
+from scipy import sparse
+
+from taxi_db import DATA_DIR, get_connection, execute_query
+
+MODEL_PATH = os.path.join(DATA_DIR, "fare_model.npz")
+
+# What the model predicts; the same components the analyzer breaks a trip into
+TARGETS = ['fare_amount', 'tip_amount', 'extra', 'tolls_amount', 'congestion_surcharge', 'total_amount']
+
+# Piecewise-linear distance basis: distance plus hinges max(0, distance - knot)
+DISTANCE_KNOTS = np.array([1.0, 2.0, 3.0, 5.0, 8.0, 12.0, 18.0], dtype=np.float64)
+
+# Prediction interval reported alongside the point estimate
+INTERVAL_QUANTILES = (0.1, 0.9)
+RESIDUAL_BINS = 20
+
+RIDGE_PENALTY = 1.0
+CHUNK_ROWS = 100_000
+# Held-out trips kept for interval calibration, sampled uniformly from the pass
+HOLDOUT_ROWS = 200_000
+
+TRAINING_QUERY = """
+SELECT
+    trip_distance,
+    EXTRACT(HOUR FROM pickup_time::time)::int as pickup_hour,
+    (EXTRACT(ISODOW FROM pickup_date::date) - 1)::int as pickup_dow,
+    pickup_borough,
+    dropoff_borough,
+    pickup_zone,
+    dropoff_zone,
+    COALESCE(fare_amount, 0),
+    COALESCE(tip_amount, 0),
+    COALESCE(extra, 0),
+    COALESCE(tolls_amount, 0),
+    COALESCE(congestion_surcharge, 0),
+    total_amount
+FROM
+    taxi_trips
+WHERE
+    pickup_time IS NOT NULL AND
+    pickup_date IS NOT NULL AND
+    trip_distance > 0 AND
+    trip_distance < 100 AND
+    total_amount > 0
+"""
+
+
+def _distance_basis(distance):
+    distance = np.asarray(distance, dtype=np.float64).reshape(-1, 1)
+    return np.hstack([distance, np.maximum(0.0, distance - DISTANCE_KNOTS)])
+
+
+class FareModel:
+    """Additive model: intercept + distance basis + one-hot hour, weekday, boroughs and zones.
+
+    Because every categorical block is one-hot, scoring is a handful of
+    array gathers and one small matrix product, so whole batches score in
+    microseconds. Intervals come from residual quantiles binned by the
+    predicted total. Zone counts per borough (trips seen in training) let a
+    trip given only by boroughs be scored as the average over their zones.
+    """
+
+    def __init__(self, coef, boroughs, zones, residual_edges, residual_quantiles,
+                 pickup_zone_counts=None, dropoff_zone_counts=None):
+        self.coef = coef
+        self.boroughs = list(boroughs)
+        self.zones = list(zones)
+        self.residual_edges = residual_edges
+        self.residual_quantiles = residual_quantiles
+        shape = (len(self.boroughs), len(self.zones))
+        self.pickup_zone_counts = np.zeros(shape) if pickup_zone_counts is None else pickup_zone_counts
+        self.dropoff_zone_counts = np.zeros(shape) if dropoff_zone_counts is None else dropoff_zone_counts
+        self._borough_index = {b: i for i, b in enumerate(self.boroughs)}
+        self._zone_index = {z: i for i, z in enumerate(self.zones)}
+        self._slices = _block_slices(len(self.boroughs), len(self.zones))
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with np.load(path, allow_pickle=False) as f:
+            return cls(
+                f['coef'].astype(np.float64),
+                f['boroughs'].tolist(),
+                f['zones'].tolist(),
+                f['residual_edges'],
+                f['residual_quantiles'],
+                # Models saved before zone counts were kept score unknown zones as zero
+                f['pickup_zone_counts'] if 'pickup_zone_counts' in f.files else None,
+                f['dropoff_zone_counts'] if 'dropoff_zone_counts' in f.files else None
+            )
+
+    def save(self, path=MODEL_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(
+            path,
+            coef=self.coef.astype(np.float32),
+            boroughs=np.array(self.boroughs, dtype=str),
+            zones=np.array(self.zones, dtype=str),
+            residual_edges=self.residual_edges.astype(np.float32),
+            residual_quantiles=self.residual_quantiles.astype(np.float32),
+            pickup_zone_counts=self.pickup_zone_counts.astype(np.float32),
+            dropoff_zone_counts=self.dropoff_zone_counts.astype(np.float32)
+        )
+
+    def _lookup(self, index, values, n):
+        # Unknown categories map to a zero coefficient (the "other" slot at n)
+        values = np.atleast_1d(values)
+        return np.array([index.get(v, n) for v in values], dtype=np.int64)
+
+    def _zone_average(self, counts, block):
+        # Per borough, the zone coefficients weighted by the zones' share of its
+        # trips; zero for unknown boroughs
+        totals = counts.sum(axis=1, keepdims=True)
+        shares = np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+        return _padded(shares @ block)
+
+    def predict(self, distance, hour, dow, pickup_borough, dropoff_borough,
+                pickup_zone=None, dropoff_zone=None):
+        """Point estimates for every target, shape (n, len(TARGETS)).
+
+        Without zones, each zone term is its borough's trip-weighted average,
+        as the fit split location effects between boroughs and zones.
+        """
+        distance = np.atleast_1d(np.asarray(distance, dtype=np.float64))
+        n = len(distance)
+        hour = np.broadcast_to(np.asarray(hour, dtype=np.int64), (n,))
+        dow = np.broadcast_to(np.asarray(dow, dtype=np.int64), (n,))
+
+        nb, nz = len(self.boroughs), len(self.zones)
+        pb = np.broadcast_to(self._lookup(self._borough_index, pickup_borough, nb), (n,))
+        db = np.broadcast_to(self._lookup(self._borough_index, dropoff_borough, nb), (n,))
+
+        coef = self.coef
+        s = self._slices
+        pred = coef[s['intercept']].reshape(1, -1) + _distance_basis(distance) @ coef[s['distance']]
+        pred += coef[s['hour']][hour]
+        pred += coef[s['dow']][dow]
+        pred += _padded(coef[s['pickup_borough']])[pb]
+        pred += _padded(coef[s['dropoff_borough']])[db]
+        for zone, borough, counts, block in [(pickup_zone, pb, self.pickup_zone_counts, coef[s['pickup_zone']]),
+                                             (dropoff_zone, db, self.dropoff_zone_counts, coef[s['dropoff_zone']])]:
+            if zone is None:
+                pred += self._zone_average(counts, block)[borough]
+            else:
+                pred += _padded(block)[np.broadcast_to(self._lookup(self._zone_index, zone, nz), (n,))]
+        return np.maximum(pred, 0.0)
+
+    def predict_interval(self, predictions):
+        """Low/high bounds for each target given point predictions from predict()"""
+        total = predictions[:, TARGETS.index('total_amount')]
+        bins = np.clip(np.searchsorted(self.residual_edges, total, side='right') - 1,
+                       0, len(self.residual_edges) - 2)
+        # residual_quantiles: (bins, targets, 2)
+        offsets = self.residual_quantiles[bins]
+        low = np.maximum(predictions + offsets[:, :, 0], 0.0)
+        high = np.maximum(predictions + offsets[:, :, 1], 0.0)
+        return low, high
+
+
+def _padded(block):
+    # Extra zero row for categories the model never saw
+    return np.vstack([block, np.zeros((1, block.shape[1]))])
+
+
+def _block_slices(n_boroughs, n_zones):
+    sizes = [
+        ('intercept', 1),
+        ('distance', 1 + len(DISTANCE_KNOTS)),
+        ('hour', 24),
+        ('dow', 7),
+        ('pickup_borough', n_boroughs),
+        ('dropoff_borough', n_boroughs),
+        ('pickup_zone', n_zones),
+        ('dropoff_zone', n_zones),
+    ]
+    slices, start = {}, 0
+    for name, size in sizes:
+        slices[name] = slice(start, start + size)
+        start += size
+    slices['n_features'] = start
+    return slices
+
+
+def _design_matrix(chunk, borough_index, zone_index, slices):
+    # Sparse: of the ~600 columns a row has the distance basis and at most six ones
+    n = len(chunk['trip_distance'])
+    rows = np.arange(n)
+    basis = _distance_basis(chunk['trip_distance'])
+    entries = [
+        (rows, np.full(n, slices['intercept'].start), np.ones(n)),
+        (np.repeat(rows, basis.shape[1]), np.tile(np.arange(slices['distance'].start, slices['distance'].stop), n),
+         basis.ravel()),
+        (rows, slices['hour'].start + chunk['pickup_hour'], np.ones(n)),
+        (rows, slices['dow'].start + chunk['pickup_dow'], np.ones(n)),
+    ]
+    for column, index in [('pickup_borough', borough_index), ('dropoff_borough', borough_index),
+                          ('pickup_zone', zone_index), ('dropoff_zone', zone_index)]:
+        codes = np.array([index.get(v, -1) for v in chunk[column]], dtype=np.int64)
+        known = codes >= 0
+        entries.append((rows[known], slices[column].start + codes[known], np.ones(known.sum())))
+    r, c, v = (np.concatenate(parts) for parts in zip(*entries))
+    return sparse.csr_matrix((v, (r, c)), shape=(n, slices['n_features']))
+
+
+def _take(chunk, rows):
+    return {k: (v[rows] if isinstance(v, np.ndarray) else np.asarray(v, dtype=object)[rows])
+            for k, v in chunk.items()}
+
+
+class _Reservoir:
+    """A uniform sample of at most size rows from chunks streamed through add()"""
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.seen = 0
+        self.rows = None
+
+    def add(self, chunk):
+        n = len(chunk['trip_distance'])
+        if n == 0:
+            return
+        # Algorithm R, a chunk at a time: the t-th row replaces a random slot
+        # with probability size / (t + 1)
+        t = self.seen + np.arange(n)
+        slots = np.where(t < self.size, t, self.rng.integers(0, t + 1))
+        keep = slots < self.size
+        self.seen += n
+        chunk = _take(chunk, keep)
+        slots = slots[keep]
+        if self.rows is None:
+            self.rows = {k: np.empty((self.size,) + v.shape[1:], dtype=v.dtype) for k, v in chunk.items()}
+        for k, v in chunk.items():
+            self.rows[k][slots] = v
+
+    def sample(self):
+        if self.rows is None:
+            return None
+        return {k: v[:min(self.seen, self.size)] for k, v in self.rows.items()}
+
+
+def _iter_training_chunks(where_clause="1=1"):
+    conn = get_connection()
+    if conn is None:
+        return
+    conn.autocommit = False
+    try:
+        # Named cursor streams rows from the server instead of loading them all
+        with conn.cursor(name="fare_model_training") as cur:
+            cur.itersize = CHUNK_ROWS
+            cur.execute(TRAINING_QUERY + f" AND {where_clause}")
+            while True:
+                rows = cur.fetchmany(CHUNK_ROWS)
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                yield {
+                    'trip_distance': np.array(columns[0], dtype=np.float64),
+                    'pickup_hour': np.array(columns[1], dtype=np.int64) % 24,
+                    'pickup_dow': np.array(columns[2], dtype=np.int64) % 7,
+                    'pickup_borough': columns[3],
+                    'dropoff_borough': columns[4],
+                    'pickup_zone': columns[5],
+                    'dropoff_zone': columns[6],
+                    'targets': np.array(columns[7:], dtype=np.float64).T
+                }
+    finally:
+        conn.close()
+
+
+def train_fare_model(where_clause="1=1", holdout_fraction=0.1, seed=0):
+    """Fit the model from taxi_trips in one streaming pass, then calibrate intervals"""
+    boroughs = execute_query(
+        "SELECT DISTINCT pickup_borough as b FROM taxi_trips WHERE pickup_borough != '' "
+        "UNION SELECT DISTINCT dropoff_borough FROM taxi_trips WHERE dropoff_borough != '' ORDER BY 1"
+    )
+    zones = execute_query(
+        "SELECT DISTINCT pickup_zone as z FROM taxi_trips WHERE pickup_zone != '' "
+        "UNION SELECT DISTINCT dropoff_zone FROM taxi_trips WHERE dropoff_zone != '' ORDER BY 1"
+    )
+    if boroughs.empty or zones.empty:
+        return None
+    boroughs = boroughs.iloc[:, 0].tolist()
+    zones = zones.iloc[:, 0].tolist()
+    borough_index = {b: i for i, b in enumerate(boroughs)}
+    zone_index = {z: i for i, z in enumerate(zones)}
+    slices = _block_slices(len(boroughs), len(zones))
+
+    # Accumulate the normal equations chunk by chunk; hold a random slice out
+    # to calibrate the intervals on trips the fit didn't see
+    rng = np.random.default_rng(seed)
+    XtX = np.zeros((slices['n_features'], slices['n_features']))
+    Xty = np.zeros((slices['n_features'], len(TARGETS)))
+    holdout = _Reservoir(HOLDOUT_ROWS, rng)
+    zone_counts = {side: np.zeros((len(boroughs), len(zones))) for side in ['pickup', 'dropoff']}
+    for chunk in _iter_training_chunks(where_clause):
+        for side, counts in zone_counts.items():
+            b = np.array([borough_index.get(v, -1) for v in chunk[f'{side}_borough']], dtype=np.int64)
+            z = np.array([zone_index.get(v, -1) for v in chunk[f'{side}_zone']], dtype=np.int64)
+            known = (b >= 0) & (z >= 0)
+            np.add.at(counts, (b[known], z[known]), 1)
+        held = rng.random(len(chunk['trip_distance'])) < holdout_fraction
+        fit = _design_matrix(_take(chunk, ~held), borough_index, zone_index, slices)
+        XtX += (fit.T @ fit).toarray()
+        Xty += fit.T @ chunk['targets'][~held]
+        holdout.add(_take(chunk, held))
+
+    held = holdout.sample()
+    if held is None:
+        return None
+
+    penalty = RIDGE_PENALTY * np.eye(slices['n_features'])
+    penalty[0, 0] = 0.0  # don't shrink the intercept
+    coef = np.linalg.solve(XtX + penalty, Xty)
+
+    pred = _design_matrix(held, borough_index, zone_index, slices) @ coef
+    residuals = held['targets'] - pred
+
+    # Interval calibration: residual quantiles within bins of predicted total
+    total_pred = pred[:, TARGETS.index('total_amount')]
+    edges = np.unique(np.quantile(total_pred, np.linspace(0, 1, RESIDUAL_BINS + 1)))
+    edges[0], edges[-1] = -np.inf, np.inf
+    bins = np.clip(np.searchsorted(edges, total_pred, side='right') - 1, 0, len(edges) - 2)
+    quantiles = np.zeros((len(edges) - 1, len(TARGETS), 2))
+    for b in range(len(edges) - 1):
+        in_bin = residuals[bins == b]
+        if len(in_bin):
+            quantiles[b] = np.quantile(in_bin, INTERVAL_QUANTILES, axis=0).T
+
+    return FareModel(coef, boroughs, zones, edges, quantiles, zone_counts['pickup'], zone_counts['dropoff'])
+
+
+# Loaded once per process and shared by every session
+_model = None
+_model_mtime = None
+_model_lock = threading.Lock()
+
+
+def get_fare_model(path=MODEL_PATH):
+    """The trained model, or None if it hasn't been built yet"""
+    global _model, _model_mtime
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _model_lock:
+        if _model is None or _model_mtime != mtime:
+            _model = FareModel.load(path)
+            _model_mtime = mtime
+        return _model
+
+
+def estimate_trip(pickup_borough, dropoff_borough, hours, trip_distance, dows=range(7)):
+    """Average model estimate over a set of hours and weekdays.
+
+    Returns a dict with the analyzer's avg_* keys plus total_low/total_high,
+    or None when no model is available.
+    """
+    model = get_fare_model()
+    if model is None:
+        return None
+    hour_grid, dow_grid = np.meshgrid(np.asarray(list(hours)), np.asarray(list(dows)))
+    hour_grid, dow_grid = hour_grid.ravel(), dow_grid.ravel()
+    pred = model.predict(np.full(len(hour_grid), trip_distance), hour_grid, dow_grid,
+                         pickup_borough, dropoff_borough)
+    low, high = model.predict_interval(pred)
+
+    names = ['avg_fare', 'avg_tip', 'avg_extra', 'avg_tolls', 'avg_congestion', 'avg_total']
+    estimate = dict(zip(names, pred.mean(axis=0)))
+    total = TARGETS.index('total_amount')
+    estimate['total_low'] = float(low[:, total].mean())
+    estimate['total_high'] = float(high[:, total].mean())
+    return estimate
+
+
+if __name__ == "__main__":
+    model = train_fare_model()
+    if model is None:
+        print("No training data available")
+    else:
+        model.save()
+        print(f"Saved fare model to {MODEL_PATH}")
@@ -1,14 +1,24 @@
-import streamlit as t
+import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-import psycopg2
 import calendar
+import uuid
 from datetime import datetime, timedelta
 import json
 
+from taxi_figures import downsample_series
+from query_cache import warm_up
+from dashboard_cache import connect, fetch_cached, fetch_query, coverage, start_warmer, warm_queries
+from analytics_pool import submit
+from dashboard_queries import (
+    MONTHS, CORRELATION_PERIODS, CALENDAR_MONTH, CALENDAR_DAY,
+    OVERVIEW_QUERY, BOROUGH_QUERY, table_exists_query, month_bounds, daily_trips_query, correlation_query,
+    daily_anomalies_query, events_query, get_monthly_metrics, format_event
+)
+
 # Set page configuration
 st.set_page_config(
     page_title="NYC Taxi & Events Analysis",
@@ -119,33 +129,36 @@ st.markdown("""
 @st.cache_resource
 def init_connection():
     try:
-        return psycopg2.connect(
+        return connect(dict(
             dbname=st.secrets["db_name"],
             user=st.secrets["db_user"],
             password=st.secrets["db_password"],
             host=st.secrets["db_host"],
             port=st.secrets["db_port"]
-        )
+        ))
     except Exception as e:
         st.error(f"Database connection error: {e}")
         # For demo purposes, return None so we can use sample data
         return None
 
-# Execute query with caching
-@st.cache_data(ttl=600)
+# Execute query with caching. Expired results are served while they are
+# refreshed in the background (see dashboard_cache.py)
 def run_query(query):
-    conn = init_connection()
-    if conn is None:
+    if init_connection() is None:
         # Return sample data if connection failed
         return None
-    
     try:
-        return pd.read_sql_query(query, conn)
+        return fetch_cached(query)
     except Exception as e:
         st.error(f"Query execution error: {e}")
         return None
-    finally:
-        conn.close()
+
+# A fresh process re-reads the most requested queries from the disk cache,
+# and the dashboard's fixed queries are kept fresh from then on. Both run on
+# background threads, so they use dashboard_cache's Streamlit-free fetch
+if init_connection() is not None:
+    warm_up('dashboard', fetch_cached)
+    start_warmer(warm_queries, fetch_query)
 
 # Sample data generator functions (used when DB connection fails or for development)
 def get_sample_overview_data():
@@ -171,6 +184,17 @@ def get_sample_monthly_data(month="July", year=2023):
         "peak_day_date": "Dec 15"
     }
 
+# Surge and dip zone-hours per day from trip_anomalies (see trip_anomalies.py),
+# or None when the detector hasn't been run
+def get_daily_anomalies(start_date, end_date):
+    if not table_exists("trip_anomalies"):
+        return None
+    return run_query(daily_anomalies_query(start_date, end_date))
+
+def table_exists(table_name):
+    result = run_query(table_exists_query(table_name))
+    return result is not None and not result.empty and bool(result.iloc[0]['present'])
+
 def get_sample_daily_trips(month="July", year=2023):
     days = 31 if month in ["January", "March", "May", "July", "August", "October", "December"] else 30
     if month == "February":
@@ -275,6 +299,13 @@ def get_sample_events_by_day(month="July", year=2023, day=14):
     else:
         return []
 
+# Events of one day with the taxi demand attributed to each (see event_attribution.py)
+def get_events_for_day(day):
+    day_events = run_query(events_query(day, day, table_exists("event_trip_attribution")))
+    if day_events is None or day_events.empty:
+        return []
+    return [format_event(row) for _, row in day_events.iterrows()]
+
 def generate_calendar_days(year, month):
     # Create a calendar for the selected month
     cal = calendar.monthcalendar(year, month)
@@ -292,292 +323,70 @@ def generate_calendar_days(year, month):
     
     return formatted_cal, month_name
 
-# App Header
-st.markdown("<div class='dashboard-title'>NYC Taxi & Events Analysis</div>", unsafe_allow_html=True)
-st.markdown("<div class='dashboard-subtitle'>Interactive dashboard showing the relationship between NYC taxi demand and events</div>", unsafe_allow_html=True)
-
-# Overview Section
-st.markdown("<div class='dashboard-container'>", unsafe_allow_html=True)
-st.markdown("<div class='dashboard-title' style='font-size: 20px;'>Overview</div>", unsafe_allow_html=True)
-st.markdown("<div class='dashboard-subtitle'>Key metrics from NYC taxi trips and events (June-Dec 2023)</div>", unsafe_allow_html=True)
-
-tab1, tab2 = st.tabs(["Taxi Data", "Events Data"])
-
-with tab1:
-    # Attempt to get data from DB
-    query = """
-    SELECT 
-        COUNT(*) as total_trips,
-        AVG(daily_trips) as avg_daily_trips,
-        MAX(peak_borough) as peak_borough,
-        MAX(peak_day) as peak_day
-    FROM nyc_taxi_overview
-    """
-    db_data = run_query(query)
-    
-    # Use sample data if DB query failed
-    data = get_sample_overview_data() if db_data is None else {
-        "total_trips": f"{db_data['total_trips'].iloc[0]/1000000:.1f}M",
-        "avg_daily_trips": f"{db_data['avg_daily_trips'].iloc[0]:,.0f}",
-        "peak_borough": db_data['peak_borough'].iloc[0],
-        "peak_day": db_data['peak_day'].iloc[0]
-    }
-    
-    # Display metrics
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-title'>Total Trips</div>", unsafe_allow_html=True)
-        st.markdown(f"<div class='metric-value'>{data['total_trips']}</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-subtitle'>Jan-Dec 2023</div>", unsafe_allow_html=True)
-        st.markdown("</div>", unsafe_allow_html=True)
-    
-    with col2:
-        st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-title'>Avg. Daily Trips</div>", unsafe_allow_html=True)
-        st.markdown(f"<div class='metric-value'>{data['avg_daily_trips']}</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-subtitle'>Per day</div>", unsafe_allow_html=True)
-        st.markdown("</div>", unsafe_allow_html=True)
-    
-    with col3:
-        st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-title'>Peak Borough</div>", unsafe_allow_html=True)
-        st.markdown(f"<div class='metric-value'>{data['peak_borough']}</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-subtitle'>Most trips</div>", unsafe_allow_html=True)
-        st.markdown("</div>", unsafe_allow_html=True)
-    
-    with col4:
-        st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-title'>Peak Day</div>", unsafe_allow_html=True)
-        st.markdown(f"<div class='metric-value'>{data['peak_day']}</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-subtitle'>Highest demand</div>", unsafe_allow_html=True)
-        st.markdown("</div>", unsafe_allow_html=True)
-
-with tab2:
-    # Similar structure for Events tab (simplified for now)
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-title'>Total Events</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-value'>1,456</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-subtitle'>Jan-Dec 2023</div>", unsafe_allow_html=True)
-        st.markdown("</div>", unsafe_allow_html=True)
-    
-    with col2:
-        st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-title'>Avg. Daily Events</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-value'>4.2</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-subtitle'>Per day</div>", unsafe_allow_html=True)
-        st.markdown("</div>", unsafe_allow_html=True)
-    
-    with col3:
-        st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-title'>Top Event Type</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-value'>Street Fair</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-subtitle'>342 events</div>", unsafe_allow_html=True)
-        st.markdown("</div>", unsafe_allow_html=True)
-    
-    with col4:
-        st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-title'>Peak Month</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-value'>July</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-subtitle'>187 events</div>", unsafe_allow_html=True)
-        st.markdown("</div>", unsafe_allow_html=True)
-
-st.markdown("</div>", unsafe_allow_html=True)
-
-# Daily Taxi Trips Section
-st.markdown("<div class='dashboard-container'>", unsafe_allow_html=True)
-col1, col2 = st.columns([3, 1])
-
-with col1:
-    st.markdown("<div class='dashboard-title' style='font-size: 20px;'>Daily Taxi Trips</div>", unsafe_allow_html=True)
-    st.markdown("<div class='dashboard-subtitle'>Daily taxi trip volume by month</div>", unsafe_allow_html=True)
-
-with col2:
-    month_options = ["January", "February", "March", "April", "May", "June", 
-                    "July", "August", "September", "October", "November", "December"]
-    selected_month = st.selectbox("Select Month", month_options, index=6)  # Default to July
-
-# Query for daily trips by month
-query = f"""
-SELECT 
-    date_trunc('day', trip_datetime) as trip_date,
-    COUNT(*) as trip_count,
-    CASE WHEN EXISTS (
-        SELECT 1 FROM nyc_events 
-        WHERE DATE(event_datetime) = DATE(trip_datetime)
-    ) THEN TRUE ELSE FALSE END as is_event_day
-FROM nyc_taxi_trips
-WHERE EXTRACT(MONTH FROM trip_datetime) = {month_options.index(selected_month) + 1}
-AND EXTRACT(YEAR FROM trip_datetime) = 2023
-GROUP BY trip_date
-ORDER BY trip_date
-"""
-db_daily_data = run_query(query)
-
-# Use sample data if DB query failed
-daily_data = get_sample_daily_trips(selected_month) if db_daily_data is None else db_daily_data
-
-# Monthly metrics
-monthly_metrics = get_sample_monthly_data(selected_month)
-
-col1, col2, col3 = st.columns(3)
-
-with col1:
-    st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-    st.markdown("<div class='metric-title'>Total Trips</div>", unsafe_allow_html=True)
-    st.markdown(f"<div class='metric-value'>{monthly_metrics['total_trips']}</div>", unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
-
-with col2:
-    st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-    st.markdown("<div class='metric-title'>Average Daily</div>", unsafe_allow_html=True)
-    st.markdown(f"<div class='metric-value'>{monthly_metrics['avg_daily']}</div>", unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
-
-with col3:
-    st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-    st.markdown("<div class='metric-title'>Peak Day</div>", unsafe_allow_html=True)
-    st.markdown(f"<div class='metric-value'>{monthly_metrics['peak_day']}</div>", unsafe_allow_html=True)
-    st.markdown(f"<div class='metric-subtitle'>{monthly_metrics['peak_day_date']}</div>", unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
-
-# Daily trips chart
-fig = px.bar(daily_data, 
-             x='date', 
-             y='trips',
-             color='is_event',
-             color_discrete_map={True: '#6c5ce7', False: '#a29bfe'},
-             labels={'date': '', 'trips': 'Taxi Trips', 'is_event': 'Event Day'})
-
-fig.update_layout(
-    height=350,
-    margin=dict(l=20, r=20, t=30, b=20),
-    paper_bgcolor='white',
-    plot_bgcolor='white',
-    hovermode='x unified',
-    yaxis=dict(
-        gridcolor='#f0f0f0',
-        range=[4000, 7000]
-    ),
-    xaxis=dict(
-        gridcolor='#f0f0f0'
-    ),
-    showlegend=False
-)
-
-st.plotly_chart(fig, use_container_width=True)
-
-# Legend for event days
-col1, col2 = st.columns([1, 3])
-with col1:
-    st.markdown("""
-    <div style="display: flex; align-items: center; margin-right: 20px;">
-        <div style="width: 12px; height: 12px; background-color: #6c5ce7; margin-right: 5px;"></div>
-        <span style="font-size: 14px;">Event day</span>
-    </div>
-    """, unsafe_allow_html=True)
-with col2:
-    st.markdown("""
-    <div style="display: flex; align-items: center;">
-        <div style="width: 12px; height: 12px; background-color: #a29bfe; margin-right: 5px;"></div>
-        <span style="font-size: 14px;">Regular day</span>
-    </div>
-    """, unsafe_allow_html=True)
-
-# Event count
-st.markdown("<div style='font-size: 14px; color: #666; margin-top: 10px;'>2 major events in July 2023</div>", unsafe_allow_html=True)
-
-st.markdown("</div>", unsafe_allow_html=True)
-
-# Taxi Trips by Borough Section
-st.markdown("<div class='dashboard-container'>", unsafe_allow_html=True)
-st.markdown("<div class='dashboard-title' style='font-size: 20px;'>Taxi Trips by Borough</div>", unsafe_allow_html=True)
-st.markdown("<div class='dashboard-subtitle'>Distribution of taxi pickups across NYC boroughs</div>", unsafe_allow_html=True)
-
-# Query for borough data
-query = """
-SELECT 
-    borough,
-    COUNT(*) as trip_count,
-    ROUND(100.0 * COUNT(*) / SUM(COUNT(*)) OVER (), 1) as percentage
-FROM nyc_taxi_trips
-GROUP BY borough
-ORDER BY trip_count DESC
-"""
-db_borough_data = run_query(query)
-
-# Use sample data if DB query failed
-borough_data = get_sample_borough_data() if db_borough_data is None else db_borough_data
-
-# Borough pie chart
-colors = ['#e74c3c', '#e67e22', '#f1c40f', '#ecf0f1', '#bdc3c7']
-fig = px.pie(borough_data, 
-             values='percentage', 
-             names='borough',
-             color_discrete_sequence=colors)
-
-fig.update_traces(textposition='inside', textinfo='percent+label')
-fig.update_layout(
-    height=350,
-    margin=dict(l=20, r=20, t=30, b=20),
-    showlegend=False
-)
-
-st.plotly_chart(fig, use_container_width=True)
-
-# Borough legend
-col1, col2, col3, col4, col5 = st.columns(5)
-boroughs = ["Manhattan", "Brooklyn", "Queens", "Bronx", "Staten Island"]
-colors = ['#e74c3c', '#e67e22', '#f1c40f', '#ecf0f1', '#bdc3c7']
+# Memoized figure builders. st.cache_data hashes the input frame, so a figure is
+# only rebuilt when its section's data actually changes.
+@st.cache_data(ttl=600)
+def build_daily_trips_figure(daily_data, anomalies=None):
+    fig = px.bar(daily_data, 
+                 x='date', 
+                 y='trips',
+                 color='is_event',
+                 color_discrete_map={True: '#6c5ce7', False: '#a29bfe'},
+                 labels={'date': '', 'trips': 'Taxi Trips', 'is_event': 'Event Day'})
+
+    # Mark days with detected surges/dips on top of their bars
+    if anomalies is not None and not anomalies.empty:
+        marked = daily_data.assign(date=pd.to_datetime(daily_data['date']).dt.normalize()).merge(
+            anomalies.assign(date=pd.to_datetime(anomalies['date'])), on='date')
+        for kind, symbol, color in [('surges', 'triangle-up', '#e74c3c'), ('dips', 'triangle-down', '#0984e3')]:
+            days = marked[marked[kind] > 0]
+            fig.add_trace(go.Scatter(
+                x=days['date'],
+                y=days['trips'],
+                mode='markers',
+                marker=dict(symbol=symbol, size=10, color=color),
+                name=kind.capitalize(),
+                customdata=days[kind],
+                hovertemplate=f"%{{customdata}} zone-hour {kind}<extra></extra>"
+            ))
 
-for i, col in enumerate([col1, col2, col3, col4, col5]):
-    with col:
-        st.markdown(f"""
-        <div style="display: flex; align-items: center;">
-            <div style="width: 12px; height: 12px; border-radius: 50%; background-color: {colors[i]}; margin-right: 5px;"></div>
-            <span>{boroughs[i]}</span>
-        </div>
-        """, unsafe_allow_html=True)
+    fig.update_layout(
+        height=350,
+        margin=dict(l=20, r=20, t=30, b=20),
+        paper_bgcolor='white',
+        plot_bgcolor='white',
+        hovermode='x unified',
+        yaxis=dict(
+            gridcolor='#f0f0f0',
+            range=[4000, 7000]
+        ),
+        xaxis=dict(
+            gridcolor='#f0f0f0'
+        ),
+        showlegend=False
+    )
+    return fig
 
-st.markdown("</div>", unsafe_allow_html=True)
+@st.cache_data(ttl=600)
+def build_borough_figure(borough_data):
+    colors = ['#e74c3c', '#e67e22', '#f1c40f', '#ecf0f1', '#bdc3c7']
+    fig = px.pie(borough_data, 
+                 values='percentage', 
+                 names='borough',
+                 color_discrete_sequence=colors)
+
+    fig.update_traces(textposition='inside', textinfo='percent+label')
+    fig.update_layout(
+        height=350,
+        margin=dict(l=20, r=20, t=30, b=20),
+        showlegend=False
+    )
+    return fig
 
-# Correlation Analysis Section
-st.markdown("<div class='dashboard-container'>", unsafe_allow_html=True)
-col1, col2 = st.columns([3, 1])
-
-with col1:
-    st.markdown("<div class='dashboard-title' style='font-size: 20px;'>Correlation Analysis</div>", unsafe_allow_html=True)
-    st.markdown("<div class='dashboard-subtitle'>Relationship between NYC events and taxi demand</div>", unsafe_allow_html=True)
-
-with col2:
-    time_options = ["All Time (Jun-Dec)", "Q2 2023", "Q3 2023", "Q4 2023"]
-    selected_time = st.selectbox("Select Time Period", time_options)
-
-tab1, tab2 = st.tabs(["Time Series", "Lag Analysis"])
-
-with tab1:
-    # Query for correlation data
-    query = """
-    SELECT 
-        date_trunc('day', t.trip_datetime) as date,
-        COUNT(DISTINCT t.id) as taxi_trips,
-        COUNT(DISTINCT e.id) as events
-    FROM nyc_taxi_trips t
-    LEFT JOIN nyc_events e ON DATE(t.trip_datetime) = DATE(e.event_datetime)
-    WHERE t.trip_datetime BETWEEN '2023-06-01' AND '2023-12-31'
-    GROUP BY date
-    ORDER BY date
-    """
-    db_correlation_data = run_query(query)
-    
-    # Use sample data if DB query failed
-    correlation_data = get_sample_correlation_data() if db_correlation_data is None else db_correlation_data
-    
-    # Create time series chart
+@st.cache_data(ttl=600)
+def build_correlation_figure(correlation_data):
+    # Keep the payload bounded however long the selected period is
+    correlation_data = downsample_series(correlation_data, 'date', 'taxi_trips')
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     
     # Add taxi trips line
@@ -631,217 +440,519 @@ with tab1:
         range=[0, 28],
         secondary_y=True
     )
+    return fig
+
+@st.cache_data(ttl=600)
+def build_lag_figure(lag_data):
+    colors = ['#6c5ce7' if r >= 0 else '#fab1a0' for r in lag_data['correlation'].fillna(0)]
+    fig = go.Figure(go.Bar(
+        x=lag_data['lag'],
+        y=lag_data['correlation'],
+        marker_color=colors,
+        hovertemplate="Lag %{x} days: r = %{y:.2f}<extra></extra>"
+    ))
+    fig.update_layout(
+        height=350,
+        margin=dict(l=20, r=20, t=30, b=20),
+        paper_bgcolor='white',
+        plot_bgcolor='white',
+        xaxis=dict(title='Days taxi demand lags events', gridcolor='#f0f0f0', dtick=1),
+        yaxis=dict(title='Correlation', gridcolor='#f0f0f0', range=[-1, 1])
+    )
+    return fig
+
+@st.cache_data(ttl=600)
+def build_price_trend_figure(price_trend_df):
+    fig = px.line(price_trend_df, 
+                 x='month', 
+                 y='price',
+                 markers=True,
+                 line_shape='spline')
     
-    st.plotly_chart(fig, use_container_width=True)
+    fig.update_traces(line=dict(color='#a29bfe', width=2),
+                     marker=dict(color='#a29bfe', size=8))
     
-    st.markdown("""
-    <div style="font-size: 14px; color: #666; margin-top: 10px;">
-        The chart shows a positive correlation between the number of events and taxi trips during All Time (Jun-Dec 2023), 
-        particularly on holidays and special event days.
-    </div>
-    """, unsafe_allow_html=True)
-
-with tab2:
-    # Placeholder for the Lag Analysis tab
-    st.markdown("""
-    <div style="text-align: center; padding: 100px 0;">
-        <div style="font-size: 16px; color: #666;">Lag Analysis coming soon</div>
-    </div>
-    """, unsafe_allow_html=True)
+    fig.update_layout(
+        height=350,
+        margin=dict(l=20, r=20, t=30, b=20),
+        paper_bgcolor='white',
+        plot_bgcolor='white',
+        hovermode='x unified',
+        yaxis=dict(
+            title='Average Price ($)',
+            gridcolor='#f0f0f0',
+            range=[28, 44],
+            tickprefix='$'
+        ),
+        xaxis=dict(
+            title='Month',
+            gridcolor='#f0f0f0'
+        )
+    )
+    return fig
 
-st.markdown("</div>", unsafe_allow_html=True)
+# App Header
+st.markdown("<div class='dashboard-title'>NYC Taxi & Events Analysis</div>", unsafe_allow_html=True)
+st.markdown("<div class='dashboard-subtitle'>Interactive dashboard showing the relationship between NYC taxi demand and events</div>", unsafe_allow_html=True)
 
-# Events Calendar Section
-st.markdown("<div class='dashboard-container'>", unsafe_allow_html=True)
-st.markdown("<div class='dashboard-title' style='font-size: 20px;'>Events Calendar</div>", unsafe_allow_html=True)
-st.markdown("<div class='dashboard-subtitle'>Calendar view of NYC permitted events</div>", unsafe_allow_html=True)
-
-# Month navigation
-col1, col2, col3 = st.columns([1, 4, 1])
-with col1:
-    st.markdown("""
-    <div style="display: flex; align-items: center; justify-content: center; height: 40px;">
-        <a href="#" style="color: #333; text-decoration: none;">←</a>
-    </div>
-    """, unsafe_allow_html=True)
-with col2:
-    st.markdown("""
-    <div style="display: flex; align-items: center; justify-content: center; height: 40px;">
-        <div style="font-weight: bold; font-size: 16px;">December 2023</div>
-    </div>
-    """, unsafe_allow_html=True)
-with col3:
-    st.markdown("""
-    <div style="display: flex; align-items: center; justify-content: center; height: 40px;">
-        <a href="#" style="color: #333; text-decoration: none;">→</a>
-    </div>
-    """, unsafe_allow_html=True)
-
-# Calendar grid
-days_of_week = ["Su", "Mo", "Tu", "We", "Th", "Fr", "Sa"]
-col1, col2, col3, col4, col5, col6, col7 = st.columns(7)
-
-# Header row
-for i, col in enumerate([col1, col2, col3, col4, col5, col6, col7]):
-    with col:
-        st.markdown(f"""
-        <div style="display: flex; align-items: center; justify-content: center; height: 32px; font-size: 14px; color: #666;">
-            {days_of_week[i]}
-        </div>
-        """, unsafe_allow_html=True)
+# Analyses are keyed per browser session, so a rerun only cancels that user's own jobs
+def analytics_key(name):
+    if 'analytics_session' not in st.session_state:
+        st.session_state['analytics_session'] = uuid.uuid4().hex
+    return f"{st.session_state['analytics_session']}:{name}"
 
-# Calendar data for December 2023
-# This is simplified - in a real app you would generate this dynamically
-calendar_data = [
-    ["26", "27", "28", "29", "30", "1", "2"],
-    ["3", "4", "5", "6", "7", "8", "9"],
-    ["10", "11", "12", "13", "14", "15", "16"],
-    ["17", "18", "19", "20", "21", "22", "23"],
-    ["24", "25", "26", "27", "28", "29", "30"],
-    ["31", "1", "2", "3", "4", "5", "6"]
-]
-
-# Generate calendar grid
-for week in calendar_data:
-    cols = st.columns(7)
-    for i, day in enumerate(week):
-        is_current_month = True
-        if (int(day) > 20 and int(calendar_data[0][0]) > 20 and i < 3) or (int(day) < 10 and i > 3 and int(calendar_data[-1][-1]) < 10):
-            is_current_month = False
-        
-        is_selected = day == "5"  # Example: Day 5 is selected
-        
-        bg_color = "#ffefd5" if is_selected else "white"
-        text_color = "#ccc" if not is_current_month else "#333"
-        
-        with cols[i]:
-            st.markdown(f"""
-            <div style="display: flex; align-items: center; justify-content: center; height: 32px; background-color: {bg_color}; border-radius: 5px; margin: 2px; color: {text_color};">
-                {day}
-            </div>
-            """, unsafe_allow_html=True)
+# Overview Section
+@st.fragment
+def render_overview():
+    st.markdown("<div class='dashboard-container'>", unsafe_allow_html=True)
+    st.markdown("<div class='dashboard-title' style='font-size: 20px;'>Overview</div>", unsafe_allow_html=True)
+    st.markdown("<div class='dashboard-subtitle'>Key metrics from NYC taxi trips and events (June-Dec 2023)</div>", unsafe_allow_html=True)
+
+    tab1, tab2 = st.tabs(["Taxi Data", "Events Data"])
+
+    with tab1:
+        # Attempt to get data from DB
+        db_data = run_query(OVERVIEW_QUERY)
+    
+        # Use sample data if DB query failed
+        data = get_sample_overview_data() if db_data is None else {
+            "total_trips": f"{db_data['total_trips'].iloc[0]/1000000:.1f}M",
+            "avg_daily_trips": f"{db_data['avg_daily_trips'].iloc[0]:,.0f}",
+            "peak_borough": db_data['peak_borough'].iloc[0],
+            "peak_day": db_data['peak_day'].iloc[0]
+        }
+    
+        # Display metrics
+        col1, col2, col3, col4 = st.columns(4)
+    
+        with col1:
+            st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-title'>Total Trips</div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='metric-value'>{data['total_trips']}</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-subtitle'>Jan-Dec 2023</div>", unsafe_allow_html=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+    
+        with col2:
+            st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-title'>Avg. Daily Trips</div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='metric-value'>{data['avg_daily_trips']}</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-subtitle'>Per day</div>", unsafe_allow_html=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+    
+        with col3:
+            st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-title'>Peak Borough</div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='metric-value'>{data['peak_borough']}</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-subtitle'>Most trips</div>", unsafe_allow_html=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+    
+        with col4:
+            st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-title'>Peak Day</div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='metric-value'>{data['peak_day']}</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-subtitle'>Highest demand</div>", unsafe_allow_html=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+
+    with tab2:
+        # Similar structure for Events tab (simplified for now)
+        col1, col2, col3, col4 = st.columns(4)
+    
+        with col1:
+            st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-title'>Total Events</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-value'>1,456</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-subtitle'>Jan-Dec 2023</div>", unsafe_allow_html=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+    
+        with col2:
+            st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-title'>Avg. Daily Events</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-value'>4.2</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-subtitle'>Per day</div>", unsafe_allow_html=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+    
+        with col3:
+            st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-title'>Top Event Type</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-value'>Street Fair</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-subtitle'>342 events</div>", unsafe_allow_html=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+    
+        with col4:
+            st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-title'>Peak Month</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-value'>July</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-subtitle'>187 events</div>", unsafe_allow_html=True)
+            st.markdown("</div>", unsafe_allow_html=True)
 
-# Display events for a specific day
-st.markdown("<div style='margin-top: 30px;'>", unsafe_allow_html=True)
-st.markdown("<div style='font-size: 18px; font-weight: bold; margin-bottom: 15px;'>July 14, 2023</div>", unsafe_allow_html=True)
-
-# Sample events for demonstration
-events = [
-    {
-        "title": "Street Fair",
-        "location": "Manhattan",
-        "time": "10:00 AM - 6:00 PM"
-    },
-    {
-        "title": "Music Festival",
-        "location": "Brooklyn",
-        "time": "4:00 PM - 10:00 PM",
-        "note": "Taxi demand increased by 23% on this day"
-    }
-]
-
-for event in events:
-    st.markdown("<div class='event-item'>", unsafe_allow_html=True)
-    st.markdown(f"<div class='event-title'>{event['title']}</div>", unsafe_allow_html=True)
-    st.markdown(f"<div class='event-location'>{event['location']}</div>", unsafe_allow_html=True)
-    st.markdown(f"<div class='event-time'>{event['time']}</div>", unsafe_allow_html=True)
-    if 'note' in event and event['note']:
-        st.markdown(f"<div class='event-note'>{event['note']}</div>", unsafe_allow_html=True)
     st.markdown("</div>", unsafe_allow_html=True)
 
-st.markdown("</div>", unsafe_allow_html=True)
-st.markdown("</div>", unsafe_allow_html=True)
+# Daily Taxi Trips Section
+@st.fragment
+def render_daily_trips():
+    st.markdown("<div class='dashboard-container'>", unsafe_allow_html=True)
+    col1, col2 = st.columns([3, 1])
 
-# Average Taxi Prices Section (Not shown in images but was in the code)
-st.markdown("<div class='dashboard-container'>", unsafe_allow_html=True)
-st.markdown("<div class='dashboard-title' style='font-size: 20px;'>Average Taxi Prices</div>", unsafe_allow_html=True)
-st.markdown("<div class='dashboard-subtitle'>Analysis of taxi fares by borough and month (Jun-Dec 2023)</div>", unsafe_allow_html=True)
+    with col1:
+        st.markdown("<div class='dashboard-title' style='font-size: 20px;'>Daily Taxi Trips</div>", unsafe_allow_html=True)
+        st.markdown("<div class='dashboard-subtitle'>Daily taxi trip volume by month</div>", unsafe_allow_html=True)
 
-# Borough filter
-col1, col2 = st.columns([3, 1])
-with col2:
-    borough_options = ["All Boroughs", "Manhattan", "Brooklyn", "Queens", "Bronx", "Staten Island"]
-    selected_borough = st.selectbox("", borough_options, key="price_borough_filter")
+    with col2:
+        selected_month = st.selectbox("Select Month", MONTHS, index=6)  # Default to July
 
-# Tab selection for price analysis
-price_tab1, price_tab2 = st.tabs(["Price Trends", "Borough Comparison"])
+    # Query for daily trips by month
+    month_number = MONTHS.index(selected_month) + 1
+    db_daily_data = run_query(daily_trips_query(month_number))
+
+    # Use sample data if DB query failed
+    daily_data = get_sample_daily_trips(selected_month) if db_daily_data is None else db_daily_data
+
+    # Monthly metrics
+    if db_daily_data is None or db_daily_data.empty:
+        monthly_metrics = get_sample_monthly_data(selected_month)
+    else:
+        monthly_metrics = get_monthly_metrics(db_daily_data)
+
+    anomalies = get_daily_anomalies(*month_bounds(month_number))
 
-with price_tab1:
-    # Price metrics for the selected filter
     col1, col2, col3 = st.columns(3)
-    
+
     with col1:
         st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-title'>Average Price</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-value'>$34.40</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-subtitle'>Per trip</div>", unsafe_allow_html=True)
+        st.markdown("<div class='metric-title'>Total Trips</div>", unsafe_allow_html=True)
+        st.markdown(f"<div class='metric-value'>{monthly_metrics['total_trips']}</div>", unsafe_allow_html=True)
         st.markdown("</div>", unsafe_allow_html=True)
-    
+
     with col2:
         st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-title'>Price Range</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-value'>$31.88 - $39.28</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-subtitle'>Min to max</div>", unsafe_allow_html=True)
+        st.markdown("<div class='metric-title'>Average Daily</div>", unsafe_allow_html=True)
+        st.markdown(f"<div class='metric-value'>{monthly_metrics['avg_daily']}</div>", unsafe_allow_html=True)
         st.markdown("</div>", unsafe_allow_html=True)
-    
+
     with col3:
         st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-title'>Price Increase</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-value'>23.2%</div>", unsafe_allow_html=True)
-        st.markdown("<div class='metric-subtitle'>Jun to Dec</div>", unsafe_allow_html=True)
+        st.markdown("<div class='metric-title'>Peak Day</div>", unsafe_allow_html=True)
+        st.markdown(f"<div class='metric-value'>{monthly_metrics['peak_day']}</div>", unsafe_allow_html=True)
+        st.markdown(f"<div class='metric-subtitle'>{monthly_metrics['peak_day_date']}</div>", unsafe_allow_html=True)
         st.markdown("</div>", unsafe_allow_html=True)
+
+    # Daily trips chart
+    fig = build_daily_trips_figure(daily_data, anomalies)
+
+    st.plotly_chart(fig, use_container_width=True)
+
+    # Legend for event days
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        st.markdown("""
+        <div style="display: flex; align-items: center; margin-right: 20px;">
+            <div style="width: 12px; height: 12px; background-color: #6c5ce7; margin-right: 5px;"></div>
+            <span style="font-size: 14px;">Event day</span>
+        </div>
+        """, unsafe_allow_html=True)
+    with col2:
+        st.markdown("""
+        <div style="display: flex; align-items: center;">
+            <div style="width: 12px; height: 12px; background-color: #a29bfe; margin-right: 5px;"></div>
+            <span style="font-size: 14px; margin-right: 20px;">Regular day</span>
+            <span style="color: #e74c3c; margin-right: 5px;">&#9650;</span>
+            <span style="font-size: 14px; margin-right: 20px;">Demand surge</span>
+            <span style="color: #0984e3; margin-right: 5px;">&#9660;</span>
+            <span style="font-size: 14px;">Demand dip</span>
+        </div>
+        """, unsafe_allow_html=True)
+
+    # Event count
+    st.markdown("<div style='font-size: 14px; color: #666; margin-top: 10px;'>2 major events in July 2023</div>", unsafe_allow_html=True)
+
+    st.markdown("</div>", unsafe_allow_html=True)
+
+# Taxi Trips by Borough Section
+@st.fragment
+def render_borough_section():
+    st.markdown("<div class='dashboard-container'>", unsafe_allow_html=True)
+    st.markdown("<div class='dashboard-title' style='font-size: 20px;'>Taxi Trips by Borough</div>", unsafe_allow_html=True)
+    st.markdown("<div class='dashboard-subtitle'>Distribution of taxi pickups across NYC boroughs</div>", unsafe_allow_html=True)
+
+    # Query for borough data
+    db_borough_data = run_query(BOROUGH_QUERY)
+
+    # Use sample data if DB query failed
+    borough_data = get_sample_borough_data() if db_borough_data is None else db_borough_data
+
+    # Borough pie chart
+    fig = build_borough_figure(borough_data)
+
+    st.plotly_chart(fig, use_container_width=True)
+
+    # Borough legend
+    col1, col2, col3, col4, col5 = st.columns(5)
+    boroughs = ["Manhattan", "Brooklyn", "Queens", "Bronx", "Staten Island"]
+    colors = ['#e74c3c', '#e67e22', '#f1c40f', '#ecf0f1', '#bdc3c7']
+
+    for i, col in enumerate([col1, col2, col3, col4, col5]):
+        with col:
+            st.markdown(f"""
+            <div style="display: flex; align-items: center;">
+                <div style="width: 12px; height: 12px; border-radius: 50%; background-color: {colors[i]}; margin-right: 5px;"></div>
+                <span>{boroughs[i]}</span>
+            </div>
+            """, unsafe_allow_html=True)
+
+    st.markdown("</div>", unsafe_allow_html=True)
+
+# Correlation Analysis Section
+@st.fragment
+def render_correlation():
+    st.markdown("<div class='dashboard-container'>", unsafe_allow_html=True)
+    col1, col2 = st.columns([3, 1])
+
+    with col1:
+        st.markdown("<div class='dashboard-title' style='font-size: 20px;'>Correlation Analysis</div>", unsafe_allow_html=True)
+        st.markdown("<div class='dashboard-subtitle'>Relationship between NYC events and taxi demand</div>", unsafe_allow_html=True)
+
+    with col2:
+        selected_time = st.selectbox("Select Time Period", list(CORRELATION_PERIODS))
+
+    tab1, tab2 = st.tabs(["Time Series", "Lag Analysis"])
+
+    with tab1:
+        # Query for correlation data
+        db_correlation_data = run_query(correlation_query(*CORRELATION_PERIODS[selected_time]))
     
-    # Create monthly price trend chart
-    months = ['Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    prices = [32.0, 32.5, 32.2, 33.5, 35.0, 36.2, 39.5]
+        # Use sample data if DB query failed
+        correlation_data = get_sample_correlation_data() if db_correlation_data is None else db_correlation_data
     
-    price_trend_df = pd.DataFrame({
-        'month': months,
-        'price': prices
-    })
+        # Create time series chart
+        fig = build_correlation_figure(correlation_data)
     
-    fig = px.line(price_trend_df, 
-                 x='month', 
-                 y='price',
-                 markers=True,
-                 line_shape='monotone')
+        st.plotly_chart(fig, use_container_width=True)
     
-    fig.update_traces(line=dict(color='#a29bfe', width=2),
-                     marker=dict(color='#a29bfe', size=8))
+        st.markdown("""
+        <div style="font-size: 14px; color: #666; margin-top: 10px;">
+            The chart shows a positive correlation between the number of events and taxi trips during All Time (Jun-Dec 2023), 
+            particularly on holidays and special event days.
+        </div>
+        """, unsafe_allow_html=True)
+
+    with tab2:
+        # Correlation of daily events with taxi trips some days later (or
+        # earlier), computed in the analytics pool
+        lags = None
+        if db_correlation_data is not None and len(db_correlation_data) > 14:
+            lags = submit(
+                analytics_key("lag_correlation"),
+                'lag_correlation',
+                {'x': db_correlation_data['events'].to_numpy(), 'y': db_correlation_data['taxi_trips'].to_numpy()},
+                max_lag=7
+            ).result()
+
+        if lags is None:
+            st.markdown("""
+            <div style="text-align: center; padding: 100px 0;">
+                <div style="font-size: 16px; color: #666;">Lag Analysis needs daily trip and event data from the database</div>
+            </div>
+            """, unsafe_allow_html=True)
+        else:
+            lag_data = pd.DataFrame({'lag': lags['lag'], 'correlation': lags['correlation']})
+            st.plotly_chart(build_lag_figure(lag_data), use_container_width=True)
+            if lag_data['correlation'].notna().any():
+                best = lag_data.loc[lag_data['correlation'].abs().idxmax()]
+                st.markdown(f"""
+                <div style="font-size: 14px; color: #666; margin-top: 10px;">
+                    Events and taxi trips are most strongly related at a lag of {int(best['lag'])} day(s) (r = {best['correlation']:.2f}).
+                </div>
+                """, unsafe_allow_html=True)
+
+    st.markdown("</div>", unsafe_allow_html=True)
+
+# Events Calendar Section
+@st.fragment
+def render_calendar():
+    st.markdown("<div class='dashboard-container'>", unsafe_allow_html=True)
+    st.markdown("<div class='dashboard-title' style='font-size: 20px;'>Events Calendar</div>", unsafe_allow_html=True)
+    st.markdown("<div class='dashboard-subtitle'>Calendar view of NYC permitted events</div>", unsafe_allow_html=True)
+
+    # Month navigation
+    col1, col2, col3 = st.columns([1, 4, 1])
+    with col1:
+        st.markdown("""
+        <div style="display: flex; align-items: center; justify-content: center; height: 40px;">
+            <a href="#" style="color: #333; text-decoration: none;">←</a>
+        </div>
+        """, unsafe_allow_html=True)
+    with col2:
+        st.markdown("""
+        <div style="display: flex; align-items: center; justify-content: center; height: 40px;">
+            <div style="font-weight: bold; font-size: 16px;">December 2023</div>
+        </div>
+        """, unsafe_allow_html=True)
+    with col3:
+        st.markdown("""
+        <div style="display: flex; align-items: center; justify-content: center; height: 40px;">
+            <a href="#" style="color: #333; text-decoration: none;">→</a>
+        </div>
+        """, unsafe_allow_html=True)
+
+    # Calendar grid
+    days_of_week = ["Su", "Mo", "Tu", "We", "Th", "Fr", "Sa"]
+    col1, col2, col3, col4, col5, col6, col7 = st.columns(7)
+
+    # Header row
+    for i, col in enumerate([col1, col2, col3, col4, col5, col6, col7]):
+        with col:
+            st.markdown(f"""
+            <div style="display: flex; align-items: center; justify-content: center; height: 32px; font-size: 14px; color: #666;">
+                {days_of_week[i]}
+            </div>
+            """, unsafe_allow_html=True)
+
+    # Calendar data for December 2023
+    # This is simplified - in a real app you would generate this dynamically
+    calendar_data = [
+        ["26", "27", "28", "29", "30", "1", "2"],
+        ["3", "4", "5", "6", "7", "8", "9"],
+        ["10", "11", "12", "13", "14", "15", "16"],
+        ["17", "18", "19", "20", "21", "22", "23"],
+        ["24", "25", "26", "27", "28", "29", "30"],
+        ["31", "1", "2", "3", "4", "5", "6"]
+    ]
+
+    # Days with detected surges/dips are tinted
+    anomalies = get_daily_anomalies(*month_bounds(CALENDAR_MONTH))
+    anomaly_days = {}
+    if anomalies is not None:
+        for _, row in anomalies.iterrows():
+            anomaly_days[pd.to_datetime(row['date']).day] = 'surge' if row['surges'] >= row['dips'] else 'dip'
+
+    # Generate calendar grid
+    for week in calendar_data:
+        cols = st.columns(7)
+        for i, day in enumerate(week):
+            is_current_month = True
+            if (int(day) > 20 and int(calendar_data[0][0]) > 20 and i < 3) or (int(day) < 10 and i > 3 and int(calendar_data[-1][-1]) < 10):
+                is_current_month = False
+        
+            is_selected = day == "5"  # Example: Day 5 is selected
+        
+            bg_color = "#ffefd5" if is_selected else "white"
+            if is_current_month and not is_selected and int(day) in anomaly_days:
+                bg_color = "#fde2e2" if anomaly_days[int(day)] == 'surge' else "#e2ecfd"
+            text_color = "#ccc" if not is_current_month else "#333"
+        
+            with cols[i]:
+                st.markdown(f"""
+                <div style="display: flex; align-items: center; justify-content: center; height: 32px; background-color: {bg_color}; border-radius: 5px; margin: 2px; color: {text_color};">
+                    {day}
+                </div>
+                """, unsafe_allow_html=True)
+
+    # Display events for a specific day
+    st.markdown("<div style='margin-top: 30px;'>", unsafe_allow_html=True)
+    st.markdown("<div style='font-size: 18px; font-weight: bold; margin-bottom: 15px;'>July 14, 2023</div>", unsafe_allow_html=True)
+
+    events = get_events_for_day(CALENDAR_DAY)
+    if not events:
+        events = get_sample_events_by_day("July", 2023, 14)
+
+    for event in events:
+        st.markdown("<div class='event-item'>", unsafe_allow_html=True)
+        st.markdown(f"<div class='event-title'>{event['title']}</div>", unsafe_allow_html=True)
+        st.markdown(f"<div class='event-location'>{event['location']}</div>", unsafe_allow_html=True)
+        st.markdown(f"<div class='event-time'>{event['time']}</div>", unsafe_allow_html=True)
+        if 'note' in event and event['note']:
+            st.markdown(f"<div class='event-note'>{event['note']}</div>", unsafe_allow_html=True)
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    st.markdown("</div>", unsafe_allow_html=True)
+    st.markdown("</div>", unsafe_allow_html=True)
+
+# Average Taxi Prices Section (Not shown in images but was in the code)
+@st.fragment
+def render_prices():
+    st.markdown("<div class='dashboard-container'>", unsafe_allow_html=True)
+    st.markdown("<div class='dashboard-title' style='font-size: 20px;'>Average Taxi Prices</div>", unsafe_allow_html=True)
+    st.markdown("<div class='dashboard-subtitle'>Analysis of taxi fares by borough and month (Jun-Dec 2023)</div>", unsafe_allow_html=True)
+
+    # Borough filter
+    col1, col2 = st.columns([3, 1])
+    with col2:
+        borough_options = ["All Boroughs", "Manhattan", "Brooklyn", "Queens", "Bronx", "Staten Island"]
+        selected_borough = st.selectbox("", borough_options, key="price_borough_filter")
+
+    # Tab selection for price analysis
+    price_tab1, price_tab2 = st.tabs(["Price Trends", "Borough Comparison"])
+
+    with price_tab1:
+        # Price metrics for the selected filter
+        col1, col2, col3 = st.columns(3)
+    
+        with col1:
+            st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-title'>Average Price</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-value'>$34.40</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-subtitle'>Per trip</div>", unsafe_allow_html=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+    
+        with col2:
+            st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-title'>Price Range</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-value'>$31.88 - $39.28</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-subtitle'>Min to max</div>", unsafe_allow_html=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+    
+        with col3:
+            st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-title'>Price Increase</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-value'>23.2%</div>", unsafe_allow_html=True)
+            st.markdown("<div class='metric-subtitle'>Jun to Dec</div>", unsafe_allow_html=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+    
+        # Create monthly price trend chart
+        months = ['Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+        prices = [32.0, 32.5, 32.2, 33.5, 35.0, 36.2, 39.5]
+    
+        price_trend_df = pd.DataFrame({
+            'month': months,
+            'price': prices
+        })
     
-    fig.update_layout(
-        height=350,
-        margin=dict(l=20, r=20, t=30, b=20),
-        paper_bgcolor='white',
-        plot_bgcolor='white',
-        hovermode='x unified',
-        yaxis=dict(
-            title='Average Price ($)',
-            gridcolor='#f0f0f0',
-            range=[28, 44],
-            tickpretickprefix='$'
-    ),
-    xaxis=dict(
-        title='Month',
-        gridcolor='#f0f0f0'
-    )
-    )
+        fig = build_price_trend_figure(price_trend_df)
     
-    st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(fig, use_container_width=True)
+
+    with price_tab2:
+        # Placeholder for Borough Comparison tab
+        st.markdown("""
+        <div style="text-align: center; padding: 100px 0;">
+            <div style="font-size: 16px; color: #666;">Borough price comparison coming soon</div>
+        </div>
+        """, unsafe_allow_html=True)
 
-with price_tab2:
-    # Placeholder for Borough Comparison tab
-    st.markdown("""
-    <div style="text-align: center; padding: 100px 0;">
-        <div style="font-size: 16px; color: #666;">Borough price comparison coming soon</div>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown("</div>", unsafe_allow_html=True)
 
-st.markdown("</div>", unsafe_allow_html=True)
+# Each section is a fragment: a widget inside one section reruns only that
+# section, not the queries and figures of the whole page.
+render_overview()
+render_daily_trips()
+render_borough_section()
+render_correlation()
+render_calendar()
+render_prices()
 
 # Footer
 st.markdown("""
 <div style="text-align: center; margin-top: 40px; margin-bottom: 20px; font-size: 12px; color: #666;">
     NYC Taxi & Events Analysis Dashboard - Data from June to December 2023
 </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+
+# How much of the dashboard the warmer is keeping fresh
+if init_connection() is not None:
+    warm = coverage(warm_queries())
+    sections = ", ".join(f"{name} {w}/{t}" for name, (w, t) in warm['sections'].items())
+    with st.sidebar.expander("Cache warming"):
+        st.caption(f"{warm['warm']}/{warm['total']} dashboard queries warm ({sections})")
+        if warm['last_cycle'] is not None:
+            started, seconds = warm['last_cycle']
+            st.caption(f"Last warmed {datetime.fromtimestamp(started):%H:%M:%S}, in {seconds:.1f}s")
\ No newline at end of file
@@ -0,0 +1,298 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from taxi_db import DATA_DIR, get_connection
+from taxi_zones import (HOURS_PER_WEEK, PICKUP_HOUR_OF_WEEK_SQL, DURATION_MINUTES_SQL, MAX_TRIP_MINUTES,
+                        cursor_frame, days_condition, update_zone_dictionary, load_zone_dictionary, zone_index)
+
+OD_PATH = os.path.join(DATA_DIR, "od_matrix.npz")
+
+# Per-pair sums kept in the store; means are derived at query time so that
+# incremental updates can simply be added on. Minutes and distance are summed
+# over the timed_count trips with a plausible duration only.
+OD_SUMS = ['trip_count', 'total_sum', 'timed_count', 'minutes_sum', 'distance_sum']
+
+
+class ODMatrix:
+    """Zone-to-zone flows for every hour of the week.
+
+    Each metric is one CSR matrix of shape (168 * n_zones, n_zones): row
+    how * n_zones + pickup holds that pickup zone's flows in hour-of-week how.
+    All metrics share the trip_count sparsity pattern.
+    """
+
+    def __init__(self, matrices, n_zones, watermark=None):
+        self.matrices = matrices
+        self.n_zones = n_zones
+        self.watermark = watermark
+
+    @classmethod
+    def empty(cls, n_zones):
+        shape = (HOURS_PER_WEEK * n_zones, n_zones)
+        return cls({m: sparse.csr_matrix(shape) for m in OD_SUMS}, n_zones)
+
+    @classmethod
+    def load(cls, path=OD_PATH):
+        with np.load(path, allow_pickle=False) as f:
+            n_zones = int(f['n_zones'])
+            shape = (HOURS_PER_WEEK * n_zones, n_zones)
+            indices, indptr = f['indices'], f['indptr']
+            # Stores written before timed_count was kept timed every trip
+            matrices = {
+                m: sparse.csr_matrix((f[m if m in f.files else 'trip_count'].astype(np.float64), indices, indptr),
+                                     shape=shape)
+                for m in OD_SUMS
+            }
+            watermark = str(f['watermark']) or None
+        return cls(matrices, n_zones, watermark)
+
+    def save(self, path=OD_PATH):
+        # Pairs whose trips were all subtracted leave explicit zeros behind
+        counts = self.matrices['trip_count'].tocsr().copy()
+        counts.eliminate_zeros()
+        counts.sort_indices()
+        # Read every metric at the trip_count positions so one indices/indptr pair serves all
+        rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        data = {m: np.asarray(self.matrices[m][rows, counts.indices]).ravel() for m in OD_SUMS}
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            n_zones=np.int64(self.n_zones),
+            indices=counts.indices.astype(np.int32),
+            indptr=counts.indptr.astype(np.int64),
+            watermark=np.str_(self.watermark or ""),
+            **data
+        )
+        os.replace(tmp_path, path)
+
+    def resized(self, n_zones):
+        """Same flows laid out for a larger zone dictionary"""
+        if n_zones == self.n_zones:
+            return self
+        matrices = {}
+        for m, matrix in self.matrices.items():
+            coo = matrix.tocoo()
+            how, pickup = np.divmod(coo.row, self.n_zones)
+            matrices[m] = sparse.csr_matrix(
+                (coo.data, (how * n_zones + pickup, coo.col)),
+                shape=(HOURS_PER_WEEK * n_zones, n_zones)
+            )
+        return ODMatrix(matrices, n_zones, self.watermark)
+
+    def add(self, other):
+        return ODMatrix(
+            {m: self.matrices[m] + other.matrices[m] for m in OD_SUMS},
+            self.n_zones,
+            other.watermark or self.watermark
+        )
+
+    def subtract(self, other):
+        return ODMatrix(
+            {m: self.matrices[m] - other.matrices[m] for m in OD_SUMS},
+            self.n_zones,
+            self.watermark
+        )
+
+    def for_hours(self, hours=None, metric='trip_count'):
+        """Zone x zone matrix of a metric summed over a set of hours of the week"""
+        if hours is None:
+            hours = range(HOURS_PER_WEEK)
+        hours = np.asarray(list(hours))
+        # Stacked rows for the chosen hours, folded onto the pickup axis
+        rows = (hours[:, None] * self.n_zones + np.arange(self.n_zones)[None, :]).ravel()
+        selector = sparse.csr_matrix(
+            (np.ones(len(rows)), (np.tile(np.arange(self.n_zones), len(hours)), rows)),
+            shape=(self.n_zones, HOURS_PER_WEEK * self.n_zones)
+        )
+        return (selector @ self.matrices[metric]).tocsr()
+
+
+VALID_DURATION_SQL = f"({DURATION_MINUTES_SQL}) BETWEEN 1 AND {MAX_TRIP_MINUTES}"
+
+# The same sums per pickup_date, so a day that changed can be subtracted from
+# the stored matrices and added back recomputed
+CREATE_OD_DAILY_SQL = """
+CREATE TABLE IF NOT EXISTS od_flows_daily (
+    pickup_date TEXT NOT NULL,
+    how SMALLINT NOT NULL,
+    pickup_zone TEXT NOT NULL,
+    dropoff_zone TEXT NOT NULL,
+    trip_count BIGINT NOT NULL,
+    total_sum DOUBLE PRECISION NOT NULL,
+    timed_count BIGINT NOT NULL,
+    minutes_sum DOUBLE PRECISION NOT NULL,
+    distance_sum DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (pickup_date, how, pickup_zone, dropoff_zone)
+)
+"""
+
+# Aggregate trips into daily flows; {where_clause} limits the days
+OD_AGGREGATE_SQL = f"""
+SELECT
+    pickup_date,
+    {PICKUP_HOUR_OF_WEEK_SQL} as how,
+    pickup_zone,
+    dropoff_zone,
+    COUNT(*) as trip_count,
+    COALESCE(SUM(total_amount), 0) as total_sum,
+    COUNT(*) FILTER (WHERE {VALID_DURATION_SQL}) as timed_count,
+    COALESCE(SUM({DURATION_MINUTES_SQL}) FILTER (WHERE {VALID_DURATION_SQL}), 0) as minutes_sum,
+    COALESCE(SUM(trip_distance) FILTER (WHERE {VALID_DURATION_SQL}), 0) as distance_sum
+FROM
+    taxi_trips
+WHERE
+    pickup_zone != '' AND
+    dropoff_zone != '' AND
+    pickup_date IS NOT NULL AND
+    pickup_time IS NOT NULL AND
+    {{where_clause}}
+GROUP BY
+    1, 2, 3, 4
+"""
+
+
+def _daily_flows(cur, zones, where_clause):
+    """The od_flows_daily rows matching where_clause, summed into an ODMatrix"""
+    index = zone_index(zones)
+    n_zones = len(zones)
+    flows = cursor_frame(cur, f"""
+    SELECT how, pickup_zone, dropoff_zone, {", ".join(f"SUM({m}) as {m}" for m in OD_SUMS)}
+    FROM od_flows_daily
+    WHERE {where_clause}
+    GROUP BY 1, 2, 3
+    """)
+    if flows.empty:
+        return ODMatrix.empty(n_zones)
+
+    rows = flows['how'].astype(int).to_numpy() * n_zones + flows['pickup_zone'].map(index).to_numpy()
+    cols = flows['dropoff_zone'].map(index).to_numpy()
+    shape = (HOURS_PER_WEEK * n_zones, n_zones)
+    matrices = {
+        m: sparse.csr_matrix((flows[m].astype(float).to_numpy(), (rows, cols)), shape=shape)
+        for m in OD_SUMS
+    }
+    return ODMatrix(matrices, n_zones)
+
+
+def refresh_od_days(cur, days=None, path=OD_PATH):
+    """Bring the OD matrix up to date for the given pickup dates (every date when
+    days is None) inside the caller's transaction, and save it"""
+    cur.execute("SELECT to_regclass('od_flows_daily') IS NOT NULL")
+    if not cur.fetchone()[0] or not os.path.exists(path):
+        # A stored matrix can only be patched from the daily flows it was built from
+        days = None
+    cur.execute(CREATE_OD_DAILY_SQL)
+    zones = update_zone_dictionary(days)
+    if zones.empty:
+        return None
+
+    if days is None:
+        cur.execute("TRUNCATE od_flows_daily")
+        od = ODMatrix.empty(len(zones))
+        where_clause = "1=1"
+    else:
+        where_clause = days_condition(days)
+        # Back the days' old flows out of the matrix...
+        od = ODMatrix.load(path).resized(len(zones))
+        od = od.subtract(_daily_flows(cur, zones, where_clause))
+        cur.execute(f"DELETE FROM od_flows_daily WHERE {where_clause}")
+
+    # ...recompute them from taxi_trips, and add them back
+    cur.execute("INSERT INTO od_flows_daily " + OD_AGGREGATE_SQL.format(where_clause=where_clause))
+    od = od.add(_daily_flows(cur, zones, where_clause))
+    cur.execute("SELECT MAX(pickup_date) FROM od_flows_daily")
+    od.watermark = cur.fetchone()[0]
+    od.save(path)
+    return od
+
+
+def build_od_matrix(path=OD_PATH):
+    """Rebuild the OD matrix and its daily flows from all of taxi_trips"""
+    conn = get_connection()
+    if conn is None:
+        return None
+    conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            od = refresh_od_days(cur, None, path)
+        conn.commit()
+        return od
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+_od = None
+_od_mtime = None
+_od_lock = threading.Lock()
+
+
+def load_od_matrix(path=OD_PATH):
+    """The OD matrix store, loaded once per process, or None if it hasn't been built"""
+    global _od, _od_mtime
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _od_lock:
+        if _od is None or _od_mtime != mtime:
+            _od = ODMatrix.load(path)
+            _od_mtime = mtime
+        return _od
+
+
+def borough_rollup(hours=None):
+    """Pickup borough x dropoff borough sums (count, total, timed count, minutes, distance) as a long frame"""
+    od = load_od_matrix()
+    if od is None:
+        return None
+    zones = load_zone_dictionary().iloc[:od.n_zones]
+    boroughs = sorted(zones['borough'].unique())
+    b_index = zones['borough'].map({b: i for i, b in enumerate(boroughs)}).to_numpy()
+    # Zone -> borough indicator; B.T @ M @ B folds zone pairs into borough pairs
+    B = sparse.csr_matrix((np.ones(od.n_zones), (np.arange(od.n_zones), b_index)),
+                          shape=(od.n_zones, len(boroughs)))
+
+    rolled = {m: (B.T @ od.for_hours(hours, m) @ B).toarray() for m in OD_SUMS}
+    pickup, dropoff = np.meshgrid(np.arange(len(boroughs)), np.arange(len(boroughs)), indexing='ij')
+    frame = pd.DataFrame({
+        'pickup_borough': np.array(boroughs)[pickup.ravel()],
+        'dropoff_borough': np.array(boroughs)[dropoff.ravel()],
+    })
+    for m in OD_SUMS:
+        frame[m] = rolled[m].ravel()
+    return frame[frame['trip_count'] > 0].reset_index(drop=True)
+
+
+def borough_pair_estimate(pickup_borough, dropoff_borough, hours=None):
+    """Trip count, avg total, avg minutes and avg mph for a borough pair, or None"""
+    rollup = borough_rollup(hours)
+    if rollup is None:
+        return None
+    pair = rollup[(rollup['pickup_borough'] == pickup_borough) & (rollup['dropoff_borough'] == dropoff_borough)]
+    if pair.empty:
+        return None
+    row = pair.iloc[0]
+    count = row['trip_count']
+    return {
+        'trip_count': int(count),
+        'avg_total': row['total_sum'] / count,
+        'avg_minutes': row['minutes_sum'] / row['timed_count'] if row['timed_count'] > 0 else None,
+        'avg_mph': row['distance_sum'] / (row['minutes_sum'] / 60.0) if row['minutes_sum'] > 0 else None
+    }
+
+
+if __name__ == "__main__":
+    od = build_od_matrix()
+    if od is None:
+        print("No zones found in taxi_trips")
+    else:
+        print(f"OD matrix up to {od.watermark}: {od.matrices['trip_count'].nnz:,} zone pairs x hours")
@@ -0,0 +1,130 @@
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from taxi_db import POOL_MAX_CONNECTIONS, active_queries
+from taxi_queries import best_zones, is_cached
+from taxi_zones import DAYS
+from trip_profiles import TIME_RANGE_HOURS
+
+# Recommender selections are warmed in the background once a user has been
+# served one (day, time range, borough): users mostly step through adjacent
+# time ranges or days. Neighbours are ranked by how often users of this
+# process actually moved from one selection to the other.
+TIME_RANGES = list(TIME_RANGE_HOURS)
+
+# Concurrency budget: queries prefetched at once, and waiting at most
+PREFETCH_WORKERS = 2
+MAX_QUEUED = 8
+# Selections warmed after each one served
+PREFETCH_FANOUT = 3
+# Queued prefetches are dropped while this many queries are already running
+BUSY_QUERIES = POOL_MAX_CONNECTIONS // 2
+# The recommender's page size (best_zones' limit)
+RESULT_LIMIT = 10
+
+# Tie-breakers for neighbours nobody has moved to yet, in the order users
+# usually step: the next time range, the previous one, the next day, the previous day
+_NEIGHBOUR_PRIOR = [0.4, 0.3, 0.2, 0.1]
+
+_executor = ThreadPoolExecutor(PREFETCH_WORKERS, thread_name_prefix="prefetch")
+_lock = threading.Lock()
+_transitions = defaultdict(Counter)
+_queued = {}
+_prefetched = OrderedDict()
+_PREFETCHED_SIZE = 256
+_stats = Counter()
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+def neighbours(selection):
+    """Selections one step away: adjacent time ranges and days, same borough"""
+    day, time_range, borough = selection
+    t = TIME_RANGES.index(time_range)
+    d = DAYS.index(day)
+    return [
+        (day, TIME_RANGES[(t + 1) % len(TIME_RANGES)], borough),
+        (day, TIME_RANGES[t - 1], borough),
+        (DAYS[(d + 1) % len(DAYS)], time_range, borough),
+        (DAYS[d - 1], time_range, borough),
+    ]
+
+
+def likely_next(selection, n=PREFETCH_FANOUT):
+    """The n selections most likely to follow this one"""
+    with _lock:
+        scores = Counter(_transitions[selection])
+    for neighbour, prior in zip(neighbours(selection), _NEIGHBOUR_PRIOR):
+        scores[neighbour] += prior
+    scores.pop(selection, None)
+    return [s for s, _ in scores.most_common(n)]
+
+
+def _busy():
+    return active_queries() >= BUSY_QUERIES
+
+
+def _prefetch(selection):
+    with _lock:
+        _queued.pop(selection, None)
+    if _busy():
+        # Cancelled under load: real requests come first
+        _count('cancelled')
+        return
+    try:
+        best_zones(*selection, limit=RESULT_LIMIT)
+    except Exception:
+        _count('failed')
+        return
+    with _lock:
+        _prefetched[selection] = True
+        while len(_prefetched) > _PREFETCHED_SIZE:
+            _prefetched.popitem(last=False)
+    _count('completed')
+
+
+def cancel_queued():
+    """Drop every prefetch that hasn't started"""
+    with _lock:
+        queued = list(_queued.values())
+        _queued.clear()
+    for future in queued:
+        if future.cancel():
+            _count('cancelled')
+
+
+def served(previous, selection):
+    """Record that a session moved from previous to selection (None on its first
+    request) and warm the cache for what it's likely to ask next"""
+    with _lock:
+        if previous is not None and previous != selection:
+            _transitions[previous][selection] += 1
+        if _prefetched.pop(selection, None):
+            _stats['hits'] += 1
+
+    if _busy():
+        cancel_queued()
+        return
+    for candidate in likely_next(selection):
+        if is_cached('best_zones', candidate + (RESULT_LIMIT,)):
+            continue
+        with _lock:
+            if candidate in _queued:
+                continue
+            if len(_queued) >= MAX_QUEUED:
+                _stats['dropped'] += 1
+                continue
+            _queued[candidate] = _executor.submit(_prefetch, candidate)
+        _count('scheduled')
+
+
+def prefetch_stats():
+    """Counters for the sidebar: scheduled, completed, hits, cancelled, dropped, failed, queued"""
+    with _lock:
+        stats = {key: _stats[key] for key in ['scheduled', 'completed', 'hits', 'cancelled', 'dropped', 'failed']}
+        stats['queued'] = len(_queued)
+    return stats
@@ -0,0 +1,211 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import pyarrow as pa
+
+from taxi_db import DATA_DIR, execute_query, get_dataset_version, query_fingerprint, single_flight
+
+# Query results on disk, keyed by query fingerprint and dataset version, below
+# the apps' in-memory caches. A restarted or redeployed app reads them back
+# instead of re-running full scans, and warms itself from the queries that
+# were requested most often.
+CACHE_PATH = os.path.join(DATA_DIR, "query_cache.sqlite")
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+# Queries re-run in the background when a process starts
+WARM_QUERIES = 50
+# Request counts kept for warm-up
+MAX_TRACKED_QUERIES = 1000
+
+CACHE_SQL = """
+CREATE TABLE IF NOT EXISTS results (
+    fingerprint TEXT NOT NULL,
+    version TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL,
+    PRIMARY KEY (fingerprint, version)
+);
+CREATE INDEX IF NOT EXISTS results_used_at ON results (used_at);
+CREATE TABLE IF NOT EXISTS queries (
+    fingerprint TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    query TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    used_at REAL NOT NULL
+);
+"""
+
+_local = threading.local()
+
+
+def _connect():
+    # One connection per thread; WAL lets every app process read while one writes
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(CACHE_SQL)
+        _local.conn = conn
+    return conn
+
+
+def _serialize(frame):
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression='zstd')
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def load(source, query, version):
+    """The stored result of query at version, or None; counts the request for warm-up"""
+    fingerprint = query_fingerprint(query)
+    now = time.time()
+    try:
+        conn = _connect()
+        conn.execute("""
+        INSERT INTO queries (fingerprint, source, query, requests, used_at) VALUES (?, ?, ?, 1, ?)
+        ON CONFLICT (fingerprint) DO UPDATE SET requests = requests + 1, used_at = excluded.used_at
+        """, (fingerprint, source, query, now))
+        row = conn.execute("SELECT payload FROM results WHERE fingerprint = ? AND version = ?",
+                           (fingerprint, version)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE results SET used_at = ? WHERE fingerprint = ? AND version = ?",
+                     (now, fingerprint, version))
+        return pa.ipc.open_stream(row[0]).read_all().to_pandas()
+    except (sqlite3.Error, pa.ArrowException):
+        # The disk tier is an optimization; never fail a query over it
+        return None
+
+
+def store(query, version, frame):
+    """Keep a result on disk, evicting the least recently used ones over MAX_CACHE_BYTES"""
+    try:
+        payload = _serialize(frame)
+    except (pa.ArrowException, TypeError, ValueError):
+        return
+    now = time.time()
+    try:
+        conn = _connect()
+        conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                     (query_fingerprint(query), version, payload, len(payload), now, now))
+        evict(conn)
+    except sqlite3.Error:
+        pass
+
+
+def evict(conn, max_bytes=MAX_CACHE_BYTES):
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+    if total > max_bytes:
+        # Down to 90%, so a full cache doesn't evict on every store
+        excess = total - int(max_bytes * 0.9)
+        conn.execute("""
+        DELETE FROM results WHERE rowid IN (
+            SELECT rowid FROM (
+                SELECT rowid, size, SUM(size) OVER (ORDER BY used_at, rowid) as freed
+                FROM results
+            ) WHERE freed - size < ?
+        )
+        """, (excess,))
+    conn.execute("""
+    DELETE FROM queries WHERE fingerprint NOT IN (
+        SELECT fingerprint FROM queries ORDER BY requests DESC LIMIT ?
+    )
+    """, (MAX_TRACKED_QUERIES,))
+    return total
+
+
+def popular(source, n=WARM_QUERIES):
+    """The n queries of source requested most often"""
+    try:
+        rows = _connect().execute(
+            "SELECT query FROM queries WHERE source = ? ORDER BY requests DESC LIMIT ?", (source, n)
+        ).fetchall()
+    except sqlite3.Error:
+        return []
+    return [query for query, in rows]
+
+
+_warmed = set()
+_warmed_lock = threading.Lock()
+
+
+def warm_up(source, run, n=WARM_QUERIES):
+    """Call run(query) for source's n most requested queries on a background thread,
+    once per process. run should go through the caches, so each query is read
+    back from disk, or re-run and stored if the dataset has changed."""
+    with _warmed_lock:
+        if source in _warmed:
+            return
+        _warmed.add(source)
+
+    def warm():
+        for query in popular(source, n):
+            try:
+                run(query)
+            except Exception:
+                pass
+
+    threading.Thread(target=warm, name=f"warm-{source}", daemon=True).start()
+
+
+# execute_query with a memory tier over the disk tier, for the driver app
+_MEMORY_CACHE_SIZE = 256
+_memory_cache = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+
+def cached_query(query):
+    """execute_query through the memory and disk caches for the current dataset version.
+
+    Empty frames aren't kept: execute_query also returns one when a query fails.
+    """
+    version = get_dataset_version()
+    if version == "unknown":
+        # No way to tell a stored result is current
+        return execute_query(query)
+    key = (query_fingerprint(query), version)
+    with _memory_cache_lock:
+        if key in _memory_cache:
+            _memory_cache.move_to_end(key)
+            return _memory_cache[key].copy()
+
+    def fetch():
+        result = load('app', query, version)
+        if result is None:
+            result = execute_query(query)
+            if result.empty:
+                return result
+            store(query, version, result)
+        with _memory_cache_lock:
+            _memory_cache[key] = result
+            while len(_memory_cache) > _MEMORY_CACHE_SIZE:
+                _memory_cache.popitem(last=False)
+        return result
+
+    return single_flight(f"cached:{key[0]}:{version}", fetch).copy()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Summarize the on-disk query cache ({CACHE_PATH})")
+    parser.add_argument("--clear", action="store_true", help="remove every stored result")
+    args = parser.parse_args()
+
+    conn = _connect()
+    if args.clear:
+        conn.execute("DELETE FROM results")
+        conn.execute("VACUUM")
+    results, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+    print(f"{results:,} results, {size / 1e6:.1f} MB of {MAX_CACHE_BYTES / 1e6:.0f} MB")
+    for source, query, requests in conn.execute(
+        "SELECT source, query, requests FROM queries ORDER BY requests DESC LIMIT 10"
+    ):
+        print(f"{requests:>8,}  {source:<10} {' '.join(query.split())[:80]}")
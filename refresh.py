@@ -0,0 +1,254 @@
+import argparse
+import time
+from datetime import date, timedelta
+
+from taxi_db import get_connection
+from taxi_zones import publish_zone_dictionary
+from trip_profiles import refresh_profile_days, rebuild_all_profiles, publish_profile_store
+from trip_sample import refresh_sample_days, rebuild_samples, publish_trip_samples
+from od_matrix import refresh_od_days
+from zone_heatmap import refresh_zone_hour_matrix
+from shift_planner import refresh_transition_matrix
+from event_attribution import refresh_event_attribution
+from trip_anomalies import refresh_anomalies
+from demand_forecast import refresh_demand_forecast
+
+# Days before the last refreshed day that are re-checked on every run, so late
+# corrections to recent days are picked up. Older changes need --full.
+LOOKBACK_DAYS = 3
+
+REFRESH_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS derived_watermarks (
+    table_name TEXT PRIMARY KEY,
+    watermark TEXT,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    rows_processed BIGINT NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS derived_day_counts (
+    table_name TEXT NOT NULL,
+    pickup_date TEXT NOT NULL,
+    trip_count BIGINT NOT NULL,
+    total_sum DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (table_name, pickup_date)
+);
+CREATE TABLE IF NOT EXISTS dataset_versions (
+    version SERIAL PRIMARY KEY,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    tables TEXT NOT NULL
+)
+"""
+
+
+# Each refresher gets (cursor, changed days, previous watermark) and brings its
+# derived table up to date. A None watermark means the table was never built.
+
+def _refresh_profiles(cur, days, watermark):
+    if watermark is None:
+        rebuild_all_profiles(cur)
+    else:
+        refresh_profile_days(cur, days)
+
+
+def _refresh_samples(cur, days, watermark):
+    if watermark is None:
+        rebuild_samples(cur)
+    else:
+        refresh_sample_days(cur, days)
+
+
+def _refresh_od_matrix(cur, days, watermark):
+    refresh_od_days(cur, None if watermark is None else days)
+
+
+def _refresh_zone_heatmap(cur, days, watermark):
+    refresh_zone_hour_matrix(cur, None if watermark is None else days)
+
+
+def _refresh_shift_transitions(cur, days, watermark):
+    refresh_transition_matrix(cur, None if watermark is None else days)
+
+
+def _refresh_anomalies(cur, days, watermark):
+    refresh_anomalies(cur, days)
+
+
+def _refresh_demand_forecast(cur, days, watermark):
+    refresh_demand_forecast(None if watermark is None else days)
+
+
+DERIVED_TABLES = {
+    'trip_profiles': _refresh_profiles,
+    'trip_samples': _refresh_samples,
+    'od_matrix': _refresh_od_matrix,
+    'zone_hour_matrix': _refresh_zone_heatmap,
+    'shift_transitions': _refresh_shift_transitions,
+    'trip_anomalies': _refresh_anomalies,
+    'demand_forecast': _refresh_demand_forecast,
+}
+
+
+def _day_counts(cur, query):
+    cur.execute(query)
+    return {str(d): (int(n), float(s)) for d, n, s in cur.fetchall()}
+
+
+# Event-based tables track the last processed nyc_events id as their
+# watermark, and are also refreshed for events near days whose trips changed
+EVENT_TABLES = {
+    'event_trip_attribution': refresh_event_attribution,
+}
+
+
+def changed_days(cur, table_name, full=False):
+    """Days whose trips differ from what table_name was last built from.
+
+    Only days from LOOKBACK_DAYS before the last recorded day onwards are
+    compared, which keeps the check to an index range scan on pickup_date.
+    """
+    cur.execute(f"SELECT MAX(pickup_date) FROM derived_day_counts WHERE table_name = '{table_name}'")
+    last_day = cur.fetchone()[0]
+    since = "0000-00-00"
+    if last_day and not full:
+        since = (date.fromisoformat(last_day) - timedelta(days=LOOKBACK_DAYS)).isoformat()
+
+    current = _day_counts(cur, f"""
+    SELECT pickup_date, COUNT(*), COALESCE(SUM(total_amount), 0)
+    FROM taxi_trips
+    WHERE pickup_date >= '{since}'
+    GROUP BY 1
+    """)
+    recorded = _day_counts(cur, f"""
+    SELECT pickup_date, trip_count, total_sum
+    FROM derived_day_counts
+    WHERE table_name = '{table_name}' AND pickup_date >= '{since}'
+    """)
+
+    days = sorted(d for d in set(current) | set(recorded)
+                  if current.get(d) != recorded.get(d) or (full and d in current))
+    return days, current
+
+
+def _record(cur, table_name, days, current, watermark, rows_processed):
+    """Remember what the refreshed days looked like and move the watermark"""
+    if days:
+        day_list = "', '".join(days)
+        cur.execute(f"""
+        DELETE FROM derived_day_counts
+        WHERE table_name = '{table_name}' AND pickup_date IN ('{day_list}')
+        """)
+        values = ", ".join(f"('{table_name}', '{d}', {current[d][0]}, {current[d][1]})"
+                           for d in days if d in current)
+        if values:
+            cur.execute(f"INSERT INTO derived_day_counts VALUES {values}")
+    cur.execute("""
+    INSERT INTO derived_watermarks (table_name, watermark, refreshed_at, rows_processed)
+    VALUES (%s, %s, now(), %s)
+    ON CONFLICT (table_name) DO UPDATE SET
+        watermark = EXCLUDED.watermark,
+        refreshed_at = EXCLUDED.refreshed_at,
+        rows_processed = EXCLUDED.rows_processed
+    """, (table_name, watermark, rows_processed))
+
+
+def _watermark(cur, table_name):
+    cur.execute(f"SELECT watermark FROM derived_watermarks WHERE table_name = '{table_name}'")
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def publish_hot_datasets(dataset_version):
+    """Share the datasets every app process reads with the whole host (see shared_store.py)"""
+    publish_zone_dictionary()
+    publish_profile_store(dataset_version)
+    publish_trip_samples(dataset_version)
+
+
+def refresh(tables=None, full=False, log=print):
+    """Bring every derived table up to date with taxi_trips and nyc_events.
+
+    Returns the new dataset version, or None when nothing changed.
+    """
+    conn = get_connection()
+    if conn is None:
+        return None
+    conn.autocommit = False
+    refreshed = []
+    try:
+        with conn.cursor() as cur:
+            cur.execute(REFRESH_TABLES_SQL)
+            conn.commit()
+
+            for table_name, refresher in DERIVED_TABLES.items():
+                if tables and table_name not in tables:
+                    continue
+                watermark = None if full else _watermark(cur, table_name)
+                started = time.time()
+                days, current = changed_days(cur, table_name, full)
+                if not days:
+                    continue
+                refresher(cur, days, watermark)
+
+                new_watermark = max([watermark or ""] + list(current)) or None
+                rows_processed = sum(current[d][0] for d in days if d in current)
+                _record(cur, table_name, days, current, new_watermark, rows_processed)
+                conn.commit()
+                refreshed.append(table_name)
+                log(f"{table_name}: {len(days)} day(s), {rows_processed:,} trips, "
+                    f"up to {new_watermark} ({time.time() - started:.1f}s)")
+
+            for table_name, refresher in EVENT_TABLES.items():
+                if tables and table_name not in tables:
+                    continue
+                watermark = None if full else _watermark(cur, table_name)
+                started = time.time()
+                days, current = changed_days(cur, table_name, full)
+                # Never built (or --full): everything; otherwise new ids and changed days
+                if watermark is None:
+                    n_events, last_id = refresher(cur)
+                else:
+                    n_events, last_id = refresher(cur, days, int(watermark))
+                if not n_events and not days:
+                    continue
+                _record(cur, table_name, days, current, None if last_id is None else str(last_id), n_events)
+                conn.commit()
+                refreshed.append(table_name)
+                log(f"{table_name}: {n_events:,} event(s) up to id {last_id} ({time.time() - started:.1f}s)")
+
+            if not refreshed:
+                return None
+            # The apps' caches key off this version (taxi_db.get_dataset_version)
+            cur.execute("INSERT INTO dataset_versions (tables) VALUES (%s) RETURNING version",
+                        (", ".join(refreshed),))
+            version = cur.fetchone()[0]
+            # Publish the hot datasets for this version before the apps can see it
+            try:
+                publish_hot_datasets(f"v{version}")
+            except OSError as e:
+                log(f"Could not publish to the shared store: {e}")
+            conn.commit()
+            return version
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally refresh derived tables from taxi_trips and nyc_events")
+    parser.add_argument("--full", action="store_true", help="recompute every day, not just recent changes")
+    parser.add_argument("--loop", type=int, metavar="SECONDS", help="keep refreshing every SECONDS seconds")
+    known_tables = list(DERIVED_TABLES) + list(EVENT_TABLES)
+    parser.add_argument("tables", nargs="*", help=f"only refresh these ({', '.join(known_tables)})")
+    args = parser.parse_args()
+    unknown = set(args.tables) - set(known_tables)
+    if unknown:
+        parser.error(f"unknown derived table(s): {', '.join(sorted(unknown))}")
+
+    while True:
+        version = refresh(args.tables, args.full)
+        print(f"Dataset version {version}" if version else "Derived tables are up to date")
+        if not args.loop:
+            break
+        args.full = False
+        time.sleep(args.loop)
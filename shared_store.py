@@ -0,0 +1,165 @@
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+import pyarrow as pa
+
+from taxi_db import DATA_DIR
+
+# Hot datasets shared by every app process on the host. Each dataset is a
+# directory of immutable versions plus a CURRENT pointer; frames are Arrow IPC
+# files and arrays .npy files, both memory-mapped read-only, so N processes
+# share one copy in the page cache. tmpfs (/dev/shm) keeps them off disk.
+STORE_DIR = os.environ.get("TAXI_SHARED_STORE") or (
+    os.path.join("/dev/shm", "taxi_store") if os.path.isdir("/dev/shm") else os.path.join(DATA_DIR, "shared_store")
+)
+CURRENT = "CURRENT"
+
+Snapshot = namedtuple('Snapshot', ['version', 'table', 'arrays', 'meta'])
+
+
+def _dataset_dir(name):
+    return os.path.join(STORE_DIR, name)
+
+
+def _current(base):
+    try:
+        with open(os.path.join(base, CURRENT)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def publish(name, version, frame=None, arrays=None, meta=None):
+    """Write a new version of a dataset and point readers at it atomically.
+
+    Processes that already mapped the previous version keep reading it; it is
+    removed once a later version replaces it.
+    """
+    base = _dataset_dir(name)
+    os.makedirs(base, exist_ok=True)
+    build = tempfile.mkdtemp(prefix=".build-", dir=base)
+    try:
+        if frame is not None:
+            table = frame if isinstance(frame, pa.Table) else pa.Table.from_pandas(frame, preserve_index=False)
+            # Uncompressed, so readers can map the buffers without decoding
+            with pa.OSFile(os.path.join(build, "frame.arrow"), 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        for key, array in (arrays or {}).items():
+            np.save(os.path.join(build, f"{key}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(build, "meta.json"), 'w') as f:
+            json.dump({'version': str(version), 'meta': meta or {}}, f)
+
+        with open(os.path.join(base, ".lock"), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            previous = _current(base)
+            target = f"{time.time_ns():x}"
+            os.rename(build, os.path.join(base, target))
+            pointer = os.path.join(base, f".{CURRENT}.tmp")
+            with open(pointer, 'w') as f:
+                f.write(target)
+            os.replace(pointer, os.path.join(base, CURRENT))
+            for entry in os.listdir(base):
+                if not entry.startswith('.') and entry not in (CURRENT, target, previous):
+                    shutil.rmtree(os.path.join(base, entry), ignore_errors=True)
+    finally:
+        shutil.rmtree(build, ignore_errors=True)
+    return target
+
+
+def _map(path):
+    with open(os.path.join(path, "meta.json")) as f:
+        info = json.load(f)
+    table = None
+    arrays = {}
+    for entry in os.listdir(path):
+        if entry == "frame.arrow":
+            table = pa.ipc.open_file(pa.memory_map(os.path.join(path, entry), 'r')).read_all()
+        elif entry.endswith(".npy"):
+            arrays[entry[:-4]] = np.load(os.path.join(path, entry), mmap_mode='r')
+    return Snapshot(info['version'], table, arrays, info['meta'])
+
+
+_attached = {}
+_attached_lock = threading.Lock()
+
+
+def attach(name, keep=True):
+    """Current Snapshot of a dataset, mapped read-only, or None if never published.
+
+    With keep=True the mapping is reused by later calls until a new version
+    is published.
+    """
+    base = _dataset_dir(name)
+    target = _current(base)
+    if target is None:
+        return None
+    with _attached_lock:
+        cached = _attached.get(name)
+        if cached is not None and cached[0] == target:
+            return cached[1]
+    try:
+        snapshot = _map(os.path.join(base, target))
+    except (OSError, ValueError):
+        # Replaced and removed between reading the pointer and mapping it
+        return None
+    if keep:
+        with _attached_lock:
+            _attached[name] = (target, snapshot)
+    return snapshot
+
+
+def read_frame(name, version=None, keep=True):
+    """The dataset's frame (None if missing or not at version).
+
+    Numeric and categorical columns stay backed by the shared mapping.
+    """
+    snapshot = attach(name, keep)
+    if snapshot is None or snapshot.table is None or (version is not None and snapshot.version != str(version)):
+        return None
+    return snapshot.table.to_pandas(split_blocks=True)
+
+
+def prune(prefix, keep):
+    """Remove all but the `keep` most recently published datasets under prefix/"""
+    root = _dataset_dir(prefix)
+    if not os.path.isdir(root):
+        return 0
+    datasets = []
+    for entry in os.listdir(root):
+        pointer = os.path.join(root, entry, CURRENT)
+        if os.path.exists(pointer):
+            datasets.append((os.path.getmtime(pointer), entry))
+    datasets.sort(reverse=True)
+    for _, entry in datasets[keep:]:
+        shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+    return max(0, len(datasets) - keep)
+
+
+def _size(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"List the datasets in the shared store ({STORE_DIR})")
+    parser.parse_args()
+
+    found = False
+    for root, dirs, files in sorted(os.walk(STORE_DIR)):
+        if CURRENT in files:
+            found = True
+            name = os.path.relpath(root, STORE_DIR)
+            snapshot = attach(name, keep=False)
+            version = snapshot.version if snapshot else "?"
+            print(f"{name:<40} {version:<12} {_size(root) / 1e6:8.2f} MB")
+            dirs[:] = []
+    if not found:
+        print("The shared store is empty")
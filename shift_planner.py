@@ -0,0 +1,281 @@
+import os
+import threading
+
+import numpy as np
+
+from taxi_db import DATA_DIR, get_connection
+from taxi_zones import (DAYS, PICKUP_DOW_SQL, PICKUP_HOUR_SQL, DURATION_MINUTES_SQL, MAX_TRIP_MINUTES,
+                        cursor_frame, refresh_rollup_days, update_zone_dictionary, load_zone_dictionary, zone_index)
+
+TRANSITIONS_PATH = os.path.join(DATA_DIR, "shift_transitions.npz")
+
+# Transitions are kept per (weekday/weekend, hour): 48 slots
+N_SLOTS = 48
+
+# Planning resolution and assumptions
+STEP_MINUTES = 15
+# Share of a zone's trips one driver can expect to pick up when waiting there
+CAPTURE_SHARE = 0.05
+# Repositioning candidates per zone (closest by typical drive time)
+REPOSITION_CANDIDATES = 12
+
+
+def slot_index(dow, hour):
+    return (1 if dow >= 5 else 0) * 24 + hour
+
+
+# Per-(slot, pickup zone, dropoff zone) sums behind the transitions, kept per
+# pickup_date too so the refresher only recomputes the days that changed
+TRANSITION_ROLLUP = "shift_flows"
+TRANSITION_KEY = "slot, pickup_zone, dropoff_zone"
+TRANSITION_SUMS = ['trip_count', 'total_sum', 'minutes_sum']
+TRANSITION_COLUMNS = """
+    slot SMALLINT NOT NULL,
+    pickup_zone TEXT NOT NULL,
+    dropoff_zone TEXT NOT NULL,
+    trip_count BIGINT NOT NULL,
+    total_sum DOUBLE PRECISION NOT NULL,
+    minutes_sum DOUBLE PRECISION NOT NULL
+"""
+
+# Aggregate trips with a plausible duration into daily flows; {where_clause} limits the days
+TRANSITION_AGGREGATE_SQL = f"""
+SELECT
+    pickup_date,
+    CASE WHEN {PICKUP_DOW_SQL} >= 5 THEN 1 ELSE 0 END * 24 + {PICKUP_HOUR_SQL} as slot,
+    pickup_zone,
+    dropoff_zone,
+    COUNT(*) as trip_count,
+    COALESCE(SUM(total_amount), 0) as total_sum,
+    SUM({DURATION_MINUTES_SQL}) as minutes_sum
+FROM
+    taxi_trips
+WHERE
+    pickup_zone != '' AND
+    dropoff_zone != '' AND
+    {DURATION_MINUTES_SQL} BETWEEN 1 AND {MAX_TRIP_MINUTES} AND
+    {{where_clause}}
+GROUP BY
+    1, 2, 3, 4
+"""
+
+
+def refresh_transition_matrix(cur, days=None, path=TRANSITIONS_PATH):
+    """Recompute the flows of the given pickup dates (every date when days is
+    None) inside the caller's transaction, and rewrite the zone-to-zone
+    transition probabilities, fares and durations per slot to an .npz"""
+    zones = update_zone_dictionary(days)
+    if zones.empty:
+        return None
+    refresh_rollup_days(cur, TRANSITION_ROLLUP, TRANSITION_COLUMNS, TRANSITION_KEY, TRANSITION_SUMS,
+                        TRANSITION_AGGREGATE_SQL, days)
+    index = zone_index(zones)
+    n = len(zones)
+
+    flows = cursor_frame(cur, f"SELECT * FROM {TRANSITION_ROLLUP}")
+    # Number of distinct days behind each slot, to turn counts into trips per hour
+    slot_days = cursor_frame(cur, f"""
+    SELECT
+        CASE WHEN {PICKUP_DOW_SQL} >= 5 THEN 1 ELSE 0 END as weekend,
+        COUNT(*) as n_days
+    FROM
+        {TRANSITION_ROLLUP}_days
+    GROUP BY
+        1
+    """)
+    if flows.empty:
+        return None
+
+    s = flows['slot'].astype(int).to_numpy()
+    p = flows['pickup_zone'].map(index).to_numpy()
+    d = flows['dropoff_zone'].map(index).to_numpy()
+    count = flows['trip_count'].astype(np.float64).to_numpy()
+
+    counts = np.zeros((N_SLOTS, n, n), dtype=np.float64)
+    fares = np.zeros((N_SLOTS, n, n), dtype=np.float32)
+    minutes = np.zeros((N_SLOTS, n, n), dtype=np.float32)
+    counts[s, p, d] = count
+    fares[s, p, d] = flows['total_sum'].astype(float).to_numpy() / count
+    minutes[s, p, d] = flows['minutes_sum'].astype(float).to_numpy() / count
+
+    n_days = np.ones(2)
+    n_days[slot_days['weekend'].astype(int).to_numpy()] = slot_days['n_days'].astype(float).to_numpy()
+    trips_per_hour = counts.sum(axis=2) / np.repeat(n_days, 24)[:, None]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dropoff_prob = counts / counts.sum(axis=2, keepdims=True)
+    dropoff_prob = np.nan_to_num(dropoff_prob).astype(np.float32)
+
+    # Typical drive time between zones regardless of slot; used for repositioning
+    # and wherever a slot has no observed trips for a pair
+    total = counts.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        drive_minutes = (minutes * counts).sum(axis=0) / total
+    drive_minutes = np.where(total > 0, drive_minutes, np.nan)
+    drive_minutes = np.fmin(drive_minutes, drive_minutes.T)
+    fallback = np.nanmedian(drive_minutes) if np.isfinite(drive_minutes).any() else 20.0
+    drive_minutes = np.where(np.isfinite(drive_minutes), drive_minutes, fallback)
+    np.fill_diagonal(drive_minutes, 0.0)
+    minutes = np.where(counts > 0, minutes, drive_minutes[None, :, :]).astype(np.float32)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        trips_per_hour=trips_per_hour.astype(np.float32),
+        dropoff_prob=dropoff_prob,
+        fares=fares,
+        minutes=minutes,
+        drive_minutes=drive_minutes.astype(np.float32)
+    )
+    os.replace(tmp_path, path)
+    return path
+
+
+def build_transition_matrix(path=TRANSITIONS_PATH):
+    """Aggregate all of taxi_trips into the shift flows and transitions file"""
+    conn = get_connection()
+    if conn is None:
+        return None
+    conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            path = refresh_transition_matrix(cur, None, path)
+        conn.commit()
+        return path
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+_transitions = None
+_transitions_mtime = None
+_transitions_lock = threading.Lock()
+
+
+def load_transitions(path=TRANSITIONS_PATH):
+    """Transition arrays, loaded once per process, or None if not built yet"""
+    global _transitions, _transitions_mtime
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _transitions_lock:
+        if _transitions is None or _transitions_mtime != mtime:
+            with np.load(path) as f:
+                arrays = {k: f[k] for k in f.files}
+            drive = arrays['drive_minutes'].copy()
+            np.fill_diagonal(drive, np.inf)
+            arrays['neighbors'] = np.argsort(drive, axis=1)[:, :REPOSITION_CANDIDATES]
+            _transitions = arrays
+            _transitions_mtime = mtime
+        return _transitions
+
+
+def plan_shift(start_zone, dow, start_hour, shift_hours, capture_share=CAPTURE_SHARE):
+    """Expected-earnings-maximizing plan for a shift starting in start_zone.
+
+    Dynamic programming backwards over STEP_MINUTES steps. In each step a
+    driver in zone z either waits (picks up a fare with probability
+    1 - exp(-capture_share * trips_per_hour * step), which pays the average
+    fare to a random dropoff and advances by the trip time) or drives empty
+    to one of the nearby zones. Returns (steps, expected_total) where steps
+    is the most likely sequence of decisions, or None if the transition
+    matrix hasn't been built.
+    """
+    t = load_transitions()
+    if t is None:
+        return None
+    # Zones added to the dictionary after the matrix was built aren't in it
+    n = t['trips_per_hour'].shape[1]
+    zones = load_zone_dictionary().iloc[:n]
+    z0 = zone_index(zones).get(start_zone)
+    if z0 is None:
+        return None
+    n_steps = int(shift_hours * 60 // STEP_MINUTES)
+    step_hours = STEP_MINUTES / 60.0
+
+    # Slot for each step of the shift
+    clock = start_hour + np.arange(n_steps) * step_hours
+    step_dow = (dow + (clock // 24).astype(int)) % 7
+    step_slot = np.array([slot_index(d, int(h) % 24) for d, h in zip(step_dow, clock)])
+
+    neighbors = t['neighbors']
+    reposition_steps = np.maximum(1, np.ceil(
+        np.take_along_axis(t['drive_minutes'], neighbors, axis=1) / STEP_MINUTES)).astype(int)
+
+    # V[k, z]: expected earnings from step k to the end of the shift when free in zone z
+    V = np.zeros((n_steps + 1, n))
+    action = np.full((n_steps, n), -1, dtype=np.int64)  # -1 wait, otherwise target zone
+    cols = np.arange(n)
+    for k in range(n_steps - 1, -1, -1):
+        s = step_slot[k]
+        p_ride = 1.0 - np.exp(-capture_share * t['trips_per_hour'][s] * step_hours)
+
+        trip_steps = np.maximum(1, np.ceil(t['minutes'][s] / STEP_MINUTES)).astype(int)
+        # A trip that runs past the end of the shift still pays its fare
+        future = V[np.minimum(k + trip_steps, n_steps), cols[None, :]]
+        ride_value = (t['dropoff_prob'][s] * (t['fares'][s] + future)).sum(axis=1)
+        wait_value = p_ride * ride_value + (1.0 - p_ride) * V[k + 1]
+
+        move_value = V[np.minimum(k + reposition_steps, n_steps), neighbors]
+        best_move = np.argmax(move_value, axis=1)
+        move_best = move_value[cols, best_move]
+
+        moving = move_best > wait_value
+        V[k] = np.where(moving, move_best, wait_value)
+        action[k] = np.where(moving, neighbors[cols, best_move], -1)
+
+    # Most likely path: follow the policy, assuming waits end in the most likely ride
+    steps = []
+    k, z = 0, z0
+    while k < n_steps:
+        s = step_slot[k]
+        clock_label = f"{DAYS[step_dow[k]][:3]} {int(clock[k]) % 24:02d}:{int(round((clock[k] % 1) * 60)):02d}"
+        if action[k, z] >= 0:
+            target = action[k, z]
+            dur = max(1, int(np.ceil(t['drive_minutes'][z, target] / STEP_MINUTES)))
+            steps.append({
+                'time': clock_label,
+                'zone': zones['zone'].iloc[z],
+                'action': f"Reposition to {zones['zone'].iloc[target]}",
+                'expected_fare': 0.0,
+                'expected_remaining': V[k, z]
+            })
+            k, z = k + dur, target
+        else:
+            probs = t['dropoff_prob'][s, z]
+            p_ride = 1.0 - np.exp(-capture_share * t['trips_per_hour'][s, z] * step_hours)
+            if probs.sum() == 0:
+                steps.append({
+                    'time': clock_label,
+                    'zone': zones['zone'].iloc[z],
+                    'action': "Wait",
+                    'expected_fare': 0.0,
+                    'expected_remaining': V[k, z]
+                })
+                k += 1
+                continue
+            target = int(np.argmax(probs))
+            dur = max(1, int(np.ceil(t['minutes'][s, z, target] / STEP_MINUTES)))
+            steps.append({
+                'time': clock_label,
+                'zone': zones['zone'].iloc[z],
+                'action': f"Wait for a fare ({p_ride:.0%} chance per {STEP_MINUTES} min), likely to {zones['zone'].iloc[target]}",
+                'expected_fare': float((probs * t['fares'][s, z]).sum()),
+                'expected_remaining': V[k, z]
+            })
+            # Waiting until the ride arrives takes about 1/p steps
+            k, z = k + int(np.ceil(1.0 / max(p_ride, 1e-6))) - 1 + dur, target
+
+    return steps, float(V[0, z0])
+
+
+if __name__ == "__main__":
+    path = build_transition_matrix()
+    if path is None:
+        print("No trips found to build transitions from")
+    else:
+        print(f"Saved zone transitions to {path}")
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from aiohttp import web
+
+from taxi_db import POOL_MAX_CONNECTIONS, active_queries, coalesced_queries
+from taxi_zones import DAYS
+from trip_profiles import TIME_RANGE_HOURS
+from taxi_queries import best_zones, trip_profitability, filter_where_clause, filtered_summary, trips_by_hour
+
+# Queries block, so they run on worker threads; one per pooled connection
+_executor = ThreadPoolExecutor(max_workers=POOL_MAX_CONNECTIONS, thread_name_prefix="taxi-api")
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _json_default(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, (pd.Timestamp, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _respond(payload, status=200):
+    return web.json_response(payload, status=status,
+                             dumps=lambda obj: json.dumps(obj, default=_json_default))
+
+
+def _records(frame):
+    return [] if frame is None else frame.replace({np.nan: None}).to_dict(orient='records')
+
+
+def _choice(query, name, options, default=None):
+    value = query.get(name, default)
+    if value not in options:
+        raise BadRequest(f"{name} must be one of: {', '.join(options)}")
+    return value
+
+
+def _number(query, name, default=None, low=None, high=None):
+    try:
+        value = float(query[name]) if name in query else default
+    except ValueError:
+        raise BadRequest(f"{name} must be a number")
+    if value is None:
+        raise BadRequest(f"{name} is required")
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise BadRequest(f"{name} must be between {low} and {high}")
+    return value
+
+
+def _date(query, name):
+    try:
+        return date.fromisoformat(query[name]).isoformat()
+    except KeyError:
+        raise BadRequest(f"{name} is required")
+    except ValueError:
+        raise BadRequest(f"{name} must be a YYYY-MM-DD date")
+
+
+def _list(query, name):
+    return [v.strip() for v in query.get(name, "").split(",") if v.strip()]
+
+
+async def _run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+def _endpoint(handler):
+    async def wrapped(request):
+        try:
+            return _respond(await handler(request))
+        except BadRequest as e:
+            return _respond({'error': str(e)}, status=400)
+    return wrapped
+
+
+# 1. Best Time & Place Recommender
+@_endpoint
+async def best_zones_handler(request):
+    q = request.query
+    day = _choice(q, 'day', DAYS)
+    time_range = _choice(q, 'time_range', list(TIME_RANGE_HOURS))
+    borough = q.get('borough', 'All')
+    limit = int(_number(q, 'limit', 10, 1, 50))
+    results = await _run(best_zones, day, time_range, borough, limit)
+    return {'day': day, 'time_range': time_range, 'borough': borough, 'zones': _records(results)}
+
+
+# 2. Trip Profitability Analyzer
+@_endpoint
+async def trip_profitability_handler(request):
+    q = request.query
+    if 'pickup_borough' not in q or 'dropoff_borough' not in q:
+        raise BadRequest("pickup_borough and dropoff_borough are required")
+    time_range = _choice(q, 'time_range', list(TIME_RANGE_HOURS))
+    distance = _number(q, 'distance', None, 0, 30)
+    trip = await _run(trip_profitability, q['pickup_borough'], q['dropoff_borough'], time_range, distance)
+    return {'trip': trip}
+
+
+# 3. Custom Trip Filter & Stats
+@_endpoint
+async def filtered_stats_handler(request):
+    q = request.query
+    where_clause = filter_where_clause(
+        _date(q, 'start_date'),
+        _date(q, 'end_date'),
+        _number(q, 'distance_min', 0.0, 0, 100),
+        _number(q, 'distance_max', 30.0, 0, 100),
+        _list(q, 'pickup_borough'),
+        _list(q, 'dropoff_borough')
+    )
+    summary, by_hour = await asyncio.gather(_run(filtered_summary, where_clause),
+                                            _run(trips_by_hour, where_clause))
+    summary = _records(summary)
+    return {'summary': summary[0] if summary else None, 'by_hour': _records(by_hour)}
+
+
+async def health_handler(request):
+    return _respond({'status': 'ok', 'active_queries': active_queries(), 'coalesced_queries': coalesced_queries()})
+
+
+def create_app():
+    app = web.Application()
+    app.add_routes([
+        web.get('/health', health_handler),
+        web.get('/best-zones', best_zones_handler),
+        web.get('/trip-profitability', trip_profitability_handler),
+        web.get('/filtered-stats', filtered_stats_handler),
+    ])
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSON API for the driver tools")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
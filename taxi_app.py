@@ -1,11 +1,29 @@
 import streamlit as st
 import pandas as pd
-import psycopg2 as psycopg
 import plotly.express as px
 import plotly.graph_objects as go
+import uuid
+import threading
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 import numpy as np
-from scipy import stats
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+
+from taxi_db import get_connection
+from query_cache import cached_query, warm_up
+from trip_schema import apply_trip_schema
+from taxi_figures import fare_scatter_figure, histogram_figure, breakdown_pie_figure, gauge_figure, trips_by_hour_figure
+from taxi_histograms import HISTOGRAM_METRICS, get_histogram
+from trip_profiles import TIME_RANGE_HOURS
+from taxi_zones import DAYS, HOURS_PER_WEEK, hour_of_week, hour_of_week_label
+from shift_planner import plan_shift
+from demand_forecast import forecast_week, forecast_zone, busiest_zones
+from taxi_queries import best_zones, trip_profitability, filter_where_clause, filtered_summary, trips_by_hour
+from zone_map import geometries_built, render_zone_map
+from zone_heatmap import METRICS, METRIC_LABELS, load_zone_hour_matrix, aggregate_hours, top_zones
+from analytics_pool import submit
+from trip_sample import route_estimate, sample_estimate
+from prefetch import served, prefetch_stats
 
 # Set page configuration
 st.set_page_config(
@@ -15,40 +33,6 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Database connection function - FIXED to create a new connection each time
-def get_connection():
-    """Create a new connection every time - no caching"""
-    try:
-        conn = psycopg.connect(
-            host="localhost",
-            port='5432',
-            dbname="Taxi_Project",
-            user="postgres",
-            password="123"
-        )
-        conn.autocommit = True
-        return conn
-    except Exception as e:
-        st.error(f"Database connection error: {e}")
-        return None
-
-# Function to execute queries and return dataframes - FIXED
-def execute_query(query):
-    """Create a fresh connection for each query"""
-    conn = None
-    try:
-        conn = get_connection()
-        if conn:
-            df = pd.read_sql_query(query, conn)
-            return df
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Query execution error: {e}")
-        return pd.DataFrame()
-    finally:
-        if conn:
-            conn.close()
-
 # Helper function to convert time strings to hour categories
 def categorize_hour(time_str):
     try:
@@ -70,6 +54,52 @@ def categorize_hour(time_str):
     except:
         return 'Unknown'
 
+# Analyses are keyed per browser session, so a rerun only cancels that user's own jobs
+def analytics_key(name):
+    if 'analytics_session' not in st.session_state:
+        st.session_state['analytics_session'] = uuid.uuid4().hex
+    return f"{st.session_state['analytics_session']}:{name}"
+
+# Runs fn(*args) on its own thread and returns a Future. The thread is
+# attached to this script run, so st.error and the caches work there too
+def in_background(fn, *args):
+    future = Future()
+    def run():
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+    thread = threading.Thread(target=run, daemon=True)
+    add_script_run_ctx(thread)
+    thread.start()
+    return future
+
+# Metric cards for a filtered_summary row. Estimates (see trip_sample.py) are
+# marked with "≈" and carry their 95% interval in the tooltip
+def summary_metrics(summary):
+    row = summary.iloc[0]
+    def card(label, column, fmt):
+        value = fmt.format(row[column])
+        interval = None
+        if f"{column}_error" in row:
+            value = "≈ " + value
+            error = row[f"{column}_error"]
+            interval = f"95% interval: {fmt.format(row[column] - error)} to {fmt.format(row[column] + error)}"
+        st.metric(label, value, help=interval)
+
+    metrics = st.columns(3)
+    with metrics[0]:
+        card("Total Trips", 'trip_count', "{:,.0f}")
+        card("Avg Distance", 'avg_distance', "{:.2f} miles")
+
+    with metrics[1]:
+        card("Avg Fare", 'avg_fare', "${:.2f}")
+        card("Avg Tip", 'avg_tip', "${:.2f}")
+
+    with metrics[2]:
+        card("Avg Total", 'avg_total', "${:.2f}")
+        card("Total Revenue", 'total_revenue', "${:,.2f}")
+
 # Add custom CSS
 st.markdown("""
 <style>
@@ -117,7 +147,8 @@ st.markdown('<div class="main-header">NYC Taxi Driver Insights 🚕</div>', unsa
 # Sidebar for navigation
 st.sidebar.title("Navigation")
 page = st.sidebar.radio("Select a Tool", 
-    ["Best Time & Place Recommender", "Trip Profitability Analyzer", "Custom Trip Filter & Stats"])
+    ["Best Time & Place Recommender", "Trip Profitability Analyzer", "Custom Trip Filter & Stats",
+     "Shift Planner", "Demand Forecast"])
 
 # Test database connection
 try:
@@ -131,14 +162,17 @@ except:
     db_connected = False
 
 if db_connected:
+    # A fresh process re-reads the most requested queries from the disk cache
+    warm_up('app', cached_query)
+    
     # Load boroughs and zones for dropdowns
     def load_location_data():
         boroughs_query = "SELECT DISTINCT pickup_borough FROM taxi_trips WHERE pickup_borough != '' ORDER BY pickup_borough"
-        boroughs_df = execute_query(boroughs_query)
+        boroughs_df = cached_query(boroughs_query)
         boroughs = boroughs_df['pickup_borough'].tolist() if not boroughs_df.empty else []
         
         zones_query = "SELECT DISTINCT pickup_zone FROM taxi_trips WHERE pickup_zone != '' ORDER BY pickup_zone"
-        zones_df = execute_query(zones_query)
+        zones_df = cached_query(zones_query)
         zones = zones_df['pickup_zone'].tolist() if not zones_df.empty else []
         
         return boroughs, zones
@@ -155,131 +189,177 @@ if db_connected:
         st.markdown('<div class="feature-header">🔍 Best Time and Place to Work Recommender</div>', unsafe_allow_html=True)
         st.write("Find the optimal time and location to maximize your earnings.")
         
-        col1, col2, col3 = st.columns(3)
+        recommender_mode = st.radio("Mode", ["Top Zones", "Weekly Heatmap"], horizontal=True)
         
-        with col1:
-            days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-            selected_day = st.selectbox("Select day of week", days)
+        if recommender_mode == "Weekly Heatmap":
+            # Every answer here comes from the precomputed zone x weekly-hour matrix,
+            # so changing a selection never touches the database
+            heatmap_zones, zone_matrix = load_zone_hour_matrix()
             
-        with col2:
-            time_ranges = ["6am-9am", "9am-12pm", "12pm-3pm", "3pm-6pm", "6pm-9pm", "9pm-12am", "12am-6am"]
-            selected_time = st.selectbox("Select time range", time_ranges)
-            
-        with col3:
-            selected_borough = st.selectbox("Select pickup borough", ["All"] + boroughs)
-        
-        # Convert day selection to matching pattern in your data
-        if st.button("Find Optimal Locations", type="primary"):
-            with st.spinner("Analyzing data..."):
-                # Build the SQL query based on user selections
-                time_condition = ""
-                if selected_time == "6am-9am":
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 6 AND 8"
-                elif selected_time == "9am-12pm":
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 9 AND 11"
-                elif selected_time == "12pm-3pm":
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 12 AND 14"
-                elif selected_time == "3pm-6pm":
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 15 AND 17"
-                elif selected_time == "6pm-9pm":
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 18 AND 20"
-                elif selected_time == "9pm-12am":
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 21 AND 23"
-                else:  # 12am-6am
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 0 AND 5"
+            if zone_matrix is None:
+                st.info("The weekly heatmap hasn't been built yet. Run `python zone_heatmap.py` to create it.")
+            else:
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    heatmap_metric = st.selectbox("Metric", METRICS, index=1, format_func=METRIC_LABELS.get)
+                with col2:
+                    heatmap_borough = st.selectbox("Pickup borough", ["All"] + boroughs, key="heatmap_borough")
+                with col3:
+                    heatmap_rows = st.slider("Zones shown", 10, 100, 40, 10)
                 
-                borough_condition = f"pickup_borough = '{selected_borough}'" if selected_borough != "All" else "1=1"
+                metric_index = METRICS.index(heatmap_metric)
+                values = np.asarray(zone_matrix[:, :, metric_index], dtype=np.float64)
+                counts = np.asarray(zone_matrix[:, :, 0], dtype=np.float64)
                 
-                # This assumes you can extract day of week from pickup_date
-                # Adjust based on your actual data format
-                day_condition = f"TO_CHAR(TO_DATE(pickup_date, 'YYYY-MM-DD'), 'Day') LIKE '{selected_day}%'"
+                # Rank zones by the metric over the whole week, busiest-weighted
+                in_borough = np.ones(len(heatmap_zones), dtype=bool)
+                if heatmap_borough != "All":
+                    in_borough = heatmap_zones['borough'].to_numpy() == heatmap_borough
+                weekly = aggregate_hours(zone_matrix, np.arange(HOURS_PER_WEEK))[:, metric_index]
+                weekly = np.where(in_borough & (counts.sum(axis=1) > 0), weekly, -np.inf)
+                n_rows = min(heatmap_rows, int(np.isfinite(weekly).sum()))
                 
-                query = f"""
-                SELECT 
-                    pickup_zone,
-                    COUNT(*) as trip_count,
-                    AVG(fare_amount) as avg_fare,
-                    AVG(tip_amount) as avg_tip,
-                    AVG(total_amount) as avg_total
-                FROM 
-                    taxi_trips
-                WHERE 
-                    {day_condition} AND
-                    {time_condition} AND
-                    {borough_condition}
-                GROUP BY 
-                    pickup_zone
-                ORDER BY 
-                    AVG(total_amount) DESC
-                LIMIT 10
-                """
+                if n_rows == 0:
+                    st.warning("No data found for your selection. Try different criteria.")
+                else:
+                    shown = np.argpartition(-weekly, n_rows - 1)[:n_rows]
+                    shown = shown[np.argsort(-weekly[shown])]
+                    z = np.where(counts[shown] > 0, values[shown], np.nan)
+                    
+                    fig = go.Figure(go.Heatmap(
+                        z=z,
+                        x=[hour_of_week_label(h) for h in range(HOURS_PER_WEEK)],
+                        y=heatmap_zones['zone'].iloc[shown].tolist(),
+                        colorscale="Viridis",
+                        colorbar=dict(title=METRIC_LABELS[heatmap_metric]),
+                        hovertemplate="%{y}<br>%{x}<br>%{z:.2f}<extra></extra>"
+                    ))
+                    fig.update_layout(
+                        title=f"{METRIC_LABELS[heatmap_metric]} by Zone and Hour of Week",
+                        height=max(400, 18 * n_rows),
+                        yaxis=dict(autorange="reversed"),
+                        xaxis=dict(nticks=28)
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
                 
-                results = execute_query(query)
+                # Top-k for any day and time range, answered in memory
+                st.subheader("Top Zones for a Time Slot")
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    top_day = st.selectbox("Day of week", DAYS, key="heatmap_day")
+                with col2:
+                    top_time = st.selectbox("Time range", list(TIME_RANGE_HOURS), key="heatmap_time")
+                with col3:
+                    top_k = st.number_input("How many zones", 1, 50, 10)
                 
-                if not results.empty:
-                    st.success(f"Found {len(results)} optimal pickup zones.")
-                    
-                    # Display metrics
-                    metric_cols = st.columns(3)
-                    with metric_cols[0]:
-                        st.markdown(f"""
-                        <div class="metric-card">
-                            <div class="metric-value">${results['avg_total'].mean():.2f}</div>
-                            <div class="metric-title">Average Total Fare</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    with metric_cols[1]:
-                        st.markdown(f"""
-                        <div class="metric-card">
-                            <div class="metric-value">${results['avg_tip'].mean():.2f}</div>
-                            <div class="metric-title">Average Tip</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    with metric_cols[2]:
-                        st.markdown(f"""
-                        <div class="metric-card">
-                            <div class="metric-value">{results['trip_count'].sum()}</div>
-                            <div class="metric-title">Total Trips</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    # Create bar chart for top zones
-                    st.subheader(f"Top 10 Most Profitable Pickup Zones")
-                    
-                    fig = px.bar(
-                        results,
-                        x='pickup_zone',
-                        y='avg_total',
-                        color='avg_tip',
-                        labels={'pickup_zone': 'Pickup Zone', 'avg_total': 'Average Total Fare ($)', 'avg_tip': 'Average Tip ($)'},
-                        title=f"Most Profitable Pickup Zones on {selected_day} during {selected_time}",
-                        height=500
-                    )
+                start_hour, end_hour = TIME_RANGE_HOURS[top_time]
+                slot_hours = [hour_of_week(DAYS.index(top_day), h) for h in range(start_hour, end_hour + 1)]
+                best = top_zones(zone_matrix, heatmap_zones, slot_hours, heatmap_metric, int(top_k), heatmap_borough)
+                
+                if best.empty:
+                    st.warning("No data found for your selection. Try different criteria.")
+                else:
+                    best = best.rename(columns={'zone': 'Pickup Zone', 'borough': 'Borough', **METRIC_LABELS})
+                    st.dataframe(best.round(2), use_container_width=True)
+        
+        else:
+            col1, col2, col3 = st.columns(3)
+        
+            with col1:
+                days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+                selected_day = st.selectbox("Select day of week", days)
+            
+            with col2:
+                time_ranges = ["6am-9am", "9am-12pm", "12pm-3pm", "3pm-6pm", "6pm-9pm", "9pm-12am", "12am-6am"]
+                selected_time = st.selectbox("Select time range", time_ranges)
+            
+            with col3:
+                selected_borough = st.selectbox("Select pickup borough", ["All"] + boroughs)
+            
+            # Background prefetching of neighbouring selections (see prefetch.py)
+            with st.sidebar.expander("Prefetching"):
+                stats = prefetch_stats()
+                st.caption(
+                    f"{stats['completed']:,} of {stats['scheduled']:,} prefetches done, {stats['queued']} queued. "
+                    f"{stats['hits']:,} served from a prefetch. "
+                    f"{stats['cancelled']:,} cancelled under load, {stats['dropped']:,} dropped over budget, "
+                    f"{stats['failed']:,} failed."
+                )
+        
+            # Convert day selection to matching pattern in your data
+            if st.button("Find Optimal Locations", type="primary"):
+                with st.spinner("Analyzing data..."):
+                    selection = (selected_day, selected_time, selected_borough)
+                    results = best_zones(*selection)
+                    
+                    # Warm the cache for the selections likely to come next
+                    served(st.session_state.get('recommender_last'), selection)
+                    st.session_state['recommender_last'] = selection
+                
+                    if not results.empty:
+                        st.success(f"Found {len(results)} optimal pickup zones.")
+                    
+                        # Display metrics
+                        metric_cols = st.columns(3)
+                        with metric_cols[0]:
+                            st.markdown(f"""
+                            <div class="metric-card">
+                                <div class="metric-value">${results['avg_total'].mean():.2f}</div>
+                                <div class="metric-title">Average Total Fare</div>
+                            </div>
+                            """, unsafe_allow_html=True)
+                    
+                        with metric_cols[1]:
+                            st.markdown(f"""
+                            <div class="metric-card">
+                                <div class="metric-value">${results['avg_tip'].mean():.2f}</div>
+                                <div class="metric-title">Average Tip</div>
+                            </div>
+                            """, unsafe_allow_html=True)
+                    
+                        with metric_cols[2]:
+                            st.markdown(f"""
+                            <div class="metric-card">
+                                <div class="metric-value">{results['trip_count'].sum()}</div>
+                                <div class="metric-title">Total Trips</div>
+                            </div>
+                            """, unsafe_allow_html=True)
+                    
+                        # Create bar chart for top zones
+                        st.subheader(f"Top 10 Most Profitable Pickup Zones")
+                    
+                        fig = px.bar(
+                            results,
+                            x='pickup_zone',
+                            y='avg_total',
+                            color='avg_tip',
+                            labels={'pickup_zone': 'Pickup Zone', 'avg_total': 'Average Total Fare ($)', 'avg_tip': 'Average Tip ($)'},
+                            title=f"Most Profitable Pickup Zones on {selected_day} during {selected_time}",
+                            height=500
+                        )
                     
-                    st.plotly_chart(fig, use_container_width=True)
+                        st.plotly_chart(fig, use_container_width=True)
                     
-                    # Show the detailed data
-                    st.subheader("Detailed Results")
-                    # Format to 2 decimal places for dollar amounts
-                    results['avg_fare'] = results['avg_fare'].round(2)
-                    results['avg_tip'] = results['avg_tip'].round(2)
-                    results['avg_total'] = results['avg_total'].round(2)
+                        # Show the detailed data
+                        st.subheader("Detailed Results")
+                        # Format to 2 decimal places for dollar amounts
+                        results['avg_fare'] = results['avg_fare'].round(2)
+                        results['avg_tip'] = results['avg_tip'].round(2)
+                        results['avg_total'] = results['avg_total'].round(2)
                     
-                    # Rename columns for better display
-                    results.columns = ['Pickup Zone', 'Trip Count', 'Avg Fare ($)', 'Avg Tip ($)', 'Avg Total ($)']
+                        # Rename columns for better display
+                        results.columns = ['Pickup Zone', 'Trip Count', 'Avg Fare ($)', 'Avg Tip ($)', 'Avg Total ($)']
                     
-                    st.dataframe(results, use_container_width=True)
+                        st.dataframe(results, use_container_width=True)
                     
-                    st.download_button(
-                        label="Download Data as CSV",
-                        data=results.to_csv(index=False).encode('utf-8'),
-                        file_name=f"best_zones_{selected_day}_{selected_time.replace('-', 'to')}.csv",
-                        mime='text/csv',
-                    )
-                else:
-                    st.warning("No data found for your selection. Try different criteria.")
+                        st.download_button(
+                            label="Download Data as CSV",
+                            data=results.to_csv(index=False).encode('utf-8'),
+                            file_name=f"best_zones_{selected_day}_{selected_time.replace('-', 'to')}.csv",
+                            mime='text/csv',
+                        )
+                    else:
+                        st.warning("No data found for your selection. Try different criteria.")
     
     # 2. "Trip Profitability Analyzer"
     elif page == "Trip Profitability Analyzer":
@@ -305,63 +385,31 @@ if db_connected:
         # User clicks analyze
         if st.button("Analyze Trip Profitability", type="primary"):
             with st.spinner("Calculating profitability..."):
-                # Convert time selection to hour range for query
-                time_condition = ""
-                if selected_time == "6am-9am":
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 6 AND 8"
-                elif selected_time == "9am-12pm":
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 9 AND 11"
-                elif selected_time == "12pm-3pm":
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 12 AND 14"
-                elif selected_time == "3pm-6pm":
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 15 AND 17"
-                elif selected_time == "6pm-9pm":
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 18 AND 20"
-                elif selected_time == "9pm-12am":
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 21 AND 23"
-                else:  # 12am-6am
-                    time_condition = "EXTRACT(HOUR FROM pickup_time::time) BETWEEN 0 AND 5"
-                
-                # Distance range (e.g., +/- 1 mile)
-                distance_lower = max(0, trip_distance - 1)
-                distance_upper = trip_distance + 1
-                
-                # Build query to find similar trips
-                query = f"""
-                SELECT 
-                    AVG(fare_amount) as avg_fare,
-                    AVG(tip_amount) as avg_tip,
-                    AVG(extra) as avg_extra,
-                    AVG(tolls_amount) as avg_tolls,
-                    AVG(congestion_surcharge) as avg_congestion,
-                    AVG(total_amount) as avg_total,
-                    COUNT(*) as trip_count
-                FROM 
-                    taxi_trips
-                WHERE 
-                    trip_distance BETWEEN {distance_lower} AND {distance_upper} AND
-                    {time_condition} AND
-                    pickup_borough = '{selected_pickup_borough}' AND
-                    dropoff_borough = '{selected_dropoff_borough}'
-                """
+                trip = trip_profitability(
+                    selected_pickup_borough,
+                    selected_dropoff_borough,
+                    selected_time,
+                    trip_distance
+                )
                 
-                # Add filter for payment type if needed
-                # This would need a payment_type column in your data
-                
-                results = execute_query(query)
-                
-                if not results.empty and results['trip_count'].iloc[0] > 0:
+                if trip is not None:
                     # Get values from results
-                    avg_fare = results['avg_fare'].iloc[0]
-                    avg_tip = results['avg_tip'].iloc[0]
-                    avg_extra = results['avg_extra'].iloc[0]
-                    avg_tolls = results['avg_tolls'].iloc[0]
-                    avg_congestion = results['avg_congestion'].iloc[0]
-                    avg_total = results['avg_total'].iloc[0]
-                    trip_count = results['trip_count'].iloc[0]
+                    avg_fare = trip['avg_fare']
+                    avg_tip = trip['avg_tip']
+                    avg_extra = trip['avg_extra']
+                    avg_tolls = trip['avg_tolls']
+                    avg_congestion = trip['avg_congestion']
+                    avg_total = trip['avg_total']
                     
                     # Display results
-                    st.success(f"Analysis based on {int(trip_count)} similar trips")
+                    if trip['source'] == 'history':
+                        st.success(f"Analysis based on {trip['trip_count']} similar trips")
+                    else:
+                        st.info("No similar trips on record - showing the fare model's estimate instead")
+                    
+                    if 'model_total' in trip:
+                        st.caption(f"Model estimate: ${trip['model_total']:.2f} total "
+                                   f"(80% of trips between ${trip['model_total_low']:.2f} and ${trip['model_total_high']:.2f})")
                     
                     # Main metrics
                     metric_cols = st.columns(3)
@@ -389,9 +437,8 @@ if db_connected:
                         </div>
                         """, unsafe_allow_html=True)
                     
-                    # Calculate hourly rate estimate (assuming average NYC taxi speed of 12mph)
-                    estimated_trip_time = trip_distance / 12  # hours
-                    hourly_rate = avg_total / estimated_trip_time if estimated_trip_time > 0 else 0
+                    hourly_rate = trip['hourly_rate']
+                    avg_speed = trip['avg_speed_mph']
                     
                     st.subheader("Trip Breakdown")
                     
@@ -404,100 +451,37 @@ if db_connected:
                     breakdown_df = breakdown_df[breakdown_df['Amount'] > 0]  # Only show components > 0
                     
                     # Create a pie chart for the breakdown
-                    fig_breakdown = px.pie(
-                        breakdown_df,
-                        values='Amount',
-                        names='Component',
-                        title="Trip Fare Breakdown",
-                        hole=0.4,
-                        color_discrete_sequence=px.colors.sequential.Plasma_r
-                    )
-                    
-                    # Modify layout
-                    fig_breakdown.update_traces(textposition='inside', textinfo='percent+label')
-                    fig_breakdown.update_layout(
-                        legend=dict(orientation="h", yanchor="bottom", y=-0.2, xanchor="center", x=0.5)
-                    )
+                    fig_breakdown = breakdown_pie_figure(breakdown_df)
                     
                     st.plotly_chart(fig_breakdown, use_container_width=True)
                     
                     # Profitability assessment
                     st.subheader("Profitability Assessment")
                     
-                    # Get average trip profitability from the database
-                    avg_query = f"""
-                    SELECT 
-                        AVG(total_amount) as overall_avg_total,
-                        AVG(total_amount / NULLIF(trip_distance, 0)) as per_mile_avg
-                    FROM 
-                        taxi_trips
-                    WHERE 
-                        trip_distance > 0
-                    """
-                    
-                    avg_results = execute_query(avg_query)
-                    
-                    if not avg_results.empty:
-                        overall_avg = avg_results['overall_avg_total'].iloc[0]
-                        per_mile_avg = avg_results['per_mile_avg'].iloc[0]
-                        
-                        per_mile_current = avg_total / trip_distance if trip_distance > 0 else 0
+                    if 'overall_avg_total' in trip:
+                        overall_avg = trip['overall_avg_total']
+                        per_mile_avg = trip['per_mile_avg']
+                        per_mile_current = trip['per_mile']
                         
                         cols = st.columns(2)
                         with cols[0]:
-                            profit_gauge = go.Figure(go.Indicator(
-                                mode = "gauge+number+delta",
-                                value = avg_total,
-                                title = {'text': "Trip Value vs. Average"},
-                                delta = {'reference': overall_avg, 'relative': True, 'valueformat': '.1%'},
-                                gauge = {
-                                    'axis': {'range': [0, max(overall_avg * 2, avg_total * 1.2)]},
-                                    'bar': {'color': "darkblue"},
-                                    'steps': [
-                                        {'range': [0, overall_avg * 0.8], 'color': "red"},
-                                        {'range': [overall_avg * 0.8, overall_avg * 1.1], 'color': "yellow"},
-                                        {'range': [overall_avg * 1.1, max(overall_avg * 2, avg_total * 1.2)], 'color': "green"}
-                                    ],
-                                    'threshold': {
-                                        'line': {'color': "red", 'width': 4},
-                                        'thickness': 0.75,
-                                        'value': overall_avg
-                                    }
-                                }
-                            ))
-                            profit_gauge.update_layout(height=300)
+                            profit_gauge = gauge_figure(avg_total, overall_avg, "Trip Value vs. Average")
                             st.plotly_chart(profit_gauge, use_container_width=True)
                         
                         with cols[1]:
-                            mile_gauge = go.Figure(go.Indicator(
-                                mode = "gauge+number+delta",
-                                value = per_mile_current,
-                                title = {'text': "$ Per Mile vs. Average"},
-                                number = {'prefix': "$", 'valueformat': '.2f'},
-                                delta = {'reference': per_mile_avg, 'relative': True, 'valueformat': '.1%'},
-                                gauge = {
-                                    'axis': {'range': [0, max(per_mile_avg * 2, per_mile_current * 1.2)]},
-                                    'bar': {'color': "darkblue"},
-                                    'steps': [
-                                        {'range': [0, per_mile_avg * 0.8], 'color': "red"},
-                                        {'range': [per_mile_avg * 0.8, per_mile_avg * 1.1], 'color': "yellow"},
-                                        {'range': [per_mile_avg * 1.1, max(per_mile_avg * 2, per_mile_current * 1.2)], 'color': "green"}
-                                    ],
-                                    'threshold': {
-                                        'line': {'color': "red", 'width': 4},
-                                        'thickness': 0.75,
-                                        'value': per_mile_avg
-                                    }
-                                }
-                            ))
-                            mile_gauge.update_layout(height=300)
+                            mile_gauge = gauge_figure(
+                                per_mile_current,
+                                per_mile_avg,
+                                "$ Per Mile vs. Average",
+                                number={'prefix': "$", 'valueformat': '.2f'}
+                            )
                             st.plotly_chart(mile_gauge, use_container_width=True)
                     
                     # Estimated hourly rate
                     st.markdown(f"""
                     <div class="metric-card">
                         <div class="metric-value">${hourly_rate:.2f}/hr</div>
-                        <div class="metric-title">Estimated Hourly Rate (Based on avg. speed of 12mph)</div>
+                        <div class="metric-title">Estimated Hourly Rate (Based on avg. speed of {avg_speed:.0f}mph)</div>
                     </div>
                     """, unsafe_allow_html=True)
                     
@@ -534,8 +518,8 @@ if db_connected:
         max_date_query = "SELECT MAX(pickup_date) FROM taxi_trips"
         
         try:
-            min_date_result = execute_query(min_date_query)
-            max_date_result = execute_query(max_date_query)
+            min_date_result = cached_query(min_date_query)
+            max_date_result = cached_query(max_date_query)
             
             min_date_str = min_date_result.iloc[0, 0] if not min_date_result.empty else "2023-01-01"
             max_date_str = max_date_result.iloc[0, 0] if not max_date_result.empty else "2023-12-31"
@@ -592,102 +576,60 @@ if db_connected:
         
         # Analysis execution
         if st.button("Run Analysis", type="primary"):
-            with st.spinner("Running analysis..."):
-                # Build the WHERE clause
-                conditions = []
-                conditions.append(f"pickup_date BETWEEN '{start_date_str}' AND '{end_date_str}'")
-                conditions.append(f"trip_distance BETWEEN {distance_min} AND {distance_max}")
-                
-                if pickup_borough:
-                    borough_list = "', '".join(pickup_borough)
-                    conditions.append(f"pickup_borough IN ('{borough_list}')")
-                    
-                if dropoff_borough:
-                    borough_list = "', '".join(dropoff_borough)
-                    conditions.append(f"dropoff_borough IN ('{borough_list}')")
-                
-                where_clause = " AND ".join(conditions)
-                
-                # Main metrics query
-                metrics_query = f"""
-                SELECT 
-                    COUNT(*) as trip_count,
-                    AVG(trip_distance) as avg_distance,
-                    AVG(fare_amount) as avg_fare,
-                    AVG(tip_amount) as avg_tip,
-                    AVG(total_amount) as avg_total,
-                    SUM(total_amount) as total_revenue
-                FROM 
-                    taxi_trips
-                WHERE 
-                    {where_clause}
-                """
+            where_clause = filter_where_clause(
+                start_date_str, end_date_str, distance_min, distance_max,
+                pickup_borough, dropoff_borough
+            )
+            
+            # The exact summary and hourly counts run in the background while
+            # the trip sample answers first
+            summary_job = in_background(filtered_summary, where_clause)
+            hours_job = in_background(trips_by_hour, where_clause)
+            
+            # The smallest stratified sample that is within 5% of the answer
+            filters = (start_date_str, end_date_str, distance_min, distance_max, pickup_borough, dropoff_borough)
+            sample_table, estimate = route_estimate(filters, max_error=0.05)
+            
+            # Cards and the hour chart are drawn in place, first from the
+            # estimate and then from the exact results
+            results = st.empty()
+            with results.container():
+                st.subheader("Summary Metrics")
+                metrics_slot = st.empty()
+                status_slot = st.empty()
                 
-                metrics_results = execute_query(metrics_query)
+                st.subheader("Data Visualizations")
+                viz_tabs = st.tabs(["Trips by Hour", "Trips by Borough", "Fare Analysis", "Zone Map"])
+                with viz_tabs[0]:
+                    hour_slot = st.empty()
+            
+            if estimate is not None:
+                with metrics_slot.container():
+                    summary_metrics(estimate)
+                status_slot.caption(
+                    f"Estimated from {int(estimate['sample_rows'].iloc[0]):,} sampled trips "
+                    "(hover for 95% intervals). Exact figures are on their way..."
+                )
+                hour_estimate = sample_estimate(sample_table, filters, by='hour')
+                if hour_estimate is not None and not hour_estimate.empty:
+                    hour_slot.plotly_chart(trips_by_hour_figure(hour_estimate), use_container_width=True)
+            
+            with st.spinner("Running analysis..."):
+                metrics_results = summary_job.result()
                 
-                if not metrics_results.empty:
-                    # Display main metrics
-                    st.subheader("Summary Metrics")
-                    
-                    metrics = st.columns(3)
-                    with metrics[0]:
-                        st.metric("Total Trips", f"{int(metrics_results['trip_count'].iloc[0]):,}")
-                        st.metric("Avg Distance", f"{metrics_results['avg_distance'].iloc[0]:.2f} miles")
-                    
-                    with metrics[1]:
-                        st.metric("Avg Fare", f"${metrics_results['avg_fare'].iloc[0]:.2f}")
-                        st.metric("Avg Tip", f"${metrics_results['avg_tip'].iloc[0]:.2f}")
-                    
-                    with metrics[2]:
-                        st.metric("Avg Total", f"${metrics_results['avg_total'].iloc[0]:.2f}")
-                        st.metric("Total Revenue", f"${metrics_results['total_revenue'].iloc[0]:,.2f}")
-                    
-                    # Visualizations section
-                    st.subheader("Data Visualizations")
-                    
-                    viz_tabs = st.tabs(["Trips by Hour", "Trips by Borough", "Fare Analysis"])
+                if metrics_results.empty:
+                    results.warning("No data matches your filter criteria. Please adjust and try again.")
+                else:
+                    with metrics_slot.container():
+                        summary_metrics(metrics_results)
+                    status_slot.empty()
                     
                     # Tab 1: Trips by Hour
-                    with viz_tabs[0]:
-                        hour_query = f"""
-                        SELECT 
-                            EXTRACT(HOUR FROM pickup_time::time) as hour,
-                            COUNT(*) as trip_count,
-                            AVG(total_amount) as avg_total
-                        FROM 
-                            taxi_trips
-                        WHERE 
-                            {where_clause}
-                        GROUP BY 
-                            EXTRACT(HOUR FROM pickup_time::time)
-                        ORDER BY 
-                            hour
-                        """
-                        
-                        hour_results = execute_query(hour_query)
-                        
-                        if not hour_results.empty:
-                            # Create hour labels
-                            hour_results['hour_label'] = hour_results['hour'].apply(lambda x: f"{int(x)}:00")
-                            
-                            # Create the chart
-                            fig = px.bar(
-                                hour_results,
-                                x='hour_label',
-                                y='trip_count',
-                                color='avg_total',
-                                labels={
-                                    'hour_label': 'Hour of Day',
-                                    'trip_count': 'Number of Trips',
-                                    'avg_total': 'Avg Total Fare ($)'
-                                },
-                                title="Trip Distribution by Hour of Day",
-                                color_continuous_scale=px.colors.sequential.Viridis
-                            )
-                            
-                            st.plotly_chart(fig, use_container_width=True)
-                        else:
-                            st.info("No hourly data available for the selected filters.")
+                    hour_results = hours_job.result()
+                    if not hour_results.empty:
+                        hour_slot.plotly_chart(trips_by_hour_figure(hour_results), use_container_width=True)
+                    else:
+                        hour_slot.info("No hourly data available for the selected filters.")
                     
                     # Tab 2: Trips by Borough
                     with viz_tabs[1]:
@@ -707,7 +649,7 @@ if db_connected:
                             trip_count DESC
                         """
                         
-                        borough_results = execute_query(borough_query)
+                        borough_results = cached_query(borough_query)
                         
                         if not borough_results.empty:
                             # Create a heatmap of pickup to dropoff borough
@@ -750,7 +692,7 @@ if db_connected:
                                 avg_total DESC
                             """
                             
-                            borough_avg_results = execute_query(borough_avg_query)
+                            borough_avg_results = cached_query(borough_avg_query)
                             
                             if not borough_avg_results.empty:
                                 # Create a bar chart
@@ -801,84 +743,95 @@ if db_connected:
                         LIMIT 5000
                         """
                         
-                        fare_results = execute_query(fare_query)
+                        fare_results = apply_trip_schema(cached_query(fare_query))
                         
                         if not fare_results.empty:
-                            # Create scatterplot of distance vs. fare
-                            fig = px.scatter(
-                                fare_results,
-                                x='trip_distance',
-                                y='total_amount',
-                                color='tip_amount',
-                                labels={
-                                    'trip_distance': 'Trip Distance (miles)',
-                                    'total_amount': 'Total Fare ($)',
-                                    'tip_amount': 'Tip Amount ($)'
-                                },
-                                title="Fare vs. Distance Analysis",
-                                color_continuous_scale="Viridis",
-                                opacity=0.7
-                            )
-                            
-                            # Add trendline
-                            fig.update_traces(marker=dict(size=8))
-                            
-                            # Add a linear regression trendline
-                            slope, intercept, r_value, p_value, std_err = stats.linregress(
-                                fare_results['trip_distance'],
-                                fare_results['total_amount']
-                            )
-                            
-                            # Create trendline data
-                            x_range = np.linspace(fare_results['trip_distance'].min(), fare_results['trip_distance'].max(), 100)
-                            y_pred = slope * x_range + intercept
+                            # Linear regression trendline and a bootstrap interval for its slope,
+                            # fitted in the analytics pool; new filters cancel the previous fit
+                            fit = submit(
+                                analytics_key("fare_regression"),
+                                'fare_regression',
+                                {'x': fare_results['trip_distance'].to_numpy(), 'y': fare_results['total_amount'].to_numpy()}
+                            ).result()
                             
-                            # Add trendline to plot
-                            fig.add_trace(
-                                go.Scatter(
-                                    x=x_range,
-                                    y=y_pred,
-                                    mode='lines',
-                                    name=f'Trend (${slope:.2f}/mile)',
-                                    line=dict(color='red', width=3)
-                                )
+                            # Scatterplot of distance vs. fare (binned when there are too many points)
+                            fig = fare_scatter_figure(
+                                fare_results,
+                                fit['slope'] if fit else None,
+                                fit['intercept'] if fit else None
                             )
                             
                             st.plotly_chart(fig, use_container_width=True)
                             
                             # Show the correlation
-                            correlation = fare_results['trip_distance'].corr(fare_results['total_amount'])
-                            st.info(f"Correlation between distance and fare: {correlation:.2f}")
-                            
-                            # Tip percentage analysis
-                            fare_results['tip_percentage'] = (fare_results['tip_amount'] / fare_results['fare_amount'] * 100).clip(0, 100)
-                            
-                            # Create a histogram of tip percentages
-                            fig = px.histogram(
-                                fare_results,
-                                x='tip_percentage',
-                                nbins=20,
-                                labels={
-                                    'tip_percentage': 'Tip Percentage (%)',
-                                    'count': 'Number of Trips'
-                                },
-                                title="Distribution of Tip Percentages",
-                                color_discrete_sequence=['#636EFA']
-                            )
-                            
-                            # Add average line
-                            avg_tip_pct = fare_results['tip_percentage'].mean()
-                            fig.add_vline(
-                                x=avg_tip_pct,
-                                line_dash="dash",
-                                line_color="red",
-                                annotation_text=f"Avg: {avg_tip_pct:.1f}%",
-                                annotation_position="top right"
-                            )
-                            
-                            st.plotly_chart(fig, use_container_width=True)
+                            if fit is None:
+                                st.warning("The fare analysis didn't finish in time, so the trendline is left out.")
+                            else:
+                                note = f"Correlation between distance and fare: {fit['correlation']:.2f}"
+                                if not np.isnan(fit['slope_low']):
+                                    interval = f"95% interval ${fit['slope_low']:.2f}-${fit['slope_high']:.2f}"
+                                    if not fit['complete']:
+                                        interval += f", from {fit['resamples']:,} resamples"
+                                    note += f". Fare per mile: ${fit['slope']:.2f} ({interval})"
+                                st.info(note)
                         else:
                             st.info("No fare data available for the selected filters.")
+                        
+                        # Distributions are binned in SQL over every matching trip,
+                        # not just the scatter sample above
+                        hist_tabs = st.tabs(["Tip Percentage", "Trip Distance", "Total Fare"])
+                        for hist_tab, metric in zip(hist_tabs, ['tip_percentage', 'trip_distance', 'total_amount']):
+                            with hist_tab:
+                                hist = get_histogram(metric, where_clause, bins=20)
+                                if hist['total'] > 0:
+                                    spec = HISTOGRAM_METRICS[metric]
+                                    fig = histogram_figure(
+                                        hist['edges'],
+                                        hist['counts'],
+                                        hist['mean'],
+                                        spec['label'],
+                                        spec['title'],
+                                        spec['unit']
+                                    )
+                                    st.plotly_chart(fig, use_container_width=True)
+                                else:
+                                    st.info("No data available for this distribution.")
+                    
+                    # Tab 4: Zone Map
+                    with viz_tabs[3]:
+                        if not geometries_built():
+                            st.info("Zone geometries haven't been built yet. Run `python zone_map.py` to create them.")
+                        else:
+                            zone_query = f"""
+                            SELECT 
+                                pickup_zone,
+                                COUNT(*) as trip_count,
+                                AVG(fare_amount) as avg_fare,
+                                AVG(tip_amount / NULLIF(fare_amount, 0)) * 100 as tip_percentage
+                            FROM 
+                                taxi_trips
+                            WHERE 
+                                {where_clause} AND
+                                pickup_zone != ''
+                            GROUP BY 
+                                pickup_zone
+                            """
+                            
+                            zone_results = cached_query(zone_query)
+                            
+                            if not zone_results.empty:
+                                # A single borough zooms in far enough to use the finer geometry
+                                map_level = "Borough" if len(pickup_borough) == 1 else "Citywide"
+                                map_tabs = st.tabs(["Trips", "Avg Fare", "Tip %"])
+                                for map_tab, column, label in zip(
+                                    map_tabs,
+                                    ['trip_count', 'avg_fare', 'tip_percentage'],
+                                    ['Trips', 'Avg Fare ($)', 'Tip (%)']
+                                ):
+                                    with map_tab:
+                                        render_zone_map(zone_results['pickup_zone'], zone_results[column], label, map_level)
+                            else:
+                                st.info("No zone data available for the selected filters.")
                     
                     # Download section
                     st.subheader("Download Filtered Data")
@@ -902,7 +855,7 @@ if db_connected:
                     LIMIT 10000
                     """
                     
-                    download_data = execute_query(download_query)
+                    download_data = apply_trip_schema(cached_query(download_query))
                     
                     if not download_data.empty:
                         st.write(f"Showing {len(download_data)} records (limited to 10,000 for download)")
@@ -917,8 +870,90 @@ if db_connected:
                         )
                     else:
                         st.warning("No data available for download with current filters.")
-                else:
-                    st.warning("No data matches your filter criteria. Please adjust and try again.")
+    
+    # 4. "Shift Planner"
+    elif page == "Shift Planner":
+        st.markdown('<div class="feature-header">🗺️ Shift Planner</div>', unsafe_allow_html=True)
+        st.write("Plan where to wait and where to reposition to maximize expected earnings over a shift.")
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            start_zone = st.selectbox("Starting zone", zones if zones else ["Midtown Center"])
+            shift_day = st.selectbox("Day of week", DAYS)
+        
+        with col2:
+            shift_start = st.slider("Shift start (hour)", 0, 23, 17)
+            shift_length = st.slider("Shift length (hours)", 2, 12, 8)
+        
+        if st.button("Plan My Shift", type="primary"):
+            with st.spinner("Planning shift..."):
+                plan = plan_shift(start_zone, DAYS.index(shift_day), shift_start, shift_length)
+            
+            if plan is None:
+                st.info("The zone transition matrix hasn't been built yet. Run `python shift_planner.py` to create it.")
+            else:
+                steps, expected_total = plan
+                
+                metric_cols = st.columns(2)
+                with metric_cols[0]:
+                    st.markdown(f"""
+                    <div class="metric-card">
+                        <div class="metric-value">${expected_total:.2f}</div>
+                        <div class="metric-title">Expected Shift Earnings</div>
+                    </div>
+                    """, unsafe_allow_html=True)
+                
+                with metric_cols[1]:
+                    st.markdown(f"""
+                    <div class="metric-card">
+                        <div class="metric-value">${expected_total / shift_length:.2f}/hr</div>
+                        <div class="metric-title">Expected Earnings per Hour</div>
+                    </div>
+                    """, unsafe_allow_html=True)
+                
+                st.subheader("Suggested Plan")
+                plan_df = pd.DataFrame(steps)
+                plan_df.columns = ['Time', 'Zone', 'Action', 'Expected Fare ($)', 'Expected Remaining ($)']
+                st.dataframe(plan_df.round(2), use_container_width=True)
+    
+    # 5. "Demand Forecast"
+    elif page == "Demand Forecast":
+        st.markdown('<div class="feature-header">📈 Demand Forecast</div>', unsafe_allow_html=True)
+        st.write("Expected hourly pickups per zone for the coming week, including scheduled events.")
+        
+        week = forecast_week()
+        if week is None:
+            st.info("The demand forecast hasn't been trained yet. Run `python demand_forecast.py` to create it.")
+        else:
+            forecast_zones, forecast_hours, forecast, in_event = week
+            day_labels = [f"{d:%A, %b} {d.day}" for d in forecast_hours[::24]]
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                forecast_zone_name = st.selectbox("Zone", forecast_zones,
+                                                  index=forecast_zones.index("Midtown Center") if "Midtown Center" in forecast_zones else 0)
+            with col2:
+                forecast_day = st.selectbox("Day", day_labels)
+            
+            zone_forecast = forecast_zone(forecast_zone_name, week=week)
+            fig = px.line(zone_forecast, x='hour', y='trips',
+                          labels={'hour': '', 'trips': 'Forecast Pickups'},
+                          title=f"Hourly Pickups Forecast for {forecast_zone_name}")
+            event_hours = zone_forecast[zone_forecast['event']]
+            if not event_hours.empty:
+                fig.add_trace(go.Scatter(x=event_hours['hour'], y=event_hours['trips'], mode='markers',
+                                         marker=dict(color='#e74c3c', size=6), name='Event nearby'))
+            st.plotly_chart(fig, use_container_width=True)
+            
+            st.subheader(f"Busiest Zones on {forecast_day}")
+            busiest = busiest_zones(day_offset=day_labels.index(forecast_day), week=week)
+            busiest.columns = ['Zone', 'Forecast Pickups', 'Event Nearby']
+            st.dataframe(busiest.round(0), use_container_width=True)
+            
+            if geometries_built():
+                day_cols = slice(day_labels.index(forecast_day) * 24, day_labels.index(forecast_day) * 24 + 24)
+                render_zone_map(forecast_zones, forecast[:, day_cols].sum(axis=1), "Forecast Pickups")
 
 # Add Research Questions section
 st.sidebar.markdown("---")
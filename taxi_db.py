@@ -0,0 +1,234 @@
+import hashlib
+import io
+import os
+import re
+import threading
+from concurrent.futures import Future
+
+import streamlit as st
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+import psycopg2 as psycopg
+from psycopg2.pool import ThreadedConnectionPool
+
+# Precomputed artifacts (models, matrices) built by the batch scripts
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+DB_SETTINGS = dict(
+    host="localhost",
+    port='5432',
+    dbname="Taxi_Project",
+    user="postgres",
+    password="123"
+)
+
+# Connections kept open per process for execute_query, shared by every
+# Streamlit session and by the JSON API
+POOL_MIN_CONNECTIONS = 1
+POOL_MAX_CONNECTIONS = 10
+
+# Database connection function - a dedicated connection for callers that
+# manage their own transactions (batch scripts)
+def get_connection():
+    """Create a new connection every time - no caching"""
+    try:
+        conn = psycopg.connect(**DB_SETTINGS)
+        conn.autocommit = True
+        return conn
+    except Exception as e:
+        st.error(f"Database connection error: {e}")
+        return None
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises when it runs out instead of waiting, so
+# callers queue here for a free connection
+_pool_slots = threading.BoundedSemaphore(POOL_MAX_CONNECTIONS)
+# execute_query calls running or waiting for a connection, so background
+# work can back off under load
+_active_queries = 0
+_active_lock = threading.Lock()
+
+def get_pool():
+    """The process-wide connection pool, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS, **DB_SETTINGS)
+        return _pool
+
+# Postgres type OIDs of result columns -> Arrow types; anything else is read as text
+_ARROW_TYPES = {
+    16: pa.bool_(),
+    20: pa.int64(), 21: pa.int64(), 23: pa.int64(),
+    700: pa.float64(), 701: pa.float64(), 1700: pa.float64(),
+    1082: pa.date32(),
+    1114: pa.timestamp('us'), 1184: pa.timestamp('us', tz='UTC'),
+}
+
+_CSV_CONVERT = dict(
+    # COPY writes NULL as an empty field and an empty string as ""
+    null_values=[''], strings_can_be_null=True, quoted_strings_can_be_null=False,
+    true_values=['t'], false_values=['f']
+)
+
+
+def read_frame(conn, query):
+    """Run a query and return a DataFrame with typed columns.
+
+    SELECTs are streamed with COPY ... TO STDOUT and parsed by Arrow's
+    multithreaded CSV reader straight into typed columns, instead of building
+    a Python tuple per row through the cursor.
+    """
+    query = query.strip().rstrip(';')
+    if not re.match(r"(SELECT|WITH)\b", query, re.IGNORECASE):
+        return pd.read_sql_query(query, conn)
+
+    with conn.cursor() as cur:
+        # Result column names and types, without running the query
+        cur.execute(f"SELECT * FROM ({query}) q LIMIT 0")
+        columns = [(col.name, col.type_code) for col in cur.description]
+        names = [name for name, _ in columns]
+        if len(set(names)) != len(names):
+            return pd.read_sql_query(query, conn)
+        buffer = io.BytesIO()
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", buffer)
+
+    types = {}
+    for name, oid in columns:
+        if oid in _ARROW_TYPES:
+            types[name] = _ARROW_TYPES[oid]
+        else:
+            types[name] = pa.string()
+    schema = pa.schema([(name, types[name]) for name in names])
+
+    if buffer.getbuffer().nbytes == 0:
+        table = schema.empty_table()
+    else:
+        buffer.seek(0)
+        table = pa_csv.read_csv(
+            buffer,
+            read_options=pa_csv.ReadOptions(column_names=names),
+            # A row of a single NULL is an empty line
+            parse_options=pa_csv.ParseOptions(ignore_empty_lines=False),
+            convert_options=pa_csv.ConvertOptions(column_types=types, **_CSV_CONVERT)
+        )
+    return table.to_pandas()
+
+def active_queries():
+    return _active_queries
+
+# Identical queries issued at the same time (many sessions opening the same
+# page, or every cache expiring at once) run once; the callers that arrive
+# while it runs wait for it and get a copy of its result
+_flights = {}
+_flights_lock = threading.Lock()
+_coalesced_queries = 0
+
+
+def query_fingerprint(query):
+    """Hash of a query with its layout normalized, so reindented copies match"""
+    # Whitespace inside string literals is left alone
+    parts = re.split(r"('(?:[^']|'')*')", query.strip().rstrip(';'))
+    normalized = "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts)).strip()
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def _shared_copy(result):
+    return result.copy() if isinstance(result, pd.DataFrame) else result
+
+
+def single_flight(key, compute):
+    """compute(), unless a call with the same key is already running: then its result"""
+    global _coalesced_queries
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Future()
+            flight.waiters = 0
+        else:
+            flight.waiters += 1
+            _coalesced_queries += 1
+    if not leader:
+        return _shared_copy(flight.result())
+
+    try:
+        result = compute()
+    except BaseException as e:
+        with _flights_lock:
+            del _flights[key]
+        flight.set_exception(e)
+        raise
+    with _flights_lock:
+        del _flights[key]
+        waiters = flight.waiters
+    flight.set_result(result)
+    # Nobody can join any more; keep the waiters' copy safe from the caller
+    return _shared_copy(result) if waiters else result
+
+
+def coalesced_queries():
+    """Calls answered by another caller's identical query since the process started"""
+    return _coalesced_queries
+
+# Function to execute queries and return dataframes
+def execute_query(query):
+    """Run a read query on a pooled connection, shared with identical concurrent calls"""
+    return single_flight(query_fingerprint(query), lambda: _execute_query(query))
+
+
+def _execute_query(query):
+    global _active_queries
+    conn = None
+    broken = False
+    with _active_lock:
+        _active_queries += 1
+    _pool_slots.acquire()
+    try:
+        pool = get_pool()
+        conn = pool.getconn()
+        conn.autocommit = True
+        df = read_frame(conn, query)
+        return df
+    except Exception as e:
+        # Don't hand a connection in an unknown state back to the pool
+        broken = conn is not None and (conn.closed or isinstance(e, psycopg.OperationalError))
+        st.error(f"Query execution error: {e}")
+        return pd.DataFrame()
+    finally:
+        if conn is not None:
+            _pool.putconn(conn, close=broken)
+        _pool_slots.release()
+        with _active_lock:
+            _active_queries -= 1
+
+# Version stamp the apps' caches key off. refresh.py records a new version
+# each time it updates the derived tables; before it has ever run, fall back
+# to the write counters of taxi_trips, which change whenever rows are written
+@st.cache_data(ttl=30, show_spinner=False)
+def get_dataset_version():
+    version = execute_query("""
+    SELECT version
+    FROM dataset_versions
+    ORDER BY version DESC
+    LIMIT 1
+    """) if table_exists('dataset_versions') else pd.DataFrame()
+    if not version.empty:
+        return f"v{int(version.iloc[0]['version'])}"
+
+    version = execute_query("""
+    SELECT n_tup_ins, n_tup_upd, n_tup_del
+    FROM pg_stat_user_tables
+    WHERE relname = 'taxi_trips'
+    """)
+    if version.empty:
+        return "unknown"
+    row = version.iloc[0]
+    return f"{int(row['n_tup_ins'])}-{int(row['n_tup_upd'])}-{int(row['n_tup_del'])}"
+
+
+def table_exists(table_name):
+    exists = execute_query(f"SELECT to_regclass('{table_name}') IS NOT NULL as present")
+    return not exists.empty and bool(exists.iloc[0]['present'])
@@ -0,0 +1,290 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date
+
+import pandas as pd
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+
+# Upper bounds on what we ship to the browser per chart
+MAX_SERIES_POINTS = 500
+MAX_SCATTER_POINTS = 2000
+DENSITY_BINS = 60
+
+# Figure cache (shared by every session of this process)
+_FIGURE_CACHE_SIZE = 256
+_figure_cache = OrderedDict()
+_figure_cache_lock = threading.Lock()
+
+
+def data_fingerprint(df):
+    """Stable hash of a frame's columns and values"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(list(df.columns)).encode('utf-8'))
+    if not df.empty:
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def cached_figure(name, df, params, build):
+    """Return a copy of the figure for (name, data fingerprint, params), building it on a miss.
+
+    Callers get their own copy, so updating its layout can't leak into other sessions.
+    """
+    key = (name, data_fingerprint(df), repr(sorted(params.items())))
+    with _figure_cache_lock:
+        fig = _figure_cache.get(key)
+        if fig is not None:
+            _figure_cache.move_to_end(key)
+            return go.Figure(fig)
+
+    fig = build()
+
+    with _figure_cache_lock:
+        _figure_cache[key] = fig
+        while len(_figure_cache) > _FIGURE_CACHE_SIZE:
+            _figure_cache.popitem(last=False)
+    return go.Figure(fig)
+
+
+# Downsampling helpers
+def _as_numeric(values):
+    values = pd.Series(values)
+    # DATE columns arrive as objects holding datetime.date
+    if values.dtype == object:
+        present = values.dropna()
+        if len(present) and isinstance(present.iloc[0], date):
+            values = pd.to_datetime(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype('int64').to_numpy(dtype=float)
+    return pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: indices of the n_out points that best keep the shape"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # First and last points are always kept, the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        area = np.abs(
+            (x[prev] - avg_x) * (bucket_y - y[prev]) - (x[prev] - bucket_x) * (avg_y - y[prev])
+        )
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+
+    return selected
+
+
+def downsample_series(df, x, y, max_points=MAX_SERIES_POINTS):
+    """LTTB-downsample a time series frame on column y; other columns keep the same rows"""
+    if len(df) <= max_points:
+        return df
+    ordered = df.sort_values(x)
+    idx = lttb_indices(_as_numeric(ordered[x]), _as_numeric(ordered[y]), max_points)
+    return ordered.iloc[idx]
+
+
+def _bin_edges(values, bins):
+    lo, hi = np.nanmin(values), np.nanmax(values)
+    if lo == hi:
+        hi = lo + 1
+    return np.linspace(lo, hi, bins + 1)
+
+
+# Shared figure builders for taxi_app
+def fare_scatter_figure(fare_results, slope, intercept):
+    """Distance vs. total fare; large results are shipped as a binned density instead of points"""
+    def build():
+        x = fare_results['trip_distance'].to_numpy(dtype=float)
+        y = fare_results['total_amount'].to_numpy(dtype=float)
+
+        if len(fare_results) > MAX_SCATTER_POINTS:
+            x_edges = _bin_edges(x, DENSITY_BINS)
+            y_edges = _bin_edges(y, DENSITY_BINS)
+            counts, _, _ = np.histogram2d(x, y, bins=[x_edges, y_edges])
+            counts[counts == 0] = np.nan
+            fig = go.Figure(go.Heatmap(
+                x=(x_edges[:-1] + x_edges[1:]) / 2,
+                y=(y_edges[:-1] + y_edges[1:]) / 2,
+                z=counts.T,
+                colorscale="Viridis",
+                colorbar=dict(title="Trips"),
+                hovertemplate="Distance: %{x:.1f} mi<br>Total: $%{y:.2f}<br>Trips: %{z}<extra></extra>"
+            ))
+            fig.update_layout(
+                title=f"Fare vs. Distance Analysis ({len(fare_results):,} trips, binned)",
+                xaxis_title='Trip Distance (miles)',
+                yaxis_title='Total Fare ($)'
+            )
+        else:
+            fig = px.scatter(
+                fare_results,
+                x='trip_distance',
+                y='total_amount',
+                color='tip_amount',
+                labels={
+                    'trip_distance': 'Trip Distance (miles)',
+                    'total_amount': 'Total Fare ($)',
+                    'tip_amount': 'Tip Amount ($)'
+                },
+                title="Fare vs. Distance Analysis",
+                color_continuous_scale="Viridis",
+                opacity=0.7
+            )
+            fig.update_traces(marker=dict(size=8))
+
+        # Linear regression trendline, when the fit finished
+        if slope is not None:
+            x_range = np.linspace(np.nanmin(x), np.nanmax(x), 100)
+            fig.add_trace(
+                go.Scatter(
+                    x=x_range,
+                    y=slope * x_range + intercept,
+                    mode='lines',
+                    name=f'Trend (${slope:.2f}/mile)',
+                    line=dict(color='red', width=3)
+                )
+            )
+        return fig
+
+    return cached_figure(
+        "fare_scatter",
+        fare_results[['trip_distance', 'total_amount', 'tip_amount']],
+        {"slope": None if slope is None else round(slope, 6),
+         "intercept": None if intercept is None else round(intercept, 6)},
+        build
+    )
+
+
+def histogram_figure(edges, counts, mean, x_label, title, unit=''):
+    """Histogram drawn from pre-binned edges and counts, so only the bins reach the browser"""
+    edges = np.asarray(edges, dtype=float)
+    counts = np.asarray(counts)
+
+    def build():
+        centers = (edges[:-1] + edges[1:]) / 2
+        fig = go.Figure(go.Bar(
+            x=centers,
+            y=counts,
+            width=np.diff(edges),
+            marker_color='#636EFA',
+            hovertemplate="%{x:.1f}: %{y} trips<extra></extra>"
+        ))
+        fig.update_layout(
+            title=title,
+            xaxis_title=x_label,
+            yaxis_title='Number of Trips',
+            bargap=0
+        )
+
+        if mean is not None:
+            label = f"${mean:.2f}" if unit == '$' else f"{mean:.1f}{unit}"
+            fig.add_vline(
+                x=mean,
+                line_dash="dash",
+                line_color="red",
+                annotation_text=f"Avg: {label}",
+                annotation_position="top right"
+            )
+        return fig
+
+    bins = pd.DataFrame({'left': edges[:-1], 'count': counts})
+    return cached_figure("histogram", bins, {"mean": mean, "x_label": x_label, "title": title, "unit": unit}, build)
+
+
+def trips_by_hour_figure(hour_results):
+    """Trips per hour of day colored by average total; estimates get trip_count_error bars"""
+    def build():
+        hours = hour_results.copy()
+        hours['hour_label'] = hours['hour'].apply(lambda x: f"{int(x)}:00")
+        fig = px.bar(
+            hours,
+            x='hour_label',
+            y='trip_count',
+            color='avg_total',
+            error_y='trip_count_error' if 'trip_count_error' in hours else None,
+            labels={
+                'hour_label': 'Hour of Day',
+                'trip_count': 'Number of Trips',
+                'avg_total': 'Avg Total Fare ($)'
+            },
+            title="Trip Distribution by Hour of Day",
+            color_continuous_scale=px.colors.sequential.Viridis
+        )
+        return fig
+
+    return cached_figure("trips_by_hour", hour_results, {}, build)
+
+
+def breakdown_pie_figure(breakdown_df):
+    def build():
+        fig = px.pie(
+            breakdown_df,
+            values='Amount',
+            names='Component',
+            title="Trip Fare Breakdown",
+            hole=0.4,
+            color_discrete_sequence=px.colors.sequential.Plasma_r
+        )
+        fig.update_traces(textposition='inside', textinfo='percent+label')
+        fig.update_layout(
+            legend=dict(orientation="h", yanchor="bottom", y=-0.2, xanchor="center", x=0.5)
+        )
+        return fig
+
+    return cached_figure("breakdown_pie", breakdown_df, {}, build)
+
+
+def gauge_figure(value, reference, title, number=None):
+    """Gauge of value against a reference, red/yellow/green around the reference"""
+    def build():
+        top = max(reference * 2, value * 1.2)
+        indicator = dict(
+            mode="gauge+number+delta",
+            value=value,
+            title={'text': title},
+            delta={'reference': reference, 'relative': True, 'valueformat': '.1%'},
+            gauge={
+                'axis': {'range': [0, top]},
+                'bar': {'color': "darkblue"},
+                'steps': [
+                    {'range': [0, reference * 0.8], 'color': "red"},
+                    {'range': [reference * 0.8, reference * 1.1], 'color': "yellow"},
+                    {'range': [reference * 1.1, top], 'color': "green"}
+                ],
+                'threshold': {
+                    'line': {'color': "red", 'width': 4},
+                    'thickness': 0.75,
+                    'value': reference
+                }
+            }
+        )
+        if number:
+            indicator['number'] = number
+        fig = go.Figure(go.Indicator(**indicator))
+        fig.update_layout(height=300)
+        return fig
+
+    params = {"value": round(float(value), 4), "reference": round(float(reference), 4),
+              "title": title, "number": repr(number)}
+    return cached_figure("gauge", pd.DataFrame(), params, build)
@@ -0,0 +1,69 @@
+import numpy as np
+
+from query_cache import cached_query
+
+# Metrics we can histogram in SQL. Values outside the range are clamped into
+# the first/last bin, like the old pandas .clip(0, 100) on tip percentage;
+# the mean is taken over the values themselves.
+HISTOGRAM_METRICS = {
+    'tip_percentage': {
+        'expr': "tip_amount / NULLIF(fare_amount, 0) * 100",
+        'range': (0, 100),
+        'label': 'Tip Percentage (%)',
+        'title': 'Distribution of Tip Percentages',
+        'unit': '%'
+    },
+    'trip_distance': {
+        'expr': "trip_distance",
+        'range': (0, 30),
+        'label': 'Trip Distance (miles)',
+        'title': 'Distribution of Trip Distances',
+        'unit': ' mi'
+    },
+    'total_amount': {
+        'expr': "total_amount",
+        'range': (0, 200),
+        'label': 'Total Fare ($)',
+        'title': 'Distribution of Total Fares',
+        'unit': '$'
+    }
+}
+
+
+def histogram_query(metric, where_clause, bins=20):
+    """SQL returning one row per non-empty bin: bin (1..bins), trip_count, value_sum (unclamped)"""
+    spec = HISTOGRAM_METRICS[metric]
+    lo, hi = spec['range']
+    clamped = f"LEAST(GREATEST(({spec['expr']})::numeric, {lo}), {hi})"
+    return f"""
+    SELECT
+        LEAST(width_bucket({clamped}, {lo}, {hi}, {bins}), {bins}) as bin,
+        COUNT(*) as trip_count,
+        SUM(({spec['expr']})::numeric) as value_sum
+    FROM
+        taxi_trips
+    WHERE
+        {where_clause} AND
+        ({spec['expr']}) IS NOT NULL
+    GROUP BY
+        1
+    ORDER BY
+        1
+    """
+
+
+def get_histogram(metric, where_clause, bins=20):
+    """Bin edges and counts for a metric over the whole filtered population"""
+    spec = HISTOGRAM_METRICS[metric]
+    lo, hi = spec['range']
+    results = cached_query(histogram_query(metric, where_clause, bins))
+
+    edges = np.linspace(lo, hi, bins + 1)
+    counts = np.zeros(bins, dtype=np.int64)
+    if results.empty:
+        return {'edges': edges, 'counts': counts, 'mean': None, 'total': 0}
+
+    counts[results['bin'].astype(int).to_numpy() - 1] = results['trip_count'].astype(np.int64).to_numpy()
+    total = int(counts.sum())
+    mean = float(results['value_sum'].astype(float).sum()) / total if total else None
+    return {'edges': edges, 'counts': counts, 'mean': mean, 'total': total}
@@ -0,0 +1,250 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from taxi_db import execute_query, get_dataset_version
+from shared_store import publish, prune, read_frame
+from trip_schema import apply_trip_schema
+from taxi_zones import DAYS, hour_of_week
+from trip_profiles import TIME_RANGE_HOURS, similar_trip_profile, get_overall_averages
+from fare_model import estimate_trip
+from od_matrix import borough_pair_estimate
+
+# Average NYC taxi speed when the OD matrix has no speed for a borough pair
+DEFAULT_SPEED_MPH = 12
+
+# Results shared by every Streamlit session and API request of this process,
+# keyed by the dataset version so a refresh invalidates them
+_RESULT_CACHE_SIZE = 1024
+_result_cache = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+# Frames are also published to the host's shared store (see shared_store.py),
+# so the other app processes map them instead of re-running the query
+_SHARED_RESULTS = "results"
+_SHARED_RESULTS_SIZE = 1024
+
+
+def _copy(result):
+    # Callers are free to modify what they get back
+    return result.copy() if result is not None else None
+
+
+def cached_result(name, params, compute):
+    """Return compute() for (name, params, dataset version), computing it on a miss.
+
+    Empty frames aren't kept: execute_query also returns one when a query fails.
+    """
+    key = (name, repr(params), get_dataset_version())
+    with _result_cache_lock:
+        if key in _result_cache:
+            _result_cache.move_to_end(key)
+            return _copy(_result_cache[key])
+
+    shared_name = f"{_SHARED_RESULTS}/{hashlib.sha1(repr(key).encode()).hexdigest()}"
+    result = read_frame(shared_name, keep=False)
+    if result is None:
+        result = compute()
+        if result is None or getattr(result, 'empty', False):
+            return result
+        # Stored in the compact trip dtypes so more results fit
+        result = apply_trip_schema(result)
+        if isinstance(result, pd.DataFrame):
+            try:
+                publish(shared_name, key[2], frame=result)
+                prune(_SHARED_RESULTS, _SHARED_RESULTS_SIZE)
+            except OSError:
+                pass
+
+    with _result_cache_lock:
+        _result_cache[key] = result
+        while len(_result_cache) > _RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+    return _copy(result)
+
+
+def is_cached(name, params):
+    """Whether this process already holds cached_result's answer for (name, params)"""
+    key = (name, repr(params), get_dataset_version())
+    with _result_cache_lock:
+        return key in _result_cache
+
+
+def sql_text(value):
+    """A value as a quoted SQL string literal"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def time_range_condition(time_range):
+    start_hour, end_hour = TIME_RANGE_HOURS[time_range]
+    return f"EXTRACT(HOUR FROM pickup_time::time) BETWEEN {start_hour} AND {end_hour}"
+
+
+# 1. Best Time & Place Recommender
+def best_zones_query(day, time_range, borough="All", limit=10):
+    if day not in DAYS:
+        raise ValueError(f"Unknown day: {day}")
+    borough_condition = f"pickup_borough = {sql_text(borough)}" if borough != "All" else "1=1"
+    # This assumes you can extract day of week from pickup_date
+    day_condition = f"TO_CHAR(TO_DATE(pickup_date, 'YYYY-MM-DD'), 'Day') LIKE '{day}%'"
+    return f"""
+    SELECT
+        pickup_zone,
+        COUNT(*) as trip_count,
+        AVG(fare_amount) as avg_fare,
+        AVG(tip_amount) as avg_tip,
+        AVG(total_amount) as avg_total
+    FROM
+        taxi_trips
+    WHERE
+        {day_condition} AND
+        {time_range_condition(time_range)} AND
+        {borough_condition}
+    GROUP BY
+        pickup_zone
+    ORDER BY
+        AVG(total_amount) DESC
+    LIMIT {int(limit)}
+    """
+
+
+def best_zones(day, time_range, borough="All", limit=10):
+    """Most profitable pickup zones for a weekday and time range"""
+    return cached_result('best_zones', (day, time_range, borough, limit),
+                         lambda: execute_query(best_zones_query(day, time_range, borough, limit)))
+
+
+# 2. Trip Profitability Analyzer
+def similar_trips_query(pickup_borough, dropoff_borough, time_range, trip_distance):
+    # Distance range (e.g., +/- 1 mile)
+    distance_lower = max(0, trip_distance - 1)
+    distance_upper = trip_distance + 1
+    return f"""
+    SELECT
+        AVG(fare_amount) as avg_fare,
+        AVG(tip_amount) as avg_tip,
+        AVG(extra) as avg_extra,
+        AVG(tolls_amount) as avg_tolls,
+        AVG(congestion_surcharge) as avg_congestion,
+        AVG(total_amount) as avg_total,
+        COUNT(*) as trip_count
+    FROM
+        taxi_trips
+    WHERE
+        trip_distance BETWEEN {distance_lower} AND {distance_upper} AND
+        {time_range_condition(time_range)} AND
+        pickup_borough = {sql_text(pickup_borough)} AND
+        dropoff_borough = {sql_text(dropoff_borough)}
+    """
+
+
+def _trip_profitability(pickup_borough, dropoff_borough, time_range, trip_distance):
+    # Similar-trip averages come from the precomputed profile store;
+    # scan taxi_trips only if the store hasn't been built yet
+    profile = similar_trip_profile(pickup_borough, dropoff_borough, time_range, trip_distance)
+    if profile is None:
+        results = execute_query(similar_trips_query(pickup_borough, dropoff_borough, time_range, trip_distance))
+        profile = results.iloc[0].to_dict() if not results.empty else {'trip_count': 0}
+
+    # Fare model estimate (if a model has been trained) for the interval,
+    # and in place of history for profiles with no similar trips
+    start_hour, end_hour = TIME_RANGE_HOURS[time_range]
+    model_estimate = estimate_trip(pickup_borough, dropoff_borough, range(start_hour, end_hour + 1), trip_distance)
+    has_history = profile.get('trip_count', 0) > 0
+    if not has_history:
+        if model_estimate is None:
+            return None
+        profile = {**model_estimate, 'trip_count': 0}
+
+    trip = {k: float(v) for k, v in profile.items() if k.startswith('avg_')}
+    trip['trip_count'] = int(profile['trip_count'])
+    trip['source'] = 'history' if has_history else 'model'
+    if model_estimate is not None:
+        trip['model_total'] = float(model_estimate['avg_total'])
+        trip['model_total_low'] = model_estimate['total_low']
+        trip['model_total_high'] = model_estimate['total_high']
+
+    # Hourly rate from the borough pair's observed speed in the OD matrix store
+    pair_hours = [hour_of_week(d, h) for d in range(7) for h in range(start_hour, end_hour + 1)]
+    pair_estimate = borough_pair_estimate(pickup_borough, dropoff_borough, pair_hours)
+    avg_speed = pair_estimate['avg_mph'] if pair_estimate and pair_estimate['avg_mph'] else DEFAULT_SPEED_MPH
+    trip_hours = trip_distance / avg_speed
+    trip['avg_speed_mph'] = float(avg_speed)
+    trip['hourly_rate'] = trip['avg_total'] / trip_hours if trip_hours > 0 else 0.0
+
+    # Compared with the average trip, computed once per dataset version
+    averages = get_overall_averages(get_dataset_version())
+    if not averages.empty:
+        trip['overall_avg_total'] = float(averages['overall_avg_total'].iloc[0])
+        trip['per_mile_avg'] = float(averages['per_mile_avg'].iloc[0])
+        trip['per_mile'] = trip['avg_total'] / trip_distance if trip_distance > 0 else 0.0
+    return trip
+
+
+def trip_profitability(pickup_borough, dropoff_borough, time_range, trip_distance):
+    """Expected earnings for a trip profile as a dict, or None without data"""
+    return cached_result('trip_profitability', (pickup_borough, dropoff_borough, time_range, trip_distance),
+                         lambda: _trip_profitability(pickup_borough, dropoff_borough, time_range, trip_distance))
+
+
+# 3. Custom Trip Filter & Stats
+def filter_where_clause(start_date, end_date, distance_min, distance_max,
+                        pickup_boroughs=(), dropoff_boroughs=()):
+    conditions = []
+    conditions.append(f"pickup_date BETWEEN {sql_text(start_date)} AND {sql_text(end_date)}")
+    conditions.append(f"trip_distance BETWEEN {float(distance_min)} AND {float(distance_max)}")
+
+    if pickup_boroughs:
+        borough_list = ", ".join(sql_text(b) for b in pickup_boroughs)
+        conditions.append(f"pickup_borough IN ({borough_list})")
+
+    if dropoff_boroughs:
+        borough_list = ", ".join(sql_text(b) for b in dropoff_boroughs)
+        conditions.append(f"dropoff_borough IN ({borough_list})")
+
+    return " AND ".join(conditions)
+
+
+def filtered_summary_query(where_clause):
+    return f"""
+    SELECT
+        COUNT(*) as trip_count,
+        AVG(trip_distance) as avg_distance,
+        AVG(fare_amount) as avg_fare,
+        AVG(tip_amount) as avg_tip,
+        AVG(total_amount) as avg_total,
+        SUM(total_amount) as total_revenue
+    FROM
+        taxi_trips
+    WHERE
+        {where_clause}
+    """
+
+
+def trips_by_hour_query(where_clause):
+    return f"""
+    SELECT
+        EXTRACT(HOUR FROM pickup_time::time) as hour,
+        COUNT(*) as trip_count,
+        AVG(total_amount) as avg_total
+    FROM
+        taxi_trips
+    WHERE
+        {where_clause}
+    GROUP BY
+        EXTRACT(HOUR FROM pickup_time::time)
+    ORDER BY
+        hour
+    """
+
+
+def filtered_summary(where_clause):
+    return cached_result('filtered_summary', where_clause,
+                         lambda: execute_query(filtered_summary_query(where_clause)))
+
+
+def trips_by_hour(where_clause):
+    return cached_result('trips_by_hour', where_clause,
+                         lambda: execute_query(trips_by_hour_query(where_clause)))
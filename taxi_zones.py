@@ -0,0 +1,204 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from taxi_db import DATA_DIR, execute_query
+from shared_store import publish, read_frame
+
+ZONES_PATH = os.path.join(DATA_DIR, "zones.csv")
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+HOURS_PER_WEEK = 168
+
+# SQL expressions for the weekday (0 = Monday) and hour of a trip's pickup
+PICKUP_DOW_SQL = "(EXTRACT(ISODOW FROM pickup_date::date) - 1)::int"
+PICKUP_HOUR_SQL = "EXTRACT(HOUR FROM pickup_time::time)::int"
+PICKUP_HOUR_OF_WEEK_SQL = f"({PICKUP_DOW_SQL} * 24 + {PICKUP_HOUR_SQL})"
+
+# Trip duration from the split pickup/dropoff date and time columns
+DURATION_MINUTES_SQL = """
+EXTRACT(EPOCH FROM (
+    (dropoff_date::date + dropoff_time::time) - (pickup_date::date + pickup_time::time)
+)) / 60.0
+"""
+# Durations outside 1 minute to MAX_TRIP_MINUTES are recording errors
+MAX_TRIP_MINUTES = 180
+
+
+def hour_of_week(dow, hour):
+    return dow * 24 + hour
+
+
+def hour_of_week_label(how):
+    return f"{DAYS[how // 24][:3]} {how % 24}:00"
+
+
+def load_zone_dictionary():
+    """Zone -> borough table with a stable index per zone.
+
+    Precomputed matrices index zones by row position here, so the order is
+    persisted in data/zones.csv and new zones are only ever appended. The
+    copy published to the shared store is used while it matches the file.
+    """
+    if not os.path.exists(ZONES_PATH):
+        return pd.DataFrame(columns=['zone', 'borough'])
+    zones = read_frame("zone_dictionary", version=os.path.getmtime(ZONES_PATH))
+    if zones is not None:
+        return zones
+    return pd.read_csv(ZONES_PATH, keep_default_na=False)
+
+
+def publish_zone_dictionary():
+    """Share the zone dictionary with the other app processes on this host"""
+    if os.path.exists(ZONES_PATH):
+        zones = pd.read_csv(ZONES_PATH, keep_default_na=False)
+        publish("zone_dictionary", os.path.getmtime(ZONES_PATH), frame=zones)
+
+
+def days_condition(days):
+    """SQL condition matching trips picked up on any of the given dates"""
+    day_list = "', '".join(days)
+    return f"pickup_date IN ('{day_list}')"
+
+
+def update_zone_dictionary(days=None):
+    """Append any zones seen in taxi_trips that the dictionary doesn't know yet,
+    looking only at trips picked up on the given dates when days is given"""
+    zones = load_zone_dictionary()
+    where_clause = days_condition(days) if days is not None else "1=1"
+    seen = execute_query(f"""
+    SELECT zone, MIN(borough) as borough
+    FROM (
+        SELECT pickup_zone as zone, pickup_borough as borough FROM taxi_trips WHERE {where_clause}
+        UNION
+        SELECT dropoff_zone, dropoff_borough FROM taxi_trips WHERE {where_clause}
+    ) z
+    WHERE zone != ''
+    GROUP BY zone
+    ORDER BY zone
+    """)
+    if seen.empty:
+        return zones
+
+    new = seen[~seen['zone'].isin(zones['zone'])]
+    if not new.empty:
+        zones = pd.concat([zones, new[['zone', 'borough']]], ignore_index=True)
+        os.makedirs(DATA_DIR, exist_ok=True)
+        zones.to_csv(ZONES_PATH, index=False)
+        publish_zone_dictionary()
+    return zones
+
+
+def cursor_frame(cur, query):
+    """query's rows as a DataFrame, read through cur so they include what the
+    caller's transaction has written"""
+    cur.execute(query)
+    return pd.DataFrame(cur.fetchall(), columns=[c[0] for c in cur.description])
+
+
+def refresh_rollup_days(cur, rollup, columns, key, sums, aggregate_sql, days=None):
+    """Bring the rollup table up to date for the given pickup dates (every date
+    when days is None) inside the caller's transaction.
+
+    {rollup}_daily keeps the same cells per pickup_date, so a changed day's old
+    sums are backed out of the rollup and its recomputed ones added back, as
+    trip_profiles does. {rollup}_days counts each date's trips, for per-day
+    rates. aggregate_sql selects pickup_date, the key columns and the sums for
+    trips matching {where_clause}.
+    """
+    cur.execute(f"SELECT to_regclass('{rollup}_daily') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        days = None
+    elif days is not None and not days:
+        return
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {rollup} (
+        {columns},
+        PRIMARY KEY ({key})
+    );
+    CREATE TABLE IF NOT EXISTS {rollup}_daily (
+        pickup_date TEXT NOT NULL,
+        {columns},
+        PRIMARY KEY (pickup_date, {key})
+    );
+    CREATE TABLE IF NOT EXISTS {rollup}_days (
+        pickup_date TEXT PRIMARY KEY,
+        trip_count BIGINT NOT NULL
+    )
+    """)
+    summed = ", ".join(f"SUM({s}) as {s}" for s in sums)
+
+    if days is None:
+        cur.execute(f"TRUNCATE {rollup}, {rollup}_daily, {rollup}_days")
+        where_clause = "1=1"
+    else:
+        where_clause = days_condition(days)
+        # Back the days' old contribution out of the rollup...
+        cur.execute(f"""
+        UPDATE {rollup} r SET {", ".join(f"{s} = r.{s} - d.{s}" for s in sums)}
+        FROM (
+            SELECT {key}, {summed}
+            FROM {rollup}_daily
+            WHERE {where_clause}
+            GROUP BY {key}
+        ) d
+        WHERE {" AND ".join(f"r.{k} = d.{k}" for k in key.split(", "))}
+        """)
+        cur.execute(f"DELETE FROM {rollup}_daily WHERE {where_clause}")
+        cur.execute(f"DELETE FROM {rollup}_days WHERE {where_clause}")
+
+    # ...recompute them from taxi_trips, and add the new contribution back
+    cur.execute(f"INSERT INTO {rollup}_daily " + aggregate_sql.format(where_clause=where_clause))
+    cur.execute(f"""
+    INSERT INTO {rollup}
+    SELECT {key}, {summed}
+    FROM {rollup}_daily
+    WHERE {where_clause}
+    GROUP BY {key}
+    ON CONFLICT ({key}) DO UPDATE SET
+        {", ".join(f"{s} = {rollup}.{s} + EXCLUDED.{s}" for s in sums)}
+    """)
+    cur.execute(f"DELETE FROM {rollup} WHERE trip_count <= 0")
+    cur.execute(f"""
+    INSERT INTO {rollup}_days
+    SELECT pickup_date, COUNT(*)
+    FROM taxi_trips
+    WHERE pickup_date IS NOT NULL AND {where_clause}
+    GROUP BY 1
+    """)
+
+
+def zone_index(zones):
+    return {z: i for i, z in enumerate(zones['zone'])}
+
+
+def hourly_zone_matrix(first_day, last_day):
+    """(zones, first hour, zones x hours trip counts) for pickups between two dates"""
+    counts = execute_query(f"""
+    SELECT
+        pickup_zone,
+        pickup_date,
+        {PICKUP_HOUR_SQL} as hour,
+        COUNT(*) as trip_count
+    FROM
+        taxi_trips
+    WHERE
+        pickup_zone != '' AND
+        pickup_date BETWEEN '{first_day}' AND '{last_day}'
+    GROUP BY
+        1, 2, 3
+    """)
+    start = np.datetime64(first_day, 'h')
+    n_hours = (np.datetime64(last_day, 'D') - np.datetime64(first_day, 'D') + 1).astype(int) * 24
+    if counts.empty:
+        return [], start, np.zeros((0, n_hours))
+
+    zones = sorted(counts['pickup_zone'].unique())
+    z = counts['pickup_zone'].map({name: i for i, name in enumerate(zones)}).to_numpy()
+    t = ((pd.to_datetime(counts['pickup_date']).to_numpy().astype('datetime64[h]') - start).astype(int)
+         + counts['hour'].astype(int).to_numpy())
+    # Hours without a row had no pickups, so the dense matrix starts at zero
+    matrix = np.zeros((len(zones), n_hours))
+    matrix[z, t] = counts['trip_count'].astype(float).to_numpy()
+    return zones, start, matrix
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+import analytics_pool
+from analytics_pool import fare_regression, lag_correlation, submit
+
+
+def _arrays(n=200, seed=1):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(0, 10, n)
+    return {'x': x, 'y': 2.5 * x + rng.normal(0, 1, n)}
+
+
+def test_fare_regression_stops_when_cancelled():
+    calls = []
+
+    def cancelled():
+        calls.append(None)
+        return len(calls) > 2
+
+    result = fare_regression(_arrays(), cancelled, n_boot=1000)
+    assert result['resamples'] == 2 * analytics_pool.CHECK_EVERY
+    assert not result['complete']
+    assert result['slope'] == pytest.approx(2.5, abs=0.1)
+    assert result['slope_low'] < 2.5 < result['slope_high']
+
+
+def test_lag_correlation_returns_lags_done_before_cancelling():
+    calls = []
+
+    def cancelled():
+        calls.append(None)
+        return len(calls) > 3
+
+    result = lag_correlation(_arrays(), cancelled, max_lag=7)
+    assert result['lag'] == [-7, -6, -5]
+    assert not result['complete']
+
+
+@pytest.fixture
+def pool():
+    # Start the workers first, so the timeout only covers the task itself
+    assert submit(('test', 'start'), 'lag_correlation', _arrays()).result(timeout=60)['complete']
+
+
+def test_timed_out_job_returns_partial_result(pool):
+    job = submit(('test', 'timeout'), 'fare_regression', _arrays(n=2000), n_boot=10 ** 7)
+    result = job.result(timeout=1.0)
+    assert result is not None
+    assert not result['complete']
+    assert 0 < result['resamples'] < 10 ** 7
+
+
+def test_resubmitting_a_key_cancels_the_previous_job(pool):
+    key = ('test', 'rerun')
+    first = submit(key, 'fare_regression', _arrays(n=2000), n_boot=10 ** 7)
+    second = submit(key, 'fare_regression', _arrays(), n_boot=100)
+    assert second.result(timeout=30)['complete']
+    # The superseded job was either dropped before it started or stopped early
+    partial = first.result(timeout=30, fallback='dropped')
+    assert partial == 'dropped' or not partial['complete']
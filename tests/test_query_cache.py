@@ -0,0 +1,51 @@
+import sqlite3
+
+import pytest
+
+import query_cache
+from query_cache import CACHE_SQL, evict
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.executescript(CACHE_SQL)
+    yield conn
+    conn.close()
+
+
+def _add_results(conn, used_at_sizes):
+    for i, (used_at, size) in enumerate(used_at_sizes):
+        conn.execute("INSERT INTO results VALUES (?, 'v1', x'00', ?, 0, ?)", (f"q{i}", size, used_at))
+
+
+def _kept(conn):
+    return [f for f, in conn.execute("SELECT fingerprint FROM results ORDER BY fingerprint")]
+
+
+def test_evict_keeps_everything_under_the_limit(conn):
+    _add_results(conn, [(1, 100), (2, 100), (3, 100)])
+    assert evict(conn, max_bytes=300) == 300
+    assert _kept(conn) == ['q0', 'q1', 'q2']
+
+
+def test_evict_drops_least_recently_used_down_to_90_percent(conn):
+    # q3 was used first and q0 most recently
+    _add_results(conn, [(5, 100), (4, 100), (3, 100), (1, 100), (2, 100)])
+    assert evict(conn, max_bytes=400) == 500
+    # 500 bytes down to at most 360: the two oldest go
+    assert _kept(conn) == ['q0', 'q1', 'q2']
+
+
+def test_evict_drops_a_large_old_result_alone(conn):
+    _add_results(conn, [(1, 1000), (2, 10), (3, 10)])
+    evict(conn, max_bytes=900)
+    assert _kept(conn) == ['q1', 'q2']
+
+
+def test_evict_trims_tracked_queries_to_the_most_requested(conn, monkeypatch):
+    monkeypatch.setattr(query_cache, 'MAX_TRACKED_QUERIES', 2)
+    for fingerprint, requests in [('a', 5), ('b', 1), ('c', 9)]:
+        conn.execute("INSERT INTO queries VALUES (?, 'app', 'SELECT 1', ?, 0)", (fingerprint, requests))
+    evict(conn)
+    assert [f for f, in conn.execute("SELECT fingerprint FROM queries ORDER BY fingerprint")] == ['a', 'c']
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import shift_planner
+from shift_planner import N_SLOTS, plan_shift
+
+
+@pytest.fixture
+def transitions(tmp_path, monkeypatch):
+    # Three zones: only A has demand, and its fares drop off back in A
+    n = 3
+    trips_per_hour = np.zeros((N_SLOTS, n), dtype=np.float32)
+    trips_per_hour[:, 0] = 100.0
+    dropoff_prob = np.zeros((N_SLOTS, n, n), dtype=np.float32)
+    dropoff_prob[:, 0, 0] = 1.0
+    fares = np.zeros((N_SLOTS, n, n), dtype=np.float32)
+    fares[:, 0, 0] = 20.0
+    minutes = np.full((N_SLOTS, n, n), 15.0, dtype=np.float32)
+    drive_minutes = np.full((n, n), 10.0, dtype=np.float32)
+    np.fill_diagonal(drive_minutes, 0.0)
+    path = tmp_path / "shift_transitions.npz"
+    np.savez(path, trips_per_hour=trips_per_hour, dropoff_prob=dropoff_prob, fares=fares,
+             minutes=minutes, drive_minutes=drive_minutes)
+
+    load = shift_planner.load_transitions
+    monkeypatch.setattr(shift_planner, 'load_transitions', lambda: load(str(path)))
+    # D was added to the dictionary after the matrix was built
+    zones = pd.DataFrame({'zone': ['A', 'B', 'C', 'D'], 'borough': ['Manhattan'] * 4})
+    monkeypatch.setattr(shift_planner, 'load_zone_dictionary', lambda: zones)
+
+
+def test_plan_repositions_to_demand(transitions):
+    steps, expected = plan_shift('B', dow=0, start_hour=9, shift_hours=2)
+    assert steps[0]['action'] == "Reposition to A"
+    assert expected > 0
+
+
+def test_plan_waits_where_demand_is(transitions):
+    steps, expected = plan_shift('A', dow=0, start_hour=9, shift_hours=2)
+    assert steps[0]['action'].startswith("Wait for a fare")
+    assert steps[0]['expected_fare'] == pytest.approx(20.0)
+    # One 15 minute ride per step at most: 8 steps of 2 hours
+    assert 0 < expected <= 8 * 20.0
+
+
+def test_plan_unknown_zones(transitions):
+    assert plan_shift('D', dow=0, start_hour=9, shift_hours=2) is None
+    assert plan_shift('Nowhere', dow=0, start_hour=9, shift_hours=2) is None
@@ -0,0 +1,87 @@
+import threading
+
+import pandas as pd
+
+from taxi_db import coalesced_queries, query_fingerprint, single_flight
+
+
+def _concurrent(key, compute, callers=8):
+    """Run single_flight from several threads that all arrive while the first call runs"""
+    results = [None] * callers
+    errors = [None] * callers
+
+    def call(i):
+        try:
+            results[i] = single_flight(key, compute)
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_identical_concurrent_calls_run_once():
+    started, release = threading.Event(), threading.Event()
+    runs = []
+
+    def compute():
+        runs.append(None)
+        started.set()
+        release.wait(5)
+        return pd.DataFrame({'trips': [1, 2, 3]})
+
+    before = coalesced_queries()
+    leader = threading.Thread(target=lambda: single_flight('same', compute))
+    leader.start()
+    started.wait(5)
+    threads, results, errors = _concurrent('same', compute)
+    # Let every follower join the flight before it lands
+    while coalesced_queries() - before < len(threads):
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads + [leader]:
+        thread.join(5)
+
+    assert len(runs) == 1
+    assert errors == [None] * len(threads)
+    assert all(result['trips'].tolist() == [1, 2, 3] for result in results)
+    # Each caller gets its own copy
+    results[0].loc[0, 'trips'] = 99
+    assert results[1]['trips'].tolist() == [1, 2, 3]
+
+
+def test_followers_get_the_leaders_exception():
+    started, release = threading.Event(), threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("connection lost")
+
+    (leader,), _, leader_errors = _concurrent('failing', compute, callers=1)
+    started.wait(5)
+    before = coalesced_queries()
+    threads, _, errors = _concurrent('failing', compute, callers=3)
+    while coalesced_queries() - before < len(threads):
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads + [leader]:
+        thread.join(5)
+
+    assert all(isinstance(e, RuntimeError) for e in leader_errors + errors)
+    # A later call runs again instead of reusing the failure
+    assert single_flight('failing', lambda: 'recovered') == 'recovered'
+
+
+def test_sequential_calls_are_not_coalesced():
+    runs = []
+    for _ in range(3):
+        single_flight('sequential', lambda: runs.append(None))
+    assert len(runs) == 3
+
+
+def test_fingerprint_ignores_layout_but_not_literals():
+    assert query_fingerprint("SELECT *\n    FROM taxi_trips;") == query_fingerprint("SELECT * FROM taxi_trips")
+    assert query_fingerprint("SELECT 'a  b'") != query_fingerprint("SELECT 'a b'")
@@ -0,0 +1,38 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from taxi_figures import downsample_series, lttb_indices
+
+
+def test_lttb_keeps_endpoints_and_count():
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 50)
+    idx = lttb_indices(x, y, 100)
+    assert len(idx) == 100
+    assert idx[0] == 0 and idx[-1] == 999
+    assert np.all(np.diff(idx) > 0)
+
+
+def test_lttb_keeps_spikes():
+    x = np.arange(1000, dtype=float)
+    y = np.zeros(1000)
+    y[437] = 50.0
+    y[812] = -50.0
+    idx = lttb_indices(x, y, 50)
+    assert 437 in idx and 812 in idx
+
+
+def test_lttb_short_series_unchanged():
+    assert list(lttb_indices([0, 1, 2], [5, 6, 7], 10)) == [0, 1, 2]
+
+
+def test_downsample_series_on_date_objects():
+    # DATE columns come back from Arrow as objects holding datetime.date
+    days = [date(2023, 1, 1) + timedelta(days=i) for i in range(1000)]
+    frame = pd.DataFrame({'date': pd.Series(days, dtype=object), 'trips': np.ones(1000)})
+    frame.loc[613, 'trips'] = 100.0
+    sampled = downsample_series(frame, 'date', 'trips', max_points=50)
+    assert len(sampled) == 50
+    assert days[613] in set(sampled['date'])
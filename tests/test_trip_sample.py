@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import trip_sample
+from trip_sample import _estimates, _frame_stats, route_estimate
+
+
+def _rows(weights, totals):
+    n = len(weights)
+    return pd.DataFrame({
+        'weight': np.asarray(weights, dtype=float),
+        'trip_distance': np.full(n, 2.0),
+        'fare_amount': np.full(n, 10.0),
+        'tip_amount': np.full(n, 2.0),
+        'total_amount': np.asarray(totals, dtype=float),
+    })
+
+
+def test_estimates_of_an_unweighted_sample_are_exact():
+    estimate = _estimates(_frame_stats(_rows([1, 1, 1, 1], [10, 20, 30, 40]))).iloc[0]
+    assert estimate['sample_rows'] == 4
+    assert estimate['trip_count'] == 4
+    assert estimate['trip_count_error'] == 0
+    assert estimate['avg_total'] == pytest.approx(25.0)
+    assert estimate['avg_total_error'] == 0
+    assert estimate['total_revenue'] == pytest.approx(100.0)
+
+
+def test_estimates_weight_rows_and_skip_unknown_values():
+    estimate = _estimates(_frame_stats(_rows([1, 3, 10], [10, np.nan, 40]))).iloc[0]
+    assert estimate['trip_count'] == 14
+    # Horvitz-Thompson variance of the count: sum(w (w - 1))
+    assert estimate['trip_count_error'] == pytest.approx(trip_sample.Z_95 * np.sqrt(3 * 2 + 10 * 9))
+    # The row without a total is left out of the average, not counted as zero
+    assert estimate['avg_total'] == pytest.approx((10 + 10 * 40) / 11)
+    assert estimate['avg_total_error'] > 0
+    assert estimate['total_revenue'] == pytest.approx(410.0)
+
+
+def _estimate(sample_rows, error):
+    return pd.DataFrame({
+        'sample_rows': [sample_rows],
+        'trip_count': [1000.0],
+        'trip_count_error': [1000.0 * error],
+        'avg_total': [20.0],
+        'avg_total_error': [0.0],
+    })
+
+
+@pytest.fixture
+def levels(monkeypatch):
+    monkeypatch.setattr(trip_sample, 'get_dataset_version', lambda: 1)
+    monkeypatch.setattr(trip_sample, 'available_levels',
+                        lambda version: [('small', 0.001), ('medium', 0.01), ('large', 0.1)])
+    queried = []
+
+    def use(errors):
+        def sample_estimate(table, filters):
+            queried.append(table)
+            sample_rows, error = errors[table]
+            return _estimate(sample_rows, error)
+        monkeypatch.setattr(trip_sample, 'sample_estimate', sample_estimate)
+        return queried
+    return use
+
+
+def test_route_estimate_uses_the_smallest_level_within_the_bound(levels):
+    queried = levels({'small': (500, 0.01), 'medium': (5000, 0.01), 'large': (50000, 0.01)})
+    table, estimate = route_estimate(None, max_error=0.05)
+    assert table == 'small'
+    assert queried == ['small']
+
+
+def test_route_estimate_skips_levels_expected_to_miss(levels):
+    # 0.5 at 0.1% is expected to shrink to about 0.16 at 1% and 0.05 at 10%
+    queried = levels({'small': (500, 0.5), 'medium': (5000, 0.15), 'large': (50000, 0.04)})
+    table, estimate = route_estimate(None, max_error=0.05)
+    assert table == 'large'
+    assert estimate['sample_rows'].iloc[0] == 50000
+    assert queried == ['small', 'large']
+
+
+def test_route_estimate_gives_up_when_no_level_is_within_the_bound(levels):
+    queried = levels({'small': (500, 0.5), 'medium': (5000, 0.2), 'large': (50000, 0.1)})
+    assert route_estimate(None, max_error=0.05) == (None, None)
+    assert queried == ['small', 'large']
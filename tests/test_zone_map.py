@@ -0,0 +1,45 @@
+import numpy as np
+
+from zone_map import _douglas_peucker, simplify_topology
+
+
+def test_douglas_peucker_drops_points_within_tolerance():
+    points = np.array([[0.0, 0.0], [1.0, 0.0005], [2.0, -0.0005], [3.0, 0.0]])
+    assert _douglas_peucker(points, 0.001).tolist() == [0, 3]
+
+
+def test_douglas_peucker_keeps_points_beyond_tolerance():
+    points = np.array([[0.0, 0.0], [1.0, 1.0], [2.0, 1.0], [3.0, 1.0005], [4.0, 1.0]])
+    assert _douglas_peucker(points, 0.001).tolist() == [0, 1, 4]
+
+
+def _square(ring):
+    return {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'Polygon', 'coordinates': [ring]}}
+
+
+# Two squares sharing a slightly wiggly border along x = 1
+BORDER = [[1.0, 0.0], [1.0001, 0.25], [1.0, 0.5], [0.9999, 0.75], [1.0, 1.0]]
+WEST = _square([[0.0, 0.0]] + BORDER + [[0.0, 1.0], [0.0, 0.0]])
+EAST = _square(BORDER[::-1] + [[2.0, 1.0], [2.0, 0.0], [1.0, 0.0]])
+
+
+def _ring(feature):
+    return feature['geometry']['coordinates'][0][0]
+
+
+def _on_border(ring):
+    return sorted(tuple(p) for p in ring[:-1] if 0.99 < p[0] < 1.01)
+
+
+def test_simplify_topology_simplifies_shared_border_once():
+    west, east = simplify_topology([WEST, EAST], 0.001)
+    assert _on_border(_ring(west)) == _on_border(_ring(east)) == [(1.0, 0.0), (1.0, 1.0)]
+    assert _ring(west)[0] == _ring(west)[-1]
+    assert len(_ring(west)) == 5
+
+
+def test_simplify_topology_keeps_shared_detail_identical():
+    west, east = simplify_topology([WEST, EAST], 0.00001)
+    # (1, 0.5) lies on the line between its neighbours, so only the wiggles remain
+    kept = sorted(map(tuple, BORDER[:2] + BORDER[3:]))
+    assert _on_border(_ring(west)) == _on_border(_ring(east)) == kept
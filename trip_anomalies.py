@@ -0,0 +1,116 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from taxi_db import get_connection, execute_query
+from taxi_zones import hourly_zone_matrix
+
+# Each zone-hour is compared with the same hour of the week over the previous
+# BASELINE_WEEKS weeks; at least MIN_BASELINE_WEEKS of them must exist
+BASELINE_WEEKS = 8
+MIN_BASELINE_WEEKS = 4
+
+# Robust z-score (median / MAD) beyond which an hour is flagged
+Z_THRESHOLD = 3.5
+# Ignore hours where both the observed and expected counts are tiny
+MIN_TRIPS = 10
+
+CREATE_ANOMALIES_SQL = """
+CREATE TABLE IF NOT EXISTS trip_anomalies (
+    zone TEXT NOT NULL,
+    hour_start TIMESTAMP NOT NULL,
+    trips INTEGER NOT NULL,
+    expected DOUBLE PRECISION NOT NULL,
+    z_score DOUBLE PRECISION NOT NULL,
+    kind TEXT NOT NULL,
+    PRIMARY KEY (zone, hour_start)
+);
+CREATE INDEX IF NOT EXISTS trip_anomalies_hour_idx ON trip_anomalies (hour_start)
+"""
+
+
+def detect_anomalies(first_day, last_day):
+    """Surges and dips in per-zone hourly pickups between two dates.
+
+    Only the days being scored plus BASELINE_WEEKS of history are read, so
+    scoring newly loaded days never re-fits the whole history.
+    """
+    history_start = (date.fromisoformat(first_day) - timedelta(weeks=BASELINE_WEEKS)).isoformat()
+    zones, start, matrix = hourly_zone_matrix(history_start, last_day)
+    offset = BASELINE_WEEKS * 7 * 24
+    if len(zones) == 0 or matrix.shape[1] <= offset:
+        return pd.DataFrame(columns=['zone', 'hour_start', 'trips', 'expected', 'z_score', 'kind'])
+
+    # baseline[k, z, t]: the same hour k + 1 weeks before each scored hour
+    observed = matrix[:, offset:]
+    n_scored = observed.shape[1]
+    baseline = np.stack([matrix[:, offset - 168 * k:offset - 168 * k + n_scored]
+                         for k in range(1, BASELINE_WEEKS + 1)])
+
+    # Weeks before a zone's first pickup don't count as zero-trip history
+    first_seen = np.argmax(matrix > 0, axis=1)
+    hours = np.arange(n_scored)[None, None, :] + offset - 168 * np.arange(1, BASELINE_WEEKS + 1)[:, None, None]
+    baseline = np.where(hours >= first_seen[None, :, None], baseline, np.nan)
+
+    expected = np.nanmedian(baseline, axis=0)
+    mad = np.nanmedian(np.abs(baseline - expected[None]), axis=0)
+    valid = np.sum(~np.isnan(baseline), axis=0) >= MIN_BASELINE_WEEKS
+    # Poisson floor on the spread so quiet zones don't flag every extra trip
+    scale = np.maximum(1.4826 * mad, np.sqrt(np.maximum(expected, 1.0)))
+    z_score = (observed - expected) / scale
+
+    flagged = valid & (np.abs(z_score) >= Z_THRESHOLD) & (np.maximum(observed, expected) >= MIN_TRIPS)
+    z_idx, t_idx = np.nonzero(flagged)
+    return pd.DataFrame({
+        'zone': np.array(zones)[z_idx],
+        'hour_start': (start + offset + t_idx).astype('datetime64[ns]'),
+        'trips': observed[z_idx, t_idx].astype(int),
+        'expected': expected[z_idx, t_idx],
+        'z_score': z_score[z_idx, t_idx],
+        'kind': np.where(z_score[z_idx, t_idx] > 0, 'surge', 'dip'),
+    })
+
+
+def store_anomalies(cur, anomalies, first_day, last_day):
+    """Replace the stored anomalies between two dates"""
+    cur.execute(CREATE_ANOMALIES_SQL)
+    cur.execute(f"""
+    DELETE FROM trip_anomalies
+    WHERE hour_start >= '{first_day}' AND hour_start < DATE '{last_day}' + 1
+    """)
+    if anomalies.empty:
+        return
+    rows = [
+        (r.zone, pd.Timestamp(r.hour_start).to_pydatetime(), int(r.trips),
+         float(r.expected), float(r.z_score), r.kind)
+        for r in anomalies.itertuples()
+    ]
+    execute_values(cur, "INSERT INTO trip_anomalies VALUES %s", rows)
+
+
+def refresh_anomalies(cur, days):
+    """Re-score every hour from the earliest to the latest of the given days"""
+    if not days:
+        return 0
+    first_day, last_day = min(days), max(days)
+    anomalies = detect_anomalies(first_day, last_day)
+    store_anomalies(cur, anomalies, first_day, last_day)
+    return len(anomalies)
+
+
+if __name__ == "__main__":
+    span = execute_query("SELECT MIN(pickup_date) as first_day, MAX(pickup_date) as last_day FROM taxi_trips")
+    conn = get_connection()
+    if conn is None or span.empty or pd.isna(span.iloc[0]['first_day']):
+        print("No trips to score")
+    else:
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                n = refresh_anomalies(cur, [str(span.iloc[0]['first_day']), str(span.iloc[0]['last_day'])])
+            conn.commit()
+            print(f"Stored {n:,} anomalous zone-hours")
+        finally:
+            conn.close()
@@ -0,0 +1,258 @@
+import numpy as np
+import streamlit as st
+
+from taxi_db import get_connection, execute_query, get_dataset_version
+from shared_store import attach, publish
+
+# Hour ranges behind the time-of-day selectboxes (inclusive)
+TIME_RANGE_HOURS = {
+    "6am-9am": (6, 8),
+    "9am-12pm": (9, 11),
+    "12pm-3pm": (12, 14),
+    "3pm-6pm": (15, 17),
+    "6pm-9pm": (18, 20),
+    "9pm-12am": (21, 23),
+    "12am-6am": (0, 5),
+}
+
+# Half-mile distance buckets up to the 30 mile slider maximum
+DISTANCE_BUCKET_MILES = 0.5
+MAX_DISTANCE_BUCKET = 61
+
+# Component sums stored per profile cell, in this order
+PROFILE_COMPONENTS = ['fare', 'tip', 'extra', 'tolls', 'congestion', 'total']
+
+_PROFILE_COLUMNS = """
+    pickup_borough TEXT NOT NULL,
+    dropoff_borough TEXT NOT NULL,
+    pickup_hour SMALLINT NOT NULL,
+    distance_bucket SMALLINT NOT NULL,
+    trip_count BIGINT NOT NULL,
+    fare_sum DOUBLE PRECISION NOT NULL,
+    tip_sum DOUBLE PRECISION NOT NULL,
+    extra_sum DOUBLE PRECISION NOT NULL,
+    tolls_sum DOUBLE PRECISION NOT NULL,
+    congestion_sum DOUBLE PRECISION NOT NULL,
+    total_sum DOUBLE PRECISION NOT NULL,
+"""
+
+PROFILE_KEY = "pickup_borough, dropoff_borough, pickup_hour, distance_bucket"
+PROFILE_SUMS = ['trip_count'] + [f"{c}_sum" for c in PROFILE_COMPONENTS]
+
+# trip_profiles is what the app reads. trip_profiles_daily holds the same
+# cells per pickup_date so a changed day can be backed out and recomputed
+# without touching the rest.
+CREATE_PROFILES_SQL = f"""
+CREATE TABLE IF NOT EXISTS trip_profiles (
+    {_PROFILE_COLUMNS}
+    PRIMARY KEY ({PROFILE_KEY})
+);
+CREATE TABLE IF NOT EXISTS trip_profiles_daily (
+    pickup_date TEXT NOT NULL,
+    {_PROFILE_COLUMNS}
+    PRIMARY KEY (pickup_date, {PROFILE_KEY})
+)
+"""
+
+# Aggregate trips into daily profile cells; {where_clause} limits the days
+PROFILE_AGGREGATE_SQL = """
+SELECT
+    pickup_date,
+    pickup_borough,
+    dropoff_borough,
+    EXTRACT(HOUR FROM pickup_time::time)::smallint as pickup_hour,
+    LEAST(FLOOR(trip_distance / {bucket}), {max_bucket})::smallint as distance_bucket,
+    COUNT(*) as trip_count,
+    COALESCE(SUM(fare_amount), 0) as fare_sum,
+    COALESCE(SUM(tip_amount), 0) as tip_sum,
+    COALESCE(SUM(extra), 0) as extra_sum,
+    COALESCE(SUM(tolls_amount), 0) as tolls_sum,
+    COALESCE(SUM(congestion_surcharge), 0) as congestion_sum,
+    COALESCE(SUM(total_amount), 0) as total_sum
+FROM
+    taxi_trips
+WHERE
+    trip_distance >= 0 AND
+    pickup_borough != '' AND
+    dropoff_borough != '' AND
+    {where_clause}
+GROUP BY
+    1, 2, 3, 4, 5
+"""
+
+
+def _days_condition(days):
+    day_list = "', '".join(days)
+    return f"pickup_date IN ('{day_list}')"
+
+
+def refresh_profile_days(cur, days):
+    """Recompute the profile cells of the given pickup dates inside the caller's transaction"""
+    if not days:
+        return
+    days_condition = _days_condition(days)
+    sums = ", ".join(f"SUM({s}) as {s}" for s in PROFILE_SUMS)
+    cur.execute(CREATE_PROFILES_SQL)
+
+    # Back the days' old contribution out of the rollup...
+    cur.execute(f"""
+    UPDATE trip_profiles p SET {", ".join(f"{s} = p.{s} - d.{s}" for s in PROFILE_SUMS)}
+    FROM (
+        SELECT {PROFILE_KEY}, {sums}
+        FROM trip_profiles_daily
+        WHERE {days_condition}
+        GROUP BY {PROFILE_KEY}
+    ) d
+    WHERE {" AND ".join(f"p.{k} = d.{k}" for k in PROFILE_KEY.split(", "))}
+    """)
+    cur.execute(f"DELETE FROM trip_profiles_daily WHERE {days_condition}")
+
+    # ...recompute them from taxi_trips, and add the new contribution back
+    cur.execute("INSERT INTO trip_profiles_daily " + PROFILE_AGGREGATE_SQL.format(
+        bucket=DISTANCE_BUCKET_MILES,
+        max_bucket=MAX_DISTANCE_BUCKET,
+        where_clause=days_condition
+    ))
+    cur.execute(f"""
+    INSERT INTO trip_profiles
+    SELECT {PROFILE_KEY}, {sums}
+    FROM trip_profiles_daily
+    WHERE {days_condition}
+    GROUP BY {PROFILE_KEY}
+    ON CONFLICT ({PROFILE_KEY}) DO UPDATE SET
+        {", ".join(f"{s} = trip_profiles.{s} + EXCLUDED.{s}" for s in PROFILE_SUMS)}
+    """)
+    cur.execute("DELETE FROM trip_profiles WHERE trip_count <= 0")
+
+
+def rebuild_all_profiles(cur):
+    """Recompute trip_profiles and trip_profiles_daily from all of taxi_trips inside the caller's transaction"""
+    cur.execute(CREATE_PROFILES_SQL)
+    cur.execute("TRUNCATE trip_profiles, trip_profiles_daily")
+    cur.execute("INSERT INTO trip_profiles_daily " + PROFILE_AGGREGATE_SQL.format(
+        bucket=DISTANCE_BUCKET_MILES,
+        max_bucket=MAX_DISTANCE_BUCKET,
+        where_clause="1=1"
+    ))
+    cur.execute(f"""
+    INSERT INTO trip_profiles
+    SELECT {PROFILE_KEY}, {", ".join(f"SUM({s})" for s in PROFILE_SUMS)}
+    FROM trip_profiles_daily
+    GROUP BY {PROFILE_KEY}
+    """)
+
+
+def rebuild_profiles():
+    conn = get_connection()
+    if conn is None:
+        return False
+    conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            rebuild_all_profiles(cur)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+# In-memory profile store: dense sums indexed by
+# [pickup borough, dropoff borough, hour, distance bucket, component]
+def build_profile_store():
+    profiles = execute_query("SELECT * FROM trip_profiles")
+    if profiles.empty:
+        return None
+
+    boroughs = sorted(set(profiles['pickup_borough']) | set(profiles['dropoff_borough']))
+    borough_index = {b: i for i, b in enumerate(boroughs)}
+
+    counts = np.zeros((len(boroughs), len(boroughs), 24, MAX_DISTANCE_BUCKET + 1), dtype=np.int64)
+    sums = np.zeros(counts.shape + (len(PROFILE_COMPONENTS),), dtype=np.float64)
+
+    p = profiles['pickup_borough'].map(borough_index).to_numpy()
+    d = profiles['dropoff_borough'].map(borough_index).to_numpy()
+    h = profiles['pickup_hour'].astype(int).to_numpy()
+    b = profiles['distance_bucket'].astype(int).to_numpy()
+    counts[p, d, h, b] = profiles['trip_count'].astype(np.int64).to_numpy()
+    sums[p, d, h, b] = profiles[[f"{c}_sum" for c in PROFILE_COMPONENTS]].astype(float).to_numpy()
+
+    return {'borough_index': borough_index, 'counts': counts, 'sums': sums}
+
+
+def publish_profile_store(dataset_version):
+    """Build the profile store once and share it with every app process on this host"""
+    store = build_profile_store()
+    if store is not None:
+        publish("trip_profiles", dataset_version,
+                arrays={'counts': store['counts'], 'sums': store['sums']},
+                meta={'boroughs': list(store['borough_index'])})
+    return store
+
+
+@st.cache_resource(show_spinner=False)
+def load_profile_store(dataset_version):
+    # Mapped read-only from the shared store when the refresher has published
+    # this version, otherwise built from trip_profiles by this process
+    snapshot = attach("trip_profiles")
+    if snapshot is not None and snapshot.version == dataset_version:
+        return {
+            'borough_index': {b: i for i, b in enumerate(snapshot.meta['boroughs'])},
+            'counts': snapshot.arrays['counts'],
+            'sums': snapshot.arrays['sums']
+        }
+    return build_profile_store()
+
+
+def similar_trip_profile(pickup_borough, dropoff_borough, time_range, trip_distance, window=1.0):
+    """Averages over trips within +/- window miles in the same boroughs and time range.
+
+    Returns None when the profile store hasn't been built, so callers can fall
+    back to scanning taxi_trips.
+    """
+    store = load_profile_store(get_dataset_version())
+    if store is None:
+        return None
+
+    empty = {'trip_count': 0}
+    p = store['borough_index'].get(pickup_borough)
+    d = store['borough_index'].get(dropoff_borough)
+    if p is None or d is None:
+        return empty
+
+    start_hour, end_hour = TIME_RANGE_HOURS[time_range]
+    # The last bucket holds every longer trip (up to the outliers), so it is
+    # only used for distances in that range
+    last = MAX_DISTANCE_BUCKET + 1 if trip_distance >= MAX_DISTANCE_BUCKET * DISTANCE_BUCKET_MILES else MAX_DISTANCE_BUCKET
+    lo = min(int(np.floor(max(0.0, trip_distance - window) / DISTANCE_BUCKET_MILES)), last - 1)
+    hi = int(np.ceil((trip_distance + window) / DISTANCE_BUCKET_MILES))
+    hi = min(max(hi, lo + 1), last)
+
+    trip_count = int(store['counts'][p, d, start_hour:end_hour + 1, lo:hi].sum())
+    if trip_count == 0:
+        return empty
+
+    sums = store['sums'][p, d, start_hour:end_hour + 1, lo:hi].sum(axis=(0, 1))
+    profile = {f"avg_{c}": sums[i] / trip_count for i, c in enumerate(PROFILE_COMPONENTS)}
+    profile['trip_count'] = trip_count
+    return profile
+
+
+# Whole-table averages only change with the data, so compute them once per version
+@st.cache_data(show_spinner=False)
+def get_overall_averages(dataset_version):
+    return execute_query("""
+    SELECT
+        AVG(total_amount) as overall_avg_total,
+        AVG(total_amount / NULLIF(trip_distance, 0)) as per_mile_avg
+    FROM
+        taxi_trips
+    WHERE
+        trip_distance > 0
+    """)
+
+
+if __name__ == "__main__":
+    if rebuild_profiles():
+        print("trip_profiles rebuilt")
+    else:
+        print("Could not connect to the database")
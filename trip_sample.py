@@ -0,0 +1,342 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from taxi_db import get_connection, execute_query, get_dataset_version, table_exists
+from shared_store import attach, publish
+from trip_schema import apply_trip_schema
+from taxi_queries import filter_where_clause
+
+# Stratified samples of taxi_trips for approximate answers (see the Custom
+# Trip Filter). Each level keeps every trip with a probability set per
+# pickup borough x hour x weekday stratum: the level's rate, raised so that
+# every stratum keeps at least MIN_STRATUM_ROWS trips. Staten Island and
+# late-night hours are never starved. Each row stores its weight, 1 / its
+# probability, i.e. the number of trips it stands for. The levels are nested:
+# every row of a smaller level is also in the larger ones.
+SAMPLE_LEVELS = [
+    ('trip_sample_0_1pct', 0.001),
+    ('trip_sample_1pct', 0.01),
+    ('trip_sample_10pct', 0.1),
+]
+MIN_STRATUM_ROWS = 50
+
+# Levels up to this rate are also published to the shared store and answered
+# from memory; larger ones are queried in Postgres
+IN_MEMORY_RATE = 0.01
+
+# Fewer matching sample rows than this and an estimate isn't worth showing
+MIN_SAMPLE_ROWS = 30
+Z_95 = 1.96
+DEFAULT_MAX_ERROR = 0.05
+
+_STRATUM_HOUR = "COALESCE(EXTRACT(HOUR FROM pickup_time::time)::smallint, -1)"
+_STRATUM_WEEKDAY = "COALESCE(EXTRACT(DOW FROM TO_DATE(pickup_date, 'YYYY-MM-DD'))::smallint, -1)"
+
+# Stratum sizes, fixed at each full rebuild; refreshed days are drawn with them
+STRATA_SQL = f"""
+DROP TABLE IF EXISTS trip_sample_strata;
+CREATE TABLE trip_sample_strata AS
+SELECT
+    COALESCE(pickup_borough, '') as stratum_borough,
+    {_STRATUM_HOUR} as stratum_hour,
+    {_STRATUM_WEEKDAY} as stratum_weekday,
+    COUNT(*) as trip_count
+FROM
+    taxi_trips
+GROUP BY
+    1, 2, 3
+"""
+
+# One random draw per trip for all levels; a trip is in a level when its
+# draw is below the level's probability for its stratum
+DRAW_SQL = f"""
+DROP TABLE IF EXISTS trip_sample_draw;
+CREATE TEMP TABLE trip_sample_draw ON COMMIT DROP AS
+SELECT t.*, s.trip_count as stratum_trips
+FROM (
+    SELECT *, {_STRATUM_HOUR} as stratum_hour, {_STRATUM_WEEKDAY} as stratum_weekday, random() as draw
+    FROM taxi_trips
+    WHERE {{where_clause}}
+    OFFSET 0
+) t
+LEFT JOIN trip_sample_strata s ON
+    s.stratum_borough = COALESCE(t.pickup_borough, '') AND
+    s.stratum_hour = t.stratum_hour AND
+    s.stratum_weekday = t.stratum_weekday
+WHERE
+    t.draw < {{probability}}
+"""
+
+# Columns the estimates are built from
+SUMMARY_AVERAGES = {
+    'avg_distance': 'trip_distance',
+    'avg_fare': 'fare_amount',
+    'avg_tip': 'tip_amount',
+    'avg_total': 'total_amount',
+}
+_SOURCES = list(SUMMARY_AVERAGES.values())
+_GROUPS = {'hour': 'stratum_hour'}
+
+
+def _probability(rate):
+    # Strata that appeared since the last full rebuild are kept whole
+    return f"""CASE WHEN stratum_trips IS NULL THEN 1.0
+        ELSE LEAST(1.0, GREATEST({rate}, {MIN_STRATUM_ROWS}.0 / stratum_trips)) END"""
+
+
+def _draw(cur, where_clause):
+    largest = max(rate for _, rate in SAMPLE_LEVELS)
+    cur.execute(DRAW_SQL.format(where_clause=where_clause, probability=_probability(largest)))
+
+
+def _days_condition(days):
+    day_list = "', '".join(days)
+    return f"pickup_date IN ('{day_list}')"
+
+
+def rebuild_samples(cur):
+    """Redraw every sample level from all of taxi_trips inside the caller's transaction"""
+    cur.execute(STRATA_SQL)
+    _draw(cur, "1=1")
+    for table, rate in SAMPLE_LEVELS:
+        cur.execute(f"""
+        DROP TABLE IF EXISTS {table};
+        CREATE TABLE {table} AS
+        SELECT *, 1.0 / ({_probability(rate)}) as weight
+        FROM trip_sample_draw
+        WHERE draw < {_probability(rate)};
+        CREATE INDEX ON {table} (pickup_date)
+        """)
+    cur.execute("DROP TABLE trip_sample_draw")
+
+
+def refresh_sample_days(cur, days):
+    """Redraw the sample rows of the given pickup dates inside the caller's transaction"""
+    if not days:
+        return
+    days_condition = _days_condition(days)
+    _draw(cur, days_condition)
+    for table, rate in SAMPLE_LEVELS:
+        cur.execute(f"DELETE FROM {table} WHERE {days_condition}")
+        cur.execute(f"""
+        INSERT INTO {table}
+        SELECT *, 1.0 / ({_probability(rate)}) as weight
+        FROM trip_sample_draw
+        WHERE draw < {_probability(rate)}
+        """)
+    cur.execute("DROP TABLE trip_sample_draw")
+
+
+def rebuild_all_samples():
+    conn = get_connection()
+    if conn is None:
+        return False
+    conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            rebuild_samples(cur)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+def publish_trip_samples(dataset_version):
+    """Share the in-memory sample levels with every app process on this host"""
+    for table, rate in SAMPLE_LEVELS:
+        if rate > IN_MEMORY_RATE or not table_exists(table):
+            continue
+        sample = execute_query(f"""
+        SELECT
+            pickup_date,
+            stratum_hour as hour,
+            trip_distance,
+            fare_amount,
+            tip_amount,
+            total_amount,
+            pickup_borough,
+            dropoff_borough,
+            weight
+        FROM
+            {table}
+        """)
+        if not sample.empty:
+            publish(f"trip_samples/{table}", dataset_version, frame=apply_trip_schema(sample))
+
+
+@st.cache_resource(show_spinner=False, max_entries=len(SAMPLE_LEVELS))
+def _load_sample(table, version):
+    snapshot = attach(f"trip_samples/{table}")
+    if snapshot is None or snapshot.version != version:
+        return None
+    return snapshot.table.to_pandas(split_blocks=True)
+
+
+def load_sample(table):
+    """A level's published rows, or None when it isn't held in memory.
+
+    A sample of an older dataset version is still used: estimates only have
+    to be close, and the exact answer follows.
+    """
+    snapshot = attach(f"trip_samples/{table}")
+    return _load_sample(table, snapshot.version) if snapshot is not None else None
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def available_levels(dataset_version):
+    """(table, rate) of the levels that have been built, smallest first"""
+    return [(table, rate) for table, rate in SAMPLE_LEVELS
+            if load_sample(table) is not None or table_exists(table)]
+
+
+def filter_sample(sample, start_date, end_date, distance_min, distance_max,
+                  pickup_boroughs=(), dropoff_boroughs=()):
+    """Sample rows matching the same filters as taxi_queries.filter_where_clause"""
+    mask = sample['pickup_datetime'].between(pd.Timestamp(start_date), pd.Timestamp(end_date))
+    mask &= sample['trip_distance'].between(distance_min, distance_max)
+    if pickup_boroughs:
+        mask &= sample['pickup_borough'].isin(pickup_boroughs)
+    if dropoff_boroughs:
+        mask &= sample['dropoff_borough'].isin(dropoff_boroughs)
+    return sample[mask.to_numpy()]
+
+
+# Horvitz-Thompson estimates: a row of weight w was kept with probability
+# 1/w, so a total is sum(w * x), with variance sum(w * (w - 1) * x^2). Both
+# sources reduce the matching rows to these sums, per group if asked:
+#   w, v            sum(w), sum(w (w - 1))
+#   <x>_w           sum(w) over rows where x is known
+#   <x>_wx          sum(w x)
+#   <x>_v0/v1/v2    sum(w (w - 1) x^k) over rows where x is known
+
+def _frame_stats(rows, by=None):
+    weights = rows['weight'].to_numpy(dtype=float)
+    variance = weights * (weights - 1)
+    sums = {'sample_rows': np.ones_like(weights), 'w': weights, 'v': variance}
+    for source in _SOURCES:
+        values = rows[source].to_numpy(dtype=float)
+        known = ~np.isnan(values)
+        values = np.where(known, values, 0.0)
+        sums[f"{source}_w"] = weights * known
+        sums[f"{source}_wx"] = weights * values
+        sums[f"{source}_v0"] = variance * known
+        sums[f"{source}_v1"] = variance * values
+        sums[f"{source}_v2"] = variance * values ** 2
+    sums = pd.DataFrame(sums)
+    if by is None:
+        return sums.sum().to_frame().T
+    sums[by] = rows[by].to_numpy()
+    return sums.groupby(by, sort=True).sum().reset_index()
+
+
+def _stats_query(table, where_clause, by=None):
+    sums = ["COUNT(*) as sample_rows", "SUM(weight) as w", "SUM(weight * (weight - 1)) as v"]
+    for source in _SOURCES:
+        known = f"CASE WHEN {source} IS NOT NULL THEN weight END"
+        sums += [
+            f"SUM({known}) as {source}_w",
+            f"SUM(weight * {source}) as {source}_wx",
+            f"SUM(({known}) * (weight - 1)) as {source}_v0",
+            f"SUM(weight * (weight - 1) * {source}) as {source}_v1",
+            f"SUM(weight * (weight - 1) * {source} * {source}) as {source}_v2",
+        ]
+    group = f"{_GROUPS[by]} as {by}, " if by else ""
+    return f"""
+    SELECT
+        {group}{", ".join(sums)}
+    FROM
+        {table}
+    WHERE
+        {where_clause}
+    {f"GROUP BY {_GROUPS[by]} ORDER BY 1" if by else ""}
+    """
+
+
+def _estimates(stats, by=None):
+    stats = stats.fillna(0)
+    estimates = pd.DataFrame({'sample_rows': stats['sample_rows'].astype(int)})
+    if by is not None:
+        estimates.insert(0, by, stats[by])
+    estimates['trip_count'] = stats['w']
+    estimates['trip_count_error'] = Z_95 * np.sqrt(stats['v'])
+    for column, source in SUMMARY_AVERAGES.items():
+        known = stats[f"{source}_w"].where(stats[f"{source}_w"] > 0)
+        mean = stats[f"{source}_wx"] / known
+        variance = (stats[f"{source}_v2"] - 2 * mean * stats[f"{source}_v1"]
+                    + mean ** 2 * stats[f"{source}_v0"]) / known ** 2
+        estimates[column] = mean
+        estimates[f"{column}_error"] = Z_95 * np.sqrt(variance.clip(lower=0))
+    estimates['total_revenue'] = stats['total_amount_wx']
+    estimates['total_revenue_error'] = Z_95 * np.sqrt(stats['total_amount_v2'])
+    return estimates
+
+
+def sample_estimate(table, filters, by=None):
+    """Estimated filtered_summary columns from one sample level, with <column>_error
+    95% half-widths; one row per value of by ('hour') if given.
+
+    filters are filter_where_clause's arguments.
+    """
+    sample = load_sample(table)
+    if sample is not None:
+        stats = _frame_stats(filter_sample(sample, *filters), by)
+    else:
+        stats = execute_query(_stats_query(table, filter_where_clause(*filters), by))
+        if stats.empty:
+            return None
+    estimates = _estimates(stats, by)
+    if by == 'hour':
+        # Trips without a pickup time
+        estimates = estimates[estimates['hour'] >= 0].reset_index(drop=True)
+    return estimates
+
+
+def relative_error(estimate):
+    """Largest 95% half-width of the trip count and average total, relative to the estimate"""
+    row = estimate.iloc[0]
+    if row['sample_rows'] < MIN_SAMPLE_ROWS or row['trip_count'] <= 0 or not row['avg_total']:
+        return np.inf
+    return max(row['trip_count_error'] / row['trip_count'], row['avg_total_error'] / abs(row['avg_total']))
+
+
+def route_estimate(filters, max_error=DEFAULT_MAX_ERROR):
+    """(sample table, summary estimate) from the smallest sample level whose relative
+    error is within max_error, or (None, None) when no level is.
+
+    After a level misses, the ones whose expected error (shrinking with the
+    square root of the rate) would still miss are skipped.
+    """
+    tried = None
+    for table, rate in available_levels(get_dataset_version()):
+        if tried is not None:
+            tried_rate, tried_rows, tried_error = tried
+            expected_rows = tried_rows * rate / tried_rate
+            if tried_rows > 0 and expected_rows < MIN_SAMPLE_ROWS:
+                continue
+            if np.isfinite(tried_error) and tried_error * np.sqrt(tried_rate / rate) > max_error:
+                continue
+        estimate = sample_estimate(table, filters)
+        if estimate is None:
+            continue
+        error = relative_error(estimate)
+        if error <= max_error:
+            return table, estimate
+        tried = (rate, int(estimate['sample_rows'].iloc[0]), error)
+    return None, None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Redraw the stratified trip samples and publish the in-memory levels")
+    parser.parse_args()
+
+    if not rebuild_all_samples():
+        print("Could not connect to the database")
+    else:
+        publish_trip_samples(get_dataset_version())
+        for table, rate in SAMPLE_LEVELS:
+            size = execute_query(f"SELECT COUNT(*) as sample_rows, SUM(weight) as trips FROM {table}")
+            print(f"{table:<20} {rate:>6.1%}  {int(size['sample_rows'].iloc[0]):>10,} rows "
+                  f"standing for {float(size['trips'].iloc[0] or 0):,.0f} trips")
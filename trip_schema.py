@@ -0,0 +1,112 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from taxi_db import execute_query
+from taxi_zones import ZONES_PATH, load_zone_dictionary
+
+# Declared in-memory types for trip columns. Frames are converted once when
+# they're fetched, before they're cached or handed to the app.
+BOROUGH_COLUMNS = ['pickup_borough', 'dropoff_borough', 'borough']
+ZONE_COLUMNS = ['pickup_zone', 'dropoff_zone', 'zone']
+MONEY_COLUMNS = [
+    'fare_amount', 'tip_amount', 'total_amount', 'extra', 'mta_tax', 'tolls_amount',
+    'improvement_surcharge', 'congestion_surcharge', 'airport_fee'
+]
+DISTANCE_COLUMNS = ['trip_distance']
+# Split text date and time columns -> one datetime64 column
+TIMESTAMP_COLUMNS = {
+    'pickup_datetime': ('pickup_date', 'pickup_time'),
+    'dropoff_datetime': ('dropoff_date', 'dropoff_time'),
+}
+
+BOROUGHS = ["Bronx", "Brooklyn", "EWR", "Manhattan", "Queens", "Staten Island", "Unknown"]
+
+_dtypes = None
+_dtypes_mtime = None
+_dtypes_lock = threading.Lock()
+
+
+def category_dtypes():
+    """(borough dtype, zone dtype) with categories from the zone dictionary, per process"""
+    global _dtypes, _dtypes_mtime
+    mtime = os.path.getmtime(ZONES_PATH) if os.path.exists(ZONES_PATH) else None
+    with _dtypes_lock:
+        if _dtypes is None or _dtypes_mtime != mtime:
+            zones = load_zone_dictionary()
+            boroughs = BOROUGHS + sorted(set(zones['borough']) - set(BOROUGHS) - {''})
+            _dtypes = (pd.CategoricalDtype(boroughs), pd.CategoricalDtype(zones['zone'].tolist()))
+            _dtypes_mtime = mtime
+        return _dtypes
+
+
+def _categorical(values, dtype):
+    # Values the dictionary doesn't know yet (or '') are added rather than lost
+    values = values.astype(object).where(values.notna(), None)
+    extra = sorted(set(values.dropna()) - set(dtype.categories))
+    if extra:
+        dtype = pd.CategoricalDtype(list(dtype.categories) + extra)
+    return values.astype(dtype)
+
+
+def apply_trip_schema(df):
+    """df with its trip columns converted to the compact dtypes; other columns are untouched"""
+    if df is None or not isinstance(df, pd.DataFrame) or df.empty:
+        return df
+    df = df.copy()
+    borough_dtype, zone_dtype = category_dtypes()
+
+    for columns, dtype in [(BOROUGH_COLUMNS, borough_dtype), (ZONE_COLUMNS, zone_dtype)]:
+        for column in columns:
+            if column in df and not pd.api.types.is_numeric_dtype(df[column]):
+                df[column] = _categorical(df[column], dtype)
+
+    for column in MONEY_COLUMNS + DISTANCE_COLUMNS:
+        if column in df and pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = df[column].astype(np.float32)
+
+    for combined, (date_column, time_column) in TIMESTAMP_COLUMNS.items():
+        if date_column not in df:
+            continue
+        text = df[date_column].astype(str)
+        if time_column in df:
+            text = text + " " + df[time_column].astype(str)
+        position = df.columns.get_loc(date_column)
+        timestamps = pd.to_datetime(text, format='ISO8601', errors='coerce')
+        df = df.drop(columns=[c for c in (date_column, time_column) if c in df])
+        df.insert(position, combined, timestamps)
+    return df
+
+
+def memory_report(before, after):
+    """Per-column bytes before and after apply_trip_schema, with a TOTAL row"""
+    before_bytes = before.memory_usage(deep=True, index=False)
+    after_bytes = after.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        'before': before_bytes,
+        'after': after_bytes.reindex(before_bytes.index)
+    })
+    # Combined timestamp columns replace their date and time columns
+    for combined, parts in TIMESTAMP_COLUMNS.items():
+        if combined in after_bytes:
+            report.loc[parts[0], 'after'] = after_bytes[combined]
+            if parts[1] in report.index:
+                report.loc[parts[1], 'after'] = 0
+    report = report.fillna(0).astype(int)
+    report.loc['TOTAL'] = report.sum()
+    report['ratio'] = (report['before'] / report['after'].where(report['after'] > 0)).round(1)
+    return report
+
+
+if __name__ == "__main__":
+    sample = execute_query("SELECT * FROM taxi_trips LIMIT 10000")
+    if sample.empty:
+        print("No trips to measure")
+    else:
+        report = memory_report(sample, apply_trip_schema(sample))
+        print(report.to_string())
+        total = report.loc['TOTAL']
+        print(f"\n{len(sample):,} trips: {total['before'] / 1e6:.2f} MB -> {total['after'] / 1e6:.2f} MB "
+              f"({total['ratio']}x smaller)")
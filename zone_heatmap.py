@@ -0,0 +1,183 @@
+import os
+import threading
+
+import numpy as np
+
+from taxi_db import DATA_DIR, get_connection
+from taxi_zones import (HOURS_PER_WEEK, PICKUP_DOW_SQL, PICKUP_HOUR_SQL,
+                        cursor_frame, load_zone_dictionary, refresh_rollup_days, update_zone_dictionary, zone_index)
+
+MATRIX_PATH = os.path.join(DATA_DIR, "zone_hour_matrix.npy")
+
+# Metrics along the last axis of the matrix
+METRICS = ['trip_count', 'avg_total', 'avg_tip', 'trips_per_hour']
+METRIC_LABELS = {
+    'trip_count': 'Trip Count',
+    'avg_total': 'Avg Total ($)',
+    'avg_tip': 'Avg Tip ($)',
+    'trips_per_hour': 'Trips per Hour'
+}
+
+
+# Per-(zone, weekday, hour) sums behind the matrix, kept per pickup_date too
+# so the refresher only recomputes the days that changed
+ZONE_HOUR_ROLLUP = "zone_hour_cells"
+ZONE_HOUR_KEY = "pickup_zone, dow, hour"
+ZONE_HOUR_SUMS = ['trip_count', 'total_sum', 'tip_sum']
+ZONE_HOUR_COLUMNS = """
+    pickup_zone TEXT NOT NULL,
+    dow SMALLINT NOT NULL,
+    hour SMALLINT NOT NULL,
+    trip_count BIGINT NOT NULL,
+    total_sum DOUBLE PRECISION NOT NULL,
+    tip_sum DOUBLE PRECISION NOT NULL
+"""
+
+# Aggregate trips into daily cells; {where_clause} limits the days
+ZONE_HOUR_AGGREGATE_SQL = f"""
+SELECT
+    pickup_date,
+    pickup_zone,
+    {PICKUP_DOW_SQL} as dow,
+    {PICKUP_HOUR_SQL} as hour,
+    COUNT(*) as trip_count,
+    COALESCE(SUM(total_amount), 0) as total_sum,
+    COALESCE(SUM(tip_amount), 0) as tip_sum
+FROM
+    taxi_trips
+WHERE
+    pickup_zone != '' AND
+    pickup_date IS NOT NULL AND
+    pickup_time IS NOT NULL AND
+    {{where_clause}}
+GROUP BY
+    1, 2, 3, 4
+"""
+
+
+def refresh_zone_hour_matrix(cur, days=None, path=MATRIX_PATH):
+    """Recompute the zone-hour cells of the given pickup dates (every date when
+    days is None) inside the caller's transaction, and rewrite the matrix file
+    as a dense zones x 168 weekly hours x metrics float32 array"""
+    zones = update_zone_dictionary(days)
+    if zones.empty:
+        return None
+    refresh_rollup_days(cur, ZONE_HOUR_ROLLUP, ZONE_HOUR_COLUMNS, ZONE_HOUR_KEY, ZONE_HOUR_SUMS,
+                        ZONE_HOUR_AGGREGATE_SQL, days)
+    index = zone_index(zones)
+
+    cells = cursor_frame(cur, f"SELECT * FROM {ZONE_HOUR_ROLLUP}")
+    # How many of each weekday the data covers, to turn counts into trips/hour
+    day_counts = cursor_frame(cur, f"""
+    SELECT
+        {PICKUP_DOW_SQL} as dow,
+        COUNT(*) as n_days
+    FROM
+        {ZONE_HOUR_ROLLUP}_days
+    GROUP BY
+        1
+    """)
+
+    matrix = np.zeros((len(zones), HOURS_PER_WEEK, len(METRICS)), dtype=np.float32)
+    if not cells.empty:
+        n_days = np.ones(7)
+        n_days[day_counts['dow'].astype(int).to_numpy()] = day_counts['n_days'].astype(float).to_numpy()
+
+        z = cells['pickup_zone'].map(index).to_numpy()
+        dow = cells['dow'].astype(int).to_numpy()
+        how = dow * 24 + cells['hour'].astype(int).to_numpy()
+        count = cells['trip_count'].astype(float).to_numpy()
+        matrix[z, how, 0] = count
+        matrix[z, how, 1] = cells['total_sum'].astype(float).to_numpy() / count
+        matrix[z, how, 2] = cells['tip_sum'].astype(float).to_numpy() / count
+        matrix[z, how, 3] = count / n_days[dow]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so readers never map a half-written file
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, matrix)
+    os.replace(tmp_path, path)
+    return matrix
+
+
+def build_zone_hour_matrix(path=MATRIX_PATH):
+    """Aggregate all of taxi_trips into the zone-hour cells and matrix file"""
+    conn = get_connection()
+    if conn is None:
+        return None
+    conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            matrix = refresh_zone_hour_matrix(cur, None, path)
+        conn.commit()
+        return matrix
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+# Memory-mapped once per process; remapped when the file is rebuilt
+_matrix = None
+_matrix_mtime = None
+_matrix_lock = threading.Lock()
+
+
+def load_zone_hour_matrix(path=MATRIX_PATH):
+    """(zones dictionary, read-only matrix) or (None, None) if it hasn't been built"""
+    global _matrix, _matrix_mtime
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None, None
+    with _matrix_lock:
+        if _matrix is None or _matrix_mtime != mtime:
+            _matrix = np.load(path, mmap_mode='r')
+            _matrix_mtime = mtime
+        matrix = _matrix
+    zones = load_zone_dictionary()
+    return zones.iloc[:matrix.shape[0]], matrix
+
+
+def aggregate_hours(matrix, hours):
+    """Collapse a set of weekly hours into per-zone trip count, avg total, avg tip, trips/hour"""
+    cells = np.asarray(matrix[:, hours, :], dtype=np.float64)
+    counts = cells[:, :, 0]
+    total_count = counts.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_total = (cells[:, :, 1] * counts).sum(axis=1) / total_count
+        avg_tip = (cells[:, :, 2] * counts).sum(axis=1) / total_count
+    trips_per_hour = cells[:, :, 3].mean(axis=1)
+    return np.stack([total_count, avg_total, avg_tip, trips_per_hour], axis=1)
+
+
+def top_zones(matrix, zones, hours, metric='avg_total', k=10, borough=None, min_trips=1):
+    """Top-k zones by a metric over the given weekly hours, without touching the database"""
+    values = aggregate_hours(matrix, hours)
+    mask = values[:, 0] >= min_trips
+    if borough and borough != "All":
+        mask &= (zones['borough'].to_numpy() == borough)
+
+    candidates = np.flatnonzero(mask)
+    if len(candidates) == 0:
+        return zones.iloc[[]].assign(**{m: [] for m in METRICS})
+
+    scores = values[candidates, METRICS.index(metric)]
+    k = min(k, len(candidates))
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    chosen = candidates[best]
+
+    result = zones.iloc[chosen].reset_index(drop=True)
+    for i, m in enumerate(METRICS):
+        result[m] = values[chosen, i]
+    return result
+
+
+if __name__ == "__main__":
+    matrix = build_zone_hour_matrix()
+    if matrix is None:
+        print("No zones found in taxi_trips")
+    else:
+        print(f"Saved {matrix.shape} zone-hour matrix to {MATRIX_PATH}")
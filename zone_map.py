@@ -0,0 +1,258 @@
+import json
+import os
+import threading
+
+import numpy as np
+import streamlit.components.v1 as components
+from plotly.offline import get_plotlyjs
+
+from taxi_db import DATA_DIR
+
+# TLC taxi zone boundaries as GeoJSON (WGS84) with "zone" and "borough" properties
+SOURCE_GEOJSON = os.path.join(DATA_DIR, "taxi_zones.geojson")
+
+# Pre-simplified geometries are written here and served by Streamlit's static
+# file serving (see .streamlit/config.toml), so browsers fetch and cache them
+# once instead of receiving the polygons with every rerun
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_URL = "/app/static"
+
+# Simplification tolerance (degrees) per zoom level: the whole city, or one borough
+DETAIL_LEVELS = {
+    "Citywide": 0.0015,
+    "Borough": 0.0004,
+}
+
+# plotly.js from the installed plotly package, written next to the geometries
+# so the map doesn't depend on a CDN
+PLOTLY_JS_FILE = "plotly.min.js"
+PLOTLY_JS = f"{STATIC_URL}/{PLOTLY_JS_FILE}"
+
+
+def geometry_filename(level):
+    return f"zone_geometry_{level.lower()}.json"
+
+
+def _douglas_peucker(points, tolerance):
+    """Indices of points kept by Douglas-Peucker (endpoints always kept)"""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = points[start], points[end]
+        segment = points[start + 1:end]
+        ab = b - a
+        length = np.hypot(ab[0], ab[1])
+        if length == 0:
+            dist = np.hypot(segment[:, 0] - a[0], segment[:, 1] - a[1])
+        else:
+            dist = np.abs(ab[0] * (segment[:, 1] - a[1]) - ab[1] * (segment[:, 0] - a[0])) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+    return np.flatnonzero(keep)
+
+
+def _rings(geometry):
+    """(feature-local polygon index, ring index, coordinates) for every ring"""
+    polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+    for p, polygon in enumerate(polygons):
+        for r, ring in enumerate(polygon):
+            yield p, r, np.round(np.asarray(ring, dtype=np.float64), 7)
+
+
+def simplify_topology(features, tolerance):
+    """Simplify zone polygons without opening gaps between neighbours.
+
+    Rings are cut into arcs wherever the set of rings sharing a vertex
+    changes. Shared borders therefore become identical arcs, each arc is
+    simplified once (in a canonical direction) and every zone that uses it
+    gets the same result.
+    """
+    rings = []
+    owners = {}
+    for f, feature in enumerate(features):
+        for p, r, coords in _rings(feature['geometry']):
+            ring_id = len(rings)
+            rings.append((f, p, r, coords))
+            for point in map(tuple, coords[:-1]):
+                owners.setdefault(point, set()).add(ring_id)
+
+    arc_cache = {}
+    simplified = [dict(feature, geometry=None) for feature in features]
+    shapes = [{} for _ in features]
+    for ring_id, (f, p, r, coords) in enumerate(rings):
+        points = coords[:-1]
+        n = len(points)
+        if n < 4:
+            shapes[f].setdefault(p, {})[r] = coords.tolist()
+            continue
+
+        sharing = [frozenset(owners[tuple(pt)]) for pt in points]
+        fixed = [i for i in range(n)
+                 if sharing[i] != sharing[i - 1] or sharing[i] != sharing[(i + 1) % n] or len(sharing[i]) > 2]
+        if not fixed:
+            # Island ring: anchor on the first point and the point farthest from it
+            far = int(np.argmax(np.hypot(*(points - points[0]).T)))
+            fixed = sorted({0, far})
+
+        out = []
+        for k, start in enumerate(fixed):
+            end = fixed[(k + 1) % len(fixed)]
+            idx = np.arange(start, end + 1) if end > start else np.r_[np.arange(start, n), np.arange(0, end + 1)]
+            arc = points[idx]
+            forward = tuple(map(tuple, arc))
+            backward = forward[::-1]
+            key = min(forward, backward)
+            if key not in arc_cache:
+                kept = _douglas_peucker(np.asarray(key), tolerance)
+                arc_cache[key] = np.asarray(key)[kept]
+            arc_points = arc_cache[key] if key == forward else arc_cache[key][::-1]
+            out.extend(arc_points[:-1].tolist())
+
+        if len(out) < 3:
+            out = points[_douglas_peucker(points, tolerance)].tolist()
+        out.append(out[0])
+        shapes[f].setdefault(p, {})[r] = out
+
+    for f, feature in enumerate(simplified):
+        polygons = [[shapes[f][p][r] for r in sorted(shapes[f][p])] for p in sorted(shapes[f])]
+        feature['geometry'] = {'type': 'MultiPolygon', 'coordinates': polygons}
+    return simplified
+
+
+def build_zone_geometries(source=SOURCE_GEOJSON):
+    """Write one simplified GeoJSON per detail level into the static folder"""
+    with open(source) as f:
+        collection = json.load(f)
+
+    features = []
+    for feature in collection['features']:
+        props = feature.get('properties', {})
+        zone = props.get('zone') or props.get('Zone')
+        if not zone or not feature.get('geometry'):
+            continue
+        features.append({
+            'type': 'Feature',
+            'id': zone,
+            'properties': {'zone': zone, 'borough': props.get('borough') or props.get('Borough', '')},
+            'geometry': feature['geometry']
+        })
+
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    written = []
+    for level, tolerance in DETAIL_LEVELS.items():
+        simplified = simplify_topology(features, tolerance)
+        path = os.path.join(STATIC_DIR, geometry_filename(level))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': simplified}, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        written.append(path)
+
+    path = os.path.join(STATIC_DIR, PLOTLY_JS_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(get_plotlyjs())
+    os.replace(tmp_path, path)
+    written.append(path)
+    return written
+
+
+# zone_centroids per (source, mtime); the GeoJSON is large and rarely changes
+_centroids = {}
+_centroids_lock = threading.Lock()
+
+
+def zone_centroids(source=SOURCE_GEOJSON):
+    """{zone: (lon, lat)} from the source GeoJSON, or {} if it isn't there.
+
+    Vertex mean of each zone's outer rings; close enough for matching points
+    to nearby zones. Parsed once per version of the file.
+    """
+    try:
+        mtime = os.path.getmtime(source)
+    except OSError:
+        return {}
+    with _centroids_lock:
+        cached = _centroids.get(source)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    with open(source) as f:
+        collection = json.load(f)
+    centroids = {}
+    for feature in collection['features']:
+        props = feature.get('properties', {})
+        zone = props.get('zone') or props.get('Zone')
+        if not zone or not feature.get('geometry'):
+            continue
+        outer = [coords[:-1] for _, r, coords in _rings(feature['geometry']) if r == 0]
+        points = np.concatenate(outer)
+        centroids[zone] = tuple(points.mean(axis=0))
+    with _centroids_lock:
+        _centroids[source] = (mtime, centroids)
+    return centroids
+
+
+def geometries_built(level="Citywide"):
+    return all(os.path.exists(os.path.join(STATIC_DIR, name)) for name in (geometry_filename(level), PLOTLY_JS_FILE))
+
+
+_MAP_TEMPLATE = """
+<div id="zone-map" style="height: {height}px;"></div>
+<script src="{plotly_js}"></script>
+<script>
+  // Geometry is a static file the browser caches; only the metric vectors are inlined
+  const metrics = {metrics};
+  fetch("{geometry_url}", {{cache: "force-cache"}})
+    .then(r => r.json())
+    .then(geojson => {{
+      Plotly.newPlot("zone-map", [{{
+        type: "choropleth",
+        geojson: geojson,
+        featureidkey: "properties.zone",
+        locations: metrics.zones,
+        z: metrics.values,
+        colorscale: "Viridis",
+        marker: {{line: {{width: 0.3, color: "#ffffff"}}}},
+        colorbar: {{title: {{text: metrics.label}}}},
+        hovertemplate: "%{{location}}<br>%{{z:.2f}}<extra></extra>"
+      }}], {{
+        geo: {{fitbounds: "locations", visible: false}},
+        margin: {{l: 0, r: 0, t: 0, b: 0}}
+      }}, {{responsive: true, displaylogo: false}});
+    }});
+</script>
+"""
+
+
+def render_zone_map(zones, values, label, level="Citywide", height=550):
+    """Choropleth of one value per zone; sends only zone names and values per rerun"""
+    values = np.asarray(values, dtype=np.float64)
+    metrics = {
+        'zones': list(zones),
+        'values': [None if not np.isfinite(v) else round(float(v), 4) for v in values],
+        'label': label
+    }
+    html = _MAP_TEMPLATE.format(
+        height=height,
+        plotly_js=PLOTLY_JS,
+        # Zone names are data; keep them from closing the script element
+        metrics=json.dumps(metrics).replace("</", "<\\/"),
+        geometry_url=f"{STATIC_URL}/{geometry_filename(level)}"
+    )
+    components.html(html, height=height + 10)
+
+
+if __name__ == "__main__":
+    if not os.path.exists(SOURCE_GEOJSON):
+        print(f"Place the TLC taxi zone GeoJSON at {SOURCE_GEOJSON} first")
+    else:
+        for path in build_zone_geometries():
+            print(f"Wrote {path} ({os.path.getsize(path) / 1024:.0f} KB)")